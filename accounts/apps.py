@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+    
+    def ready(self):
+        # Registers the signals that publish blacklisted refresh tokens and
+        # drop deleted users from the authentication cache
+        from . import authentication, blacklist  # noqa: F401
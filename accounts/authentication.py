@@ -0,0 +1,116 @@
+from django.core.cache import cache
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from utils.utils import is_shared_cache
+
+# Longest time a user is cached when the cache is per process: other
+# processes never see the invalidation, so changes (a deactivated user)
+# take up to this long to apply everywhere
+LOCAL_USER_CACHE_TTL = 5
+
+# User fields never written to the cache, which may be shared with other
+# services; they stay deferred on cached users and load on first access
+UNCACHED_USER_FIELDS = ("password",)
+
+
+def user_cache_key(user_id):
+    """Cache key under which an authenticated user's fields are stored."""
+    return f"accounts:user:{user_id}"
+
+
+def invalidate_cached_user(user_id):
+    """Drop a cached user so the next request reloads it from the database."""
+    cache.delete(user_cache_key(user_id))
+
+
+def invalidate_cached_users(user_ids):
+    """Drop several cached users (see invalidate_cached_user)."""
+    if user_ids:
+        cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+def get_user_cache_ttl():
+    """
+    Return the seconds a user is cached: USER_CACHE_TTL with a shared
+    cache, at most LOCAL_USER_CACHE_TTL with a per-process one.
+    """
+    ttl = getattr(settings, "USER_CACHE_TTL", 60)
+    return ttl if is_shared_cache() else min(ttl, LOCAL_USER_CACHE_TTL)
+
+
+def get_cached_user_fields(User):
+    """Return the attribute names of User that are kept in the cache."""
+    return [
+        field.attname
+        for field in User._meta.concrete_fields
+        if field.attname not in UNCACHED_USER_FIELDS
+    ]
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _invalidate_deleted_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that avoids a database query on every request.
+    
+    The signed claims added by accounts.tokens.get_tokens_for_user (id,
+    is_active, is_superuser, name) are trusted to reject inactive users
+    without touching the database. The user's fields, except the password
+    hash, are kept in the cache (see get_user_cache_ttl) and are
+    invalidated on User.save,
+    QuerySet.update and delete, so repeated calls to read-only endpoints
+    such as ProfileView need no queries. Invalidation only reaches other
+    processes through a shared cache.
+    """
+    
+    def get_user(self, validated_token):
+        """
+        Resolve the user for a validated token, preferring the cache.
+        
+        Args:
+            validated_token: Token that passed signature and expiry checks
+            
+        Returns:
+            User: The authenticated user
+            
+        Raises:
+            InvalidToken: If the token has no user id claim
+            AuthenticationFailed: If the user is missing or inactive
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+        
+        # Signed claim check, no database access needed
+        if api_settings.CHECK_USER_IS_ACTIVE and validated_token.get("is_active") is False:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        
+        User = get_user_model()
+        fields = get_cached_user_fields(User)
+        key = user_cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            try:
+                values = User.objects.values_list(*fields).get(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            cache.set(key, values, get_user_cache_ttl())
+        
+        # Uncached fields are deferred, so saving the user only writes the
+        # loaded fields and never blanks the password
+        user = User.from_db(DEFAULT_DB_ALIAS, fields, values)
+        
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        
+        return user
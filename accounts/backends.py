@@ -10,6 +10,10 @@ class PhoneAuthBackend(ModelBackend):
     
     This enables users to log in using either their email or phone number
     along with their password.
+    
+    It is meant to be the only entry in AUTHENTICATION_BACKENDS: each login
+    resolves the user with a single query on a unique (indexed) column and
+    runs exactly one password hash, whether or not the user exists.
     """
     
     def user_can_authenticate(self, user):
@@ -27,6 +31,27 @@ class PhoneAuthBackend(ModelBackend):
         """
         return True
     
+    def get_lookup(self, username):
+        """
+        Build the ORM lookup for an email address or phone number.
+        
+        Args:
+            username: Email address or phone number
+            
+        Returns:
+            dict: Lookup kwargs for a single unique column, or None if the
+            phone number cannot be normalized
+        """
+        # Check if username contains @ symbol (email)
+        if "@" in username:
+            return {"email": username}
+        
+        # Normalize the phone number format
+        try:
+            return {"phone_number": normalize_phone_number(username)}
+        except Exception:
+            return None
+    
     def authenticate(self, request, username=None, password=None, **kwargs):
         """
         Authenticate users by email or phone number.
@@ -40,31 +65,27 @@ class PhoneAuthBackend(ModelBackend):
         Returns:
             User: The authenticated user or None
         """
+        UserModel = get_user_model()
         if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
             return None
         
+        lookup = self.get_lookup(username)
         user = None
-        
-        # Check if username contains @ symbol (email)
-        if "@" in username:
-            # Try to find user by email
-            user = get_user_model().objects.filter(email=username).first()
-        else:
-            # Try to find user by phone number
+        if lookup is not None:
             try:
-                # Normalize the phone number format
-                try:
-                    normalize_phone = normalize_phone_number(username)
-                except:
-                    return None
-                    
-                # Find user with normalized phone number
-                user = get_user_model().objects.filter(phone_number=normalize_phone).first()
-            except ValueError:
-                return None
+                user = UserModel._default_manager.get(**lookup)
+            except UserModel.DoesNotExist:
+                pass
+        
+        if user is None:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user.
+            UserModel().set_password(password)
+            return None
 
-        # Verify password if user exists
-        if user and user.check_password(password):
+        # Verify password
+        if user.check_password(password) and self.user_can_authenticate(user):
             return user
-        else:
-            return None
\ No newline at end of file
+        return None
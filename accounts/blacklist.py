@@ -0,0 +1,126 @@
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from utils.utils import is_shared_cache
+
+# Blacklist change log in the cache: a sequence number, and one entry per
+# blacklisted JTI under the sequence number it was published with
+BLACKLIST_SEQUENCE_KEY = "accounts:blacklist:seq"
+BLACKLIST_ENTRY_KEY = "accounts:blacklist:jti:{}"
+
+# Seconds log entries are kept; processes further behind reload the whole set
+BLACKLIST_ENTRY_TIMEOUT = 24 * 60 * 60
+
+# Log entries a process catches up on before a full reload is cheaper
+MAX_DELTA = 1000
+
+_lock = threading.Lock()
+_state = {
+    "seq": None,          # Last log entry applied to the local set
+    "jtis": frozenset(),  # JTIs of blacklisted, not yet expired refresh tokens
+}
+
+
+def use_cached_blacklist():
+    """
+    Return True if blacklist checks may use the in-memory JTI set.
+
+    Requires BLACKLIST_IN_MEMORY and a cache shared by all processes: with
+    a per-process cache, a token blacklisted in one worker would stay
+    valid in every other one.
+    """
+    return settings.BLACKLIST_IN_MEMORY and is_shared_cache()
+
+
+def _load_blacklisted_jtis():
+    """Load JTIs of blacklisted tokens that could still pass signature checks."""
+    return frozenset(
+        BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+        .values_list("token__jti", flat=True)
+    )
+
+
+def publish_blacklisted_jti(jti):
+    """Append a blacklisted JTI to the shared change log."""
+    cache.add(BLACKLIST_SEQUENCE_KEY, 0, None)
+    try:
+        seq = cache.incr(BLACKLIST_SEQUENCE_KEY)
+    except ValueError:
+        # The cache lost the sequence; processes notice and reload
+        return
+    cache.set(BLACKLIST_ENTRY_KEY.format(seq), jti, BLACKLIST_ENTRY_TIMEOUT)
+    with _lock:
+        _state["jtis"] = _state["jtis"] | {jti}
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def _publish_on_blacklist(sender, instance, created, **kwargs):
+    # Covers every path that blacklists through the ORM (views, admin,
+    # RefreshToken.blacklist). Published after commit: a process that
+    # reloads from the database on seeing the new sequence number must
+    # find the row, or it would mark the entry applied without it.
+    if created and use_cached_blacklist():
+        jti = instance.token.jti
+        transaction.on_commit(lambda: publish_blacklisted_jti(jti))
+
+
+def get_blacklisted_jtis():
+    """
+    Return the in-memory set of blacklisted JTIs, applying new log entries.
+
+    Each call reads the shared sequence number (one cache round trip) and
+    fetches only the JTIs published since the last call. The whole set is
+    reloaded from the database on first use, when the process fell more
+    than MAX_DELTA entries behind, or when log entries were lost.
+
+    Returns:
+        frozenset: Blacklisted JTIs
+    """
+    seq = cache.get(BLACKLIST_SEQUENCE_KEY)
+    if seq is not None and seq == _state["seq"]:
+        return _state["jtis"]
+
+    with _lock:
+        local_seq = _state["seq"]
+        if seq is None or local_seq is None or seq < local_seq or seq - local_seq > MAX_DELTA:
+            if seq is None:
+                cache.add(BLACKLIST_SEQUENCE_KEY, 0, None)
+                seq = cache.get(BLACKLIST_SEQUENCE_KEY, 0)
+            _state["jtis"] = _load_blacklisted_jtis()
+        elif seq > local_seq:
+            keys = [BLACKLIST_ENTRY_KEY.format(number) for number in range(local_seq + 1, seq + 1)]
+            entries = cache.get_many(keys)
+            if len(entries) < len(keys):
+                _state["jtis"] = _load_blacklisted_jtis()
+            else:
+                _state["jtis"] = _state["jtis"] | frozenset(entries.values())
+        _state["seq"] = seq
+    return _state["jtis"]
+
+
+def is_blacklisted(jti):
+    """Check whether a refresh token JTI has been blacklisted."""
+    if not use_cached_blacklist():
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+    return jti in get_blacklisted_jtis()
+
+
+class CachedBlacklistRefreshToken(RefreshToken):
+    """
+    Refresh token whose blacklist check uses the in-memory JTI set instead
+    of querying the blacklist tables on every refresh (see
+    use_cached_blacklist for when the database is queried instead).
+    """
+
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if is_blacklisted(jti):
+            raise TokenError("Token is blacklisted")
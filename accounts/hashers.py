@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class FastPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Low-cost PBKDF2 hasher for load-testing environments.
+    
+    Enabled with PASSWORD_HASHER_PROFILE=fast, which settings only accept
+    with DEBUG on: as the preferred hasher it rehashes every password that
+    logs in, downgrading existing hashes. It uses its own algorithm name so
+    hashes it creates are never confused with production PBKDF2 hashes, and
+    the iteration count comes from PASSWORD_HASHER_FAST_ITERATIONS.
+    """
+    algorithm = "pbkdf2_sha256_fast"
+    
+    @property
+    def iterations(self):
+        return getattr(settings, "PASSWORD_HASHER_FAST_ITERATIONS", 1000)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+
+class Command(BaseCommand):
+    help = "Delete expired outstanding (and blacklisted) refresh tokens in batches."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Number of rows deleted per query")
+    
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        total = 0
+        
+        # Small batches keep each DELETE short so it does not lock the
+        # tables the refresh endpoint reads from.
+        while True:
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=now)
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            # Blacklist rows are removed by the ON DELETE CASCADE relation
+            OutstandingToken.objects.filter(id__in=ids).delete()
+            total += len(ids)
+        
+        self.stdout.write(self.style.SUCCESS(f"Deleted {total} expired tokens."))
@@ -4,12 +4,65 @@ from rest_framework.exceptions import ValidationError
 from django.utils import timezone
 import phonenumbers, random, string
 from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
 import uuid
+import re
+
+# Canonical Iranian mobile numbers as stored in the database, e.g. +989123456789
+CANONICAL_PHONE_PATTERN = re.compile(r"\+98(9\d{9})")
+
+# Mobile number pattern from the phonenumbers metadata for Iran (compiled lazily)
+_mobile_national_pattern = None
+
+
+def _get_mobile_national_pattern():
+    """
+    Compile the national mobile number pattern for Iran once, using the same
+    metadata phonenumbers uses for is_valid_number().
+    
+    Returns:
+        re.Pattern: Compiled national number pattern
+    """
+    global _mobile_national_pattern
+    if _mobile_national_pattern is None:
+        metadata = phonenumbers.PhoneMetadata.metadata_for_region("IR")
+        _mobile_national_pattern = re.compile(metadata.mobile.national_number_pattern)
+    return _mobile_national_pattern
+
 
 def normalize_phone_number(phone_number):
     """
     Normalizes phone numbers to international format with +98 prefix for Iran.
     
+    Numbers that are already in canonical form (+989XXXXXXXXX) are checked
+    against the mobile pattern directly, everything else goes through a
+    bounded LRU cache in front of the full phonenumbers parse.
+    
+    Args:
+        phone_number (str): Raw phone number in various formats
+        
+    Returns:
+        str: Normalized phone number in international format
+        
+    Raises:
+        ValidationError: If phone number format is invalid
+    """
+    # Fast path: already canonical numbers don't need parsing or formatting
+    # fullmatch: $ would also accept a trailing newline
+    match = CANONICAL_PHONE_PATTERN.fullmatch(phone_number)
+    if match and _get_mobile_national_pattern().fullmatch(match.group(1)):
+        return phone_number
+    
+    return _normalize_phone_number_cached(phone_number)
+
+
+def _normalize_phone_number_uncached(phone_number):
+    """
+    Normalizes phone numbers to international format with +98 prefix for Iran.
+    
+    This is the full (uncached) implementation used behind the LRU cache.
+    
     Args:
         phone_number (str): Raw phone number in various formats
         
@@ -49,11 +102,36 @@ def normalize_phone_number(phone_number):
         raise ValidationError({"error": "number is not valid."})
 
 
+# Invalid numbers raise and are never cached, so the cache only holds valid results
+_normalize_phone_number_cached = lru_cache(
+    maxsize=getattr(settings, "PHONE_NUMBER_CACHE_SIZE", 4096)
+)(_normalize_phone_number_uncached)
+
+
+class UserQuerySet(models.QuerySet):
+    """
+    User queryset that keeps CachedJWTAuthentication's cache consistent.
+    
+    update() bypasses User.save, so it drops the cached copies of the
+    updated users itself (deletes are handled by a post_delete receiver
+    in accounts.authentication).
+    """
+    def update(self, **kwargs):
+        from .authentication import invalidate_cached_users
+        user_ids = list(self.values_list("pk", flat=True))
+        rows = super().update(**kwargs)
+        invalidate_cached_users(user_ids)
+        return rows
+
+
 class UserManager(BaseUserManager):
     """
     Custom user manager for the User model.
     Handles user creation and validation.
     """
+    def get_queryset(self):
+        return UserQuerySet(self.model, using=self._db)
+    
     def create_user(self, phone_number, email, first_name, last_name, password=None, **extra_fields):
         """
         Creates and saves a new user with the given details.
@@ -133,6 +211,9 @@ class User(AbstractBaseUser):
     def save(self, *args, **kwargs):
         self.phone_number = normalize_phone_number(self.phone_number)
         super().save(*args, **kwargs)
+        # Drop the copy held by CachedJWTAuthentication
+        from .authentication import invalidate_cached_user
+        invalidate_cached_user(self.pk)
     
     def __str__(self):
         """String representation of the user"""
@@ -1,3 +1,109 @@
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from . import blacklist
+from .authentication import CachedJWTAuthentication, user_cache_key
+from .models import normalize_phone_number
 
-# Create your tests here.
+
+@mock.patch("accounts.blacklist.use_cached_blacklist", return_value=True)
+class BlacklistChangeLogTests(TestCase):
+    """The in-memory blacklist follows the change log in the cache."""
+
+    def setUp(self):
+        cache.clear()
+        blacklist._state.update(seq=None, jtis=frozenset())
+
+    def blacklist(self, jti):
+        token = OutstandingToken.objects.create(jti=jti, token=jti, expires_at=timezone.now() + timedelta(days=1))
+        BlacklistedToken.objects.create(token=token)
+
+    def forget_local_state(self, seq):
+        # What another process, last synced at `seq`, knows
+        blacklist._state.update(seq=seq, jtis=frozenset())
+
+    def test_published_after_commit(self, _):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.blacklist("a")
+            self.assertIsNone(cache.get(blacklist.BLACKLIST_SEQUENCE_KEY))
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(cache.get(blacklist.BLACKLIST_SEQUENCE_KEY), 1)
+
+    def test_other_processes_apply_new_entries_without_queries(self, _):
+        blacklist.get_blacklisted_jtis()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blacklist("a")
+        self.forget_local_state(0)
+        with self.assertNumQueries(0):
+            self.assertTrue(blacklist.is_blacklisted("a"))
+        self.assertFalse(blacklist.is_blacklisted("b"))
+
+    def test_lost_entries_reload_from_the_database(self, _):
+        blacklist.get_blacklisted_jtis()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blacklist("a")
+        cache.delete(blacklist.BLACKLIST_ENTRY_KEY.format(1))
+        self.forget_local_state(0)
+        self.assertTrue(blacklist.is_blacklisted("a"))
+        self.assertEqual(blacklist._state["seq"], 1)
+
+    def test_process_too_far_behind_reloads(self, _):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blacklist("a")
+        cache.set(blacklist.BLACKLIST_SEQUENCE_KEY, blacklist.MAX_DELTA + 5, None)
+        self.forget_local_state(1)
+        self.assertTrue(blacklist.is_blacklisted("a"))
+
+
+class NormalizePhoneNumberTests(TestCase):
+    """Canonical numbers take the fast path; anything else is parsed."""
+
+    def test_canonical_number_is_returned_as_is(self):
+        self.assertEqual(normalize_phone_number("+989123456789"), "+989123456789")
+
+    def test_other_formats_are_normalized(self):
+        self.assertEqual(normalize_phone_number("09123456789"), "+989123456789")
+
+    def test_trailing_newline_is_not_stored(self):
+        self.assertEqual(normalize_phone_number("+989123456789\n"), "+989123456789")
+
+    def test_invalid_number_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            normalize_phone_number("12345")
+
+
+@mock.patch("accounts.authentication.get_user_cache_ttl", return_value=60)
+class CachedJWTAuthenticationTests(TestCase):
+    """Users are served from the cache without their password hash."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(
+            phone_number="+989123456789", email="a@example.com", first_name="A", last_name="B", is_active=True,
+        )
+        self.user.set_password("secret")
+        self.user.save()
+        self.token = {"id": self.user.pk}
+
+    def test_repeated_requests_need_no_queries(self, _):
+        CachedJWTAuthentication().get_user(self.token)
+        with self.assertNumQueries(0):
+            user = CachedJWTAuthentication().get_user(self.token)
+        self.assertEqual(user.phone_number, "+989123456789")
+
+    def test_password_hash_is_not_cached(self, _):
+        CachedJWTAuthentication().get_user(self.token)
+        self.assertNotIn(self.user.password, cache.get(user_cache_key(self.user.pk)))
+
+    def test_saving_a_cached_user_keeps_the_password(self, _):
+        CachedJWTAuthentication().get_user(self.token)
+        user = CachedJWTAuthentication().get_user(self.token)
+        user.first_name = "C"
+        user.save()
+        self.assertTrue(get_user_model().objects.get(pk=self.user.pk).check_password("secret"))
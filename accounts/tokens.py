@@ -0,0 +1,22 @@
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+def get_tokens_for_user(user):
+    """
+    Create a refresh token (and its access token) carrying the claims that
+    CachedJWTAuthentication relies on.
+    
+    The claims are copied onto every access token derived from the refresh
+    token, including the ones issued by CustomTokenRefreshView.
+    
+    Args:
+        user: The user the tokens are issued for
+        
+    Returns:
+        RefreshToken: Refresh token with id, is_active, is_superuser and name claims
+    """
+    refresh = RefreshToken.for_user(user)
+    refresh["is_active"] = user.is_active
+    refresh["is_superuser"] = user.is_superuser
+    refresh["name"] = f"{user.first_name} {user.last_name}".strip()
+    return refresh
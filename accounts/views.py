@@ -15,6 +15,8 @@ from .serializers import (
     UpdatePhoneNumberSerializer,
 )
 from .models import OTPRequest, normalize_phone_number
+from .tokens import get_tokens_for_user
+from .blacklist import CachedBlacklistRefreshToken
 from utils.utils import send_otp, validate_phone_number
 from django.utils import timezone
 from datetime import timedelta
@@ -79,7 +81,7 @@ class LoginView(generics.GenericAPIView):
             send_otp(user.phone_number, otp_request.otp_code)
             return Response({"message": "OTP sent for activation."}, status=status.HTTP_400_BAD_REQUEST)
         
-        refresh = RefreshToken.for_user(user)
+        refresh = get_tokens_for_user(user)
         response = Response({
             "access_token": str(refresh.access_token),
         })
@@ -106,7 +108,8 @@ class CustomTokenRefreshView(APIView):
             return Response({"error": "No refresh token in"}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            refresh = RefreshToken(refresh_token)
+            # Blacklist membership is checked against the cached JTI set
+            refresh = CachedBlacklistRefreshToken(refresh_token)
             access_token = str(refresh.access_token)
             return Response({"access_token": access_token}, status=status.HTTP_200_OK)
         except Exception:
@@ -243,7 +246,7 @@ class VerifyOTPView(APIView):
             otp_request.is_verified = True
             user.save()
             otp_request.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = get_tokens_for_user(user)
             
             response =  Response({"message": "your account has been verified.", 'access_token': str(refresh.access_token)}, status=status.HTTP_200_OK)
             print("problem is here...")
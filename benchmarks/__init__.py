@@ -0,0 +1,46 @@
+"""
+Micro-benchmarks for the hot paths of the Push Notification Server.
+
+Each module can be run on its own, e.g.:
+
+    python -m benchmarks.phone_normalize
+
+Benchmarks use the project settings (and therefore the `.env` file), but
+never touch the network.
+"""
+import os
+import time
+import statistics
+
+
+def setup_django():
+    """Configure Django using the project settings so models can be imported."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+def measure(func, iterations=10000, repeat=5):
+    """
+    Time a callable and return per-call statistics.
+    
+    Args:
+        func: Zero-argument callable to benchmark
+        iterations: Number of calls per round
+        repeat: Number of rounds
+        
+    Returns:
+        dict: Best and median microseconds per call
+    """
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        rounds.append((time.perf_counter() - start) / iterations * 1e6)
+    return {"best_us": min(rounds), "median_us": statistics.median(rounds)}
+
+
+def report(name, stats):
+    """Print a single benchmark result line."""
+    print(f"{name:<48} best {stats['best_us']:>10.2f} us   median {stats['median_us']:>10.2f} us")
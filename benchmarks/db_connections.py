@@ -0,0 +1,46 @@
+"""
+Benchmark the per-request database cost of the auth and send endpoints with
+and without persistent connections.
+
+Each simulated request runs the request_started/request_finished connection
+handling Django performs around a view, plus the queries the view issues
+before doing any other work:
+
+- auth: user lookup by normalized phone number (LoginView)
+- send: admin token check (SendSingleNotificationView / SendGroupNotificationView)
+
+    python -m benchmarks.db_connections
+"""
+import uuid
+from benchmarks import setup_django, measure, report
+
+
+def main():
+    setup_django()
+    from django.db import close_old_connections, connection
+    from django.contrib.auth import get_user_model
+    from server.models import AdminToken
+
+    User = get_user_model()
+    token = uuid.uuid4()
+
+    def auth_request():
+        close_old_connections()
+        User.objects.filter(phone_number="+989123456789").first()
+        close_old_connections()
+
+    def send_request():
+        close_old_connections()
+        AdminToken.objects.filter(token=token).exists()
+        close_old_connections()
+
+    for max_age, label in ((0, "new connection per request"), (600, "persistent connection")):
+        connection.close()
+        connection.settings_dict["CONN_MAX_AGE"] = max_age
+        report(f"auth, {label}", measure(auth_request, iterations=200))
+        report(f"send, {label}", measure(send_request, iterations=200))
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark the CPU-bound part of a group send (payload encryption and VAPID
+headers) on 1..N processes. No requests are sent.
+
+    python -m benchmarks.fanout_scaling [recipients]
+"""
+import base64
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks import setup_django
+
+
+def make_subscriptions(count):
+    """Generate subscriptions with real P-256 keys and fake endpoints."""
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives import serialization
+
+    subscriptions = []
+    for index in range(count):
+        key = ec.generate_private_key(ec.SECP256R1())
+        public = key.public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+        )
+        subscriptions.append({
+            "endpoint": f"https://push.example.com/send/{index}",
+            "keys": {
+                "p256dh": base64.urlsafe_b64encode(public).decode().rstrip("="),
+                "auth": base64.urlsafe_b64encode(os.urandom(16)).decode().rstrip("="),
+            },
+        })
+    return subscriptions
+
+
+def encode_shard(subscriptions, payload):
+    """Do all per-recipient work of server.push.send_push except the HTTP request."""
+    from server import push
+
+    for record in subscriptions:
+        push.encode_push(record, payload)
+    return len(subscriptions)
+
+
+def run(subscriptions, payload, processes, shard_size=50):
+    import django
+
+    shards = [subscriptions[i:i + shard_size] for i in range(0, len(subscriptions), shard_size)]
+    # Spawned and set up like the server's send pools (see server.fanout.get_pool)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=django.setup) as pool:
+        # Warm up every process (imports, VAPID key parsing)
+        list(pool.map(encode_shard, shards[:processes], [payload] * processes))
+        start = time.perf_counter()
+        total = sum(pool.map(encode_shard, shards, [payload] * len(shards)))
+        return total / (time.perf_counter() - start)
+
+
+def main():
+    setup_django()
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    from server.records import load_records
+    subscriptions = load_records(make_subscriptions(count))
+    payload = '{"title": "Benchmark", "body": "' + "x" * 200 + '"}'
+
+    baseline = None
+    for processes in range(1, (os.cpu_count() or 1) + 1):
+        rate = run(subscriptions, payload, processes)
+        baseline = baseline or rate
+        print(f"{processes:>3} processes: {rate:>10.0f} recipients/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
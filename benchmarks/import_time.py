@@ -0,0 +1,58 @@
+"""
+Measure process startup: django.setup() alone, then importing the modules
+every process or every request loads. Each measurement runs in a fresh
+interpreter so nothing is cached between runs.
+
+    python -m benchmarks.import_time [rounds]
+
+Run with `python -X importtime -c "import server.push"` to see which
+third-party packages dominate a slow import.
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+TARGETS = (
+    ("django.setup()", ""),
+    ("utils.utils", "import utils.utils"),
+    ("server.views", "import server.views"),
+    ("URL configuration (manage.py checks)", "import config.urls"),
+    ("send pipeline (server.push, server.fanout)", "import server.push, server.fanout"),
+    ("warm-up (SERVER_WARMUP=always)", "from server.warmup import warm_up; warm_up()"),
+)
+
+SCRIPT = """
+import os, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+os.environ["SERVER_WARMUP"] = "never"
+started = time.perf_counter()
+import django
+django.setup()
+{code}
+print(time.perf_counter() - started)
+"""
+
+
+def run(code):
+    """Return the seconds a fresh interpreter spends on setup plus `code`."""
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(code=code)],
+        capture_output=True, text=True, check=True, cwd=os.getcwd(),
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    baseline = None
+    for name, code in TARGETS:
+        times = [run(code) for _ in range(rounds)]
+        best = min(times) * 1000
+        baseline = best if baseline is None else baseline
+        print(f"{name:<48} best {best:>8.1f} ms   median {statistics.median(times) * 1000:>8.1f} ms"
+              f"   (+{best - baseline:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
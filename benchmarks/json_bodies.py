@@ -0,0 +1,64 @@
+"""
+Benchmark parsing group-send request bodies and rendering group-send
+responses for 100k subscriptions: DRF's JSONParser/JSONRenderer against
+the orjson-backed FastJSONParser/FastJSONRenderer.
+
+    python -m benchmarks.json_bodies [subscriptions]
+"""
+import io
+import json
+import sys
+from benchmarks import setup_django, measure, report
+
+
+def make_request_body(count):
+    """A native JSON group-send body with `count` subscriptions."""
+    return json.dumps({
+        "admin_token": "00000000-0000-0000-0000-000000000000",
+        "title": "Benchmark",
+        "body": "Benchmark body",
+        "subscription_info_list": [
+            {
+                "endpoint": f"https://fcm.googleapis.com/fcm/send/{'x' * 140}{index}",
+                "keys": {"p256dh": "B" + "A" * 86, "auth": "A" * 22},
+            }
+            for index in range(count)
+        ],
+    }).encode("utf-8")
+
+
+def make_response(count):
+    """A group-send response listing `count` successful endpoints."""
+    successes = [f"https://fcm.googleapis.com/fcm/send/{'x' * 140}{index}" for index in range(count)]
+    return {
+        "success": successes, "error": [], "expired": [], "deferred": [],
+        "total": count, "success_count": count, "error_count": 0,
+        "expired_count": 0, "deferred_count": 0, "retry_campaign_id": None,
+    }
+
+
+def main():
+    setup_django()
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from server.parsers import FastJSONParser, use_orjson
+    from server.renderers import FastJSONRenderer
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    if not use_orjson():
+        print("orjson is not installed (or JSON_BACKEND=json): the fast classes fall back to the json module")
+
+    body = make_request_body(count)
+    legacy_field = json.dumps(json.loads(body)["subscription_info_list"])
+    print(f"request body: {len(body) / 1e6:.1f} MB, {count} subscriptions")
+    report("JSONParser", measure(lambda: JSONParser().parse(io.BytesIO(body)), iterations=1, repeat=5))
+    report("FastJSONParser", measure(lambda: FastJSONParser().parse(io.BytesIO(body)), iterations=1, repeat=5))
+    report("json.loads(subscription_info_list string)", measure(lambda: json.loads(legacy_field), iterations=1, repeat=5))
+
+    response = make_response(count)
+    report("JSONRenderer", measure(lambda: JSONRenderer().render(response), iterations=1, repeat=5))
+    report("FastJSONRenderer", measure(lambda: FastJSONRenderer().render(response), iterations=1, repeat=5))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Benchmark phone number normalisation: the full phonenumbers path versus the
+memoised normaliser with the canonical fast path.
+
+    python -m benchmarks.phone_normalize
+"""
+import itertools
+from benchmarks import setup_django, measure, report
+
+# Mix of input formats seen on the auth path
+SAMPLE_NUMBERS = [
+    "+989123456789",
+    "09123456789",
+    "00989123456789",
+    "9123456789",
+    "0912 345 6789",
+    "+98 912 345 6789",
+]
+
+
+def main():
+    setup_django()
+    from accounts.models import (
+        normalize_phone_number,
+        _normalize_phone_number_uncached,
+        _normalize_phone_number_cached,
+    )
+
+    for number in SAMPLE_NUMBERS:
+        assert normalize_phone_number(number) == _normalize_phone_number_uncached(number)
+
+    canonical = SAMPLE_NUMBERS[0]
+    report("uncached, canonical input", measure(lambda: _normalize_phone_number_uncached(canonical)))
+    report("memoised, canonical input", measure(lambda: normalize_phone_number(canonical)))
+
+    cycle = itertools.cycle(SAMPLE_NUMBERS)
+    report("uncached, mixed inputs", measure(lambda: _normalize_phone_number_uncached(next(cycle))))
+    _normalize_phone_number_cached.cache_clear()
+    report("memoised, mixed inputs", measure(lambda: normalize_phone_number(next(cycle))))
+    print(_normalize_phone_number_cached.cache_info())
+
+
+if __name__ == "__main__":
+    main()
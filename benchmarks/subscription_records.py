@@ -0,0 +1,55 @@
+"""
+Compare raw subscription_info dicts with pre-decoded SubscriptionRecords:
+memory held per 100k queued subscriptions, and per-recipient CPU of
+encrypting a payload (pywebpush's WebPusher vs encrypt_payload on a record).
+
+    python -m benchmarks.subscription_records [subscriptions]
+"""
+import gc
+import json
+import sys
+import tracemalloc
+from benchmarks import setup_django, measure, report
+from benchmarks.fanout_scaling import make_subscriptions
+
+
+def measure_memory(build):
+    """Return the bytes allocated by build() and still held by its result."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    setup_django()
+    from pywebpush import WebPusher
+    from server.push import encrypt_payload
+    from server.records import load_records
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    subscriptions = make_subscriptions(count)
+    # Round-trip through JSON so the dicts hold fresh strings, as after a request
+    encoded = json.dumps(subscriptions)
+
+    dict_bytes = measure_memory(lambda: json.loads(encoded))
+    record_bytes = measure_memory(lambda: load_records(json.loads(encoded)))
+    print(f"{'subscription_info dicts':<48} {dict_bytes / count:>8.0f} bytes/subscription")
+    print(f"{'SubscriptionRecords':<48} {record_bytes / count:>8.0f} bytes/subscription "
+          f"({record_bytes / dict_bytes:.2f}x)")
+
+    data = ('{"title": "Benchmark", "body": "' + "x" * 200 + '"}').encode()
+    subscription_info = subscriptions[0]
+    record = load_records([subscription_info])[0]
+    record.public_key
+    report("WebPusher(subscription_info).encode()",
+           measure(lambda: WebPusher(subscription_info).encode(data, "aes128gcm"), iterations=2000))
+    report("encrypt_payload(record)",
+           measure(lambda: encrypt_payload(record, data), iterations=2000))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ import os
 from pathlib import Path
 from datetime import timedelta
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -62,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'server.profiling.ProfilingMiddleware',  # On-demand profiling (X-Profile + X-Admin-Token headers)
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -97,6 +99,43 @@ DATABASES = {
         "PASSWORD": config("DB_PASSWORD"),
         'HOST': config("DB_HOST", default="localhost"),
         'PORT': config("DB_PORT", default=3306, cast=int),
+        # Keep connections open between requests (seconds, 0 closes after
+        # every request, None keeps them forever) and ping them before reuse
+        'CONN_MAX_AGE': config("DB_CONN_MAX_AGE", default=60, cast=lambda v: None if v == "None" else int(v)),
+        'CONN_HEALTH_CHECKS': config("DB_CONN_HEALTH_CHECKS", default=True, cast=bool),
+    }
+}
+
+# Optional connection pool shared by all threads of a worker process.
+# Requires the db-pool extra: poetry install --extras db-pool
+DB_POOL = config("DB_POOL", default=False, cast=bool)
+if DB_POOL:
+    import importlib.util
+    if importlib.util.find_spec("dj_db_conn_pool") is None:
+        raise ImproperlyConfigured("DB_POOL is enabled but django-db-connection-pool is not installed (install the db-pool extra).")
+    DATABASES['default']['ENGINE'] = 'dj_db_conn_pool.backends.mysql'
+    # The pool owns connection lifetimes, Django closes (returns) them per request
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['POOL_OPTIONS'] = {
+        'POOL_SIZE': config("DB_POOL_SIZE", default=10, cast=int),
+        'MAX_OVERFLOW': config("DB_POOL_MAX_OVERFLOW", default=10, cast=int),
+        'RECYCLE': config("DB_POOL_RECYCLE", default=3600, cast=int),
+        'TIMEOUT': config("DB_POOL_TIMEOUT", default=30, cast=int),
+        'PRE_PING': True,  # Health check before handing out a pooled connection
+    }
+
+
+# ==============================
+# CACHE SETTINGS
+# ==============================
+
+# Per-process memory cache by default. Point CACHE_BACKEND/CACHE_LOCATION at a
+# shared cache (e.g. django.core.cache.backends.redis.RedisCache) so that
+# invalidations and counters are visible to every gunicorn worker.
+CACHES = {
+    'default': {
+        'BACKEND': config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': config("CACHE_LOCATION", default="push-server"),
     }
 }
 
@@ -159,17 +198,61 @@ AUTH_USER_MODEL = "accounts.User"
 # AUTHENTICATION SETTINGS
 # ==============================
 
+# PhoneAuthBackend subclasses ModelBackend and resolves both email and phone
+# logins in one query, so it replaces ModelBackend rather than following it.
 AUTHENTICATION_BACKENDS = (
-    'django.contrib.auth.backends.ModelBackend',
     'accounts.backends.PhoneAuthBackend',
 )
 
+# "default" uses Django's hashers; "fast" prefers a low-iteration PBKDF2
+# hasher for load tests (existing hashes still verify). Django rehashes a
+# password with the preferred hasher on login, so "fast" would downgrade
+# real hashes: it is refused unless DEBUG is on.
+PASSWORD_HASHER_PROFILE = config("PASSWORD_HASHER_PROFILE", default="default")
+PASSWORD_HASHER_FAST_ITERATIONS = config("PASSWORD_HASHER_FAST_ITERATIONS", default=1000, cast=int)
+
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if PASSWORD_HASHER_PROFILE == "fast":
+    if not DEBUG:
+        raise ImproperlyConfigured('PASSWORD_HASHER_PROFILE="fast" is only allowed with DEBUG on')
+    PASSWORD_HASHERS.insert(0, 'accounts.hashers.FastPBKDF2PasswordHasher')
+
+# Maximum number of raw phone number inputs kept in the normalisation LRU cache
+PHONE_NUMBER_CACHE_SIZE = config("PHONE_NUMBER_CACHE_SIZE", default=4096, cast=int)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'server.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
+# Pre-load the send pipeline, VAPID key and signed JWTs at startup:
+# "auto" (gunicorn, uwsgi, runserver and send workers), "always" or "never"
+SERVER_WARMUP = config("SERVER_WARMUP", default="auto")
+
+# JSON library used by the fast parser and renderer: "orjson" (used when
+# installed, falling back to the standard library) or "json" to always use
+# the standard library
+JSON_BACKEND = config("JSON_BACKEND", default="orjson")
+
+# Seconds an authenticated user is kept in the cache by CachedJWTAuthentication
+# (every field but the password hash). Entries are dropped on User.save, update
+# and delete, but only in the process that made the change unless the cache is
+# shared; with the default per-process LocMem cache the TTL is capped at 5
+# seconds (accounts.authentication.LOCAL_USER_CACHE_TTL), so most requests still
+# query the user. Configure a shared cache (Redis, Memcached) to avoid that.
+USER_CACHE_TTL = config("USER_CACHE_TTL", default=60, cast=int)
+
 
 # ==============================
 # JWT TOKEN SETTINGS
@@ -190,6 +273,11 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_EXPIRE_TIME": timedelta(days=7),
 }
 
+# Check refresh tokens against an in-memory set of blacklisted JTIs, kept in
+# sync through a change log in the cache. Only used with a shared cache (see
+# CACHES); with a per-process cache every refresh queries the blacklist table.
+BLACKLIST_IN_MEMORY = config("BLACKLIST_IN_MEMORY", default=True, cast=bool)
+
 # JWT cookie settings
 JWT_AUTH_COOKIE = "access_token"
 JWT_AUTH_REFRESH_COOKIE = "refresh_token"
@@ -231,4 +319,214 @@ WEBPUSH_SETTINGS = {
     'VAPID_PUBLIC_KEY': config("VAPID_PUBLIC_KEY"),
     'VAPID_PRIVATE_KEY': config("VAPID_PRIVATE_KEY"),
     'VAPID_ADMIN_EMAIL': config("VAPID_SUBJECT")
-}
\ No newline at end of file
+}
+
+# Tenant VAPID key sets (linked to admin tokens) are stored encrypted with a
+# key derived from VAPID_ENCRYPTION_KEY, or SECRET_KEY if it is empty
+VAPID_ENCRYPTION_KEY = config("VAPID_ENCRYPTION_KEY", default="")
+
+# Parsed tenant keys (each with its own signed-JWT cache) kept per process
+VAPID_KEY_CACHE_SIZE = config("VAPID_KEY_CACHE_SIZE", default=64, cast=int)
+
+# Route django-webpush's send_group_notification/send_user_notification
+# through this server's send pipeline instead of pywebpush
+WEBPUSH_USE_PIPELINE = config("WEBPUSH_USE_PIPELINE", default=True, cast=bool)
+
+# Admin token that owns the django-webpush subscriptions: bridge sends count
+# against its quotas, and only it may send to a webpush_group through the API.
+# Empty leaves bridge sends unlimited and webpush groups unreachable from the API.
+WEBPUSH_ADMIN_TOKEN = config("WEBPUSH_ADMIN_TOKEN", default="")
+
+
+# ==============================
+# SEND WORKER SETTINGS
+# ==============================
+
+# Recipients per leased campaign chunk
+SEND_CHUNK_SIZE = config("SEND_CHUNK_SIZE", default=500, cast=int)
+
+# Visibility timeout of a chunk lease; an expired lease makes the chunk claimable again
+SEND_LEASE_SECONDS = config("SEND_LEASE_SECONDS", default=60, cast=int)
+
+# Persist progress at least every N recipients. A worker that crashes loses
+# the progress since its last checkpoint, so up to N recipients (plus the
+# batch in flight) are sent again when the chunk is re-leased; smaller values
+# trade one UPDATE per checkpoint for fewer duplicates.
+SEND_CHECKPOINT_EVERY = config("SEND_CHECKPOINT_EVERY", default=200, cast=int)
+
+# Maximum seconds between checkpoints, which also extend the lease
+SEND_HEARTBEAT_SECONDS = config("SEND_HEARTBEAT_SECONDS", default=10, cast=int)
+
+# Seconds to wait for a push service before a send counts as failed
+PUSH_TIMEOUT = config("PUSH_TIMEOUT", default=10, cast=int)
+
+# Default Web Push TTL (seconds) when a send request does not set one
+PUSH_DEFAULT_TTL = config("PUSH_DEFAULT_TTL", default=0, cast=int)
+
+# Consecutive failures (timeouts, connection errors, 429, 5xx) that open a
+# push service's circuit, and seconds before a half-open probe is allowed
+PUSH_BREAKER_FAILURES = config("PUSH_BREAKER_FAILURES", default=5, cast=int)
+PUSH_BREAKER_RECOVERY = config("PUSH_BREAKER_RECOVERY", default=30, cast=int)
+
+# Assumed sustained messages per second one push service origin accepts
+# from us. Not enforced anywhere: only used to project campaign durations
+# in dry runs, which report it as an assumption
+PUSH_ORIGIN_RATE_LIMIT = config("PUSH_ORIGIN_RATE_LIMIT", default=500, cast=int)
+
+# Recipients a dry run encrypts for at most; larger groups and audiences
+# are sampled evenly and the counts extrapolated
+DRY_RUN_SAMPLE_SIZE = config("DRY_RUN_SAMPLE_SIZE", default=1000, cast=int)
+
+# Keep-alive connections per push service host in each HTTP session
+PUSH_POOL_MAXSIZE = config("PUSH_POOL_MAXSIZE", default=32, cast=int)
+
+# Processes used to encrypt and send a chunk (1 = in the worker itself, 0 = one per CPU core).
+# Each priority lane of a worker gets its own pool of this size.
+SEND_PROCESSES = config("SEND_PROCESSES", default=1, cast=int)
+
+# Recipients handed to a send process at a time
+SEND_SHARD_SIZE = config("SEND_SHARD_SIZE", default=50, cast=int)
+
+# Largest group sent inline in the request; bigger groups are always queued
+# for the send workers, whatever their priority
+SEND_INLINE_MAX_RECIPIENTS = config("SEND_INLINE_MAX_RECIPIENTS", default=100, cast=int)
+
+# Threads per process that send an inline group concurrently
+SEND_INLINE_THREADS = config("SEND_INLINE_THREADS", default=16, cast=int)
+
+# Worker threads reserved per priority lane. A lane's threads also drain the
+# lanes above it, so high-priority sends are never starved by bulk campaigns.
+SEND_LANES = config("SEND_LANES", default="high=2,normal=2,bulk=1")
+
+
+# Rows per bulk insert when importing subscriptions
+IMPORT_BATCH_SIZE = config("IMPORT_BATCH_SIZE", default=1000, cast=int)
+
+
+# ==============================
+# DELIVERY LOG SETTINGS
+# ==============================
+
+# Record every delivery attempt in the DeliveryAttempt table
+DELIVERY_LOG_ENABLED = config("DELIVERY_LOG_ENABLED", default=True, cast=bool)
+
+# Buffered attempts are written with one bulk insert per batch, or once this
+# many milliseconds have passed since the previous write
+DELIVERY_LOG_BATCH_SIZE = config("DELIVERY_LOG_BATCH_SIZE", default=1000, cast=int)
+DELIVERY_LOG_FLUSH_MS = config("DELIVERY_LOG_FLUSH_MS", default=1000, cast=int)
+
+# Days of attempts kept by the prune_delivery_log command
+DELIVERY_LOG_RETENTION_DAYS = config("DELIVERY_LOG_RETENTION_DAYS", default=30, cast=int)
+
+
+# ==============================
+# TRACKING SETTINGS
+# ==============================
+
+# Add a signed display/click tracking field to campaign payloads. TRACKING_URL
+# is the public URL of the track/ endpoint service workers ping; tracking is
+# off while it is empty.
+TRACKING_ENABLED = config("TRACKING_ENABLED", default=True, cast=bool)
+TRACKING_URL = config("TRACKING_URL", default="")
+
+# Displays and clicks are counted in memory and written as aggregated
+# increments at most this often (per process)
+TRACKING_FLUSH_SECONDS = config("TRACKING_FLUSH_SECONDS", default=10, cast=int)
+
+# Seconds a tracking token is accepted after the message was sent; each
+# recipient's display and click are counted once within that time
+TRACKING_TOKEN_MAX_AGE = config("TRACKING_TOKEN_MAX_AGE", default=7 * 24 * 60 * 60, cast=int)
+
+
+# ==============================
+# QUOTA SETTINGS
+# ==============================
+
+# Per-token send quotas, enforced with sliding-window counters in the cache.
+# With the per-process LocMem default every worker counts on its own, so a
+# token can send up to the quota times the number of workers; use a shared
+# cache to enforce quotas per token. Tokens can override each default; 0
+# means unlimited.
+QUOTAS_ENABLED = config("QUOTAS_ENABLED", default=True, cast=bool)
+QUOTA_MESSAGES_PER_MINUTE = config("QUOTA_MESSAGES_PER_MINUTE", default=100000, cast=int)
+QUOTA_MESSAGES_PER_DAY = config("QUOTA_MESSAGES_PER_DAY", default=0, cast=int)
+QUOTA_MAX_GROUP_SIZE = config("QUOTA_MAX_GROUP_SIZE", default=0, cast=int)
+
+# Token usage is counted in memory and added to the TokenUsage table at most
+# this often (per process)
+USAGE_FLUSH_SECONDS = config("USAGE_FLUSH_SECONDS", default=30, cast=int)
+
+
+# ==============================
+# ANALYTICS SETTINGS
+# ==============================
+
+# Maintain per-campaign rollups (push service x time bucket) on the delivery
+# log and tracking flushes; the analytics API reads only these
+ANALYTICS_ENABLED = config("ANALYTICS_ENABLED", default=True, cast=bool)
+
+# Width of a rollup time bucket
+ANALYTICS_BUCKET_SECONDS = config("ANALYTICS_BUCKET_SECONDS", default=3600, cast=int)
+
+
+# ==============================
+# ICON SETTINGS
+# ==============================
+
+# Processes resizing uploaded notification icons (0 = in the request thread)
+ICON_PROCESSES = config("ICON_PROCESSES", default=2, cast=int)
+
+# Uploads waiting for or being processed at once; more wait up to ICON_TIMEOUT
+ICON_QUEUE_SIZE = config("ICON_QUEUE_SIZE", default=16, cast=int)
+
+# Seconds a request waits for its icon before sending without it
+ICON_TIMEOUT = config("ICON_TIMEOUT", default=5, cast=float)
+
+# Largest accepted icon upload in bytes, and largest width x height decoded
+ICON_MAX_UPLOAD_BYTES = config("ICON_MAX_UPLOAD_BYTES", default=5 * 1024 * 1024, cast=int)
+ICON_MAX_PIXELS = config("ICON_MAX_PIXELS", default=50_000_000, cast=int)
+
+# Icon variant edge lengths in pixels (each rendered as JPEG and WebP) and quality
+ICON_SIZES = config("ICON_SIZES", default="64,128,192", cast=lambda value: tuple(int(size) for size in value.split(",")))
+ICON_QUALITY = config("ICON_QUALITY", default=85, cast=int)
+
+# Largest notification payload in bytes. Push services accept 4096-byte
+# encrypted bodies, which leaves 3993 bytes of JSON; the payload builder
+# picks the largest icon variant that still fits.
+PUSH_PAYLOAD_BUDGET = config("PUSH_PAYLOAD_BUDGET", default=3993, cast=int)
+
+
+# ==============================
+# SEGMENTATION SETTINGS
+# ==============================
+
+# Seconds between incremental refreshes of the in-memory segment indexes
+SEGMENT_REFRESH_SECONDS = config("SEGMENT_REFRESH_SECONDS", default=5, cast=int)
+
+# Seconds between full rebuilds, run in a background thread (last-active
+# buckets are recomputed on rebuild)
+SEGMENT_FULL_REBUILD_SECONDS = config("SEGMENT_FULL_REBUILD_SECONDS", default=3600, cast=int)
+
+
+# ==============================
+# PROFILING SETTINGS
+# ==============================
+
+# Requests with an X-Profile header and a valid X-Admin-Token are profiled
+# with cProfile (see server.profiling); other requests are not affected.
+# Off by default: turn it on while investigating, not permanently.
+PROFILING_ENABLED = config("PROFILING_ENABLED", default=False, cast=bool)
+
+# Profiled requests per minute over all workers sharing the cache
+PROFILING_MAX_PER_MINUTE = config("PROFILING_MAX_PER_MINUTE", default=10, cast=int)
+
+# Hot functions listed in the X-Profile-Top response header
+PROFILING_TOP = config("PROFILING_TOP", default=8, cast=int)
+
+# Where "X-Profile: store" saves full profiles for download
+PROFILING_DIR = config("PROFILING_DIR", default=os.path.join(BASE_DIR, "profiles"))
+
+# Stored profiles are deleted after this many hours, and the oldest beyond
+# PROFILING_MAX_STORED, whenever a new one is saved
+PROFILING_RETENTION_HOURS = config("PROFILING_RETENTION_HOURS", default=24, cast=int)
+PROFILING_MAX_STORED = config("PROFILING_MAX_STORED", default=100, cast=int)
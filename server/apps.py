@@ -4,3 +4,25 @@ from django.apps import AppConfig
 class ServerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'server'
+    
+    def ready(self):
+        from django.apps import apps
+        from django.conf import settings
+        
+        # Registers the request_finished receiver that writes buffered delivery attempts
+        from . import delivery_log  # noqa: F401
+        
+        from .warmup import is_serving_process, should_warm_up, warm_up
+        if settings.WEBPUSH_USE_PIPELINE and apps.is_installed("webpush"):
+            from .webpush_bridge import check_webpush_admin_token, install
+            install()
+            # Fail at startup rather than in the request that sends a
+            # notification; other commands (migrate, ...) may run before
+            # the token exists
+            if is_serving_process():
+                check_webpush_admin_token()
+        
+        # Pre-load keys and caches in serving processes only, so other
+        # management commands start fast
+        if should_warm_up():
+            warm_up()
@@ -0,0 +1,408 @@
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from .models import Campaign, CampaignChunk, Subscription
+from .records import SubscriptionRecord, load_records
+from .fanout import deliver, resolve_process_count
+from .delivery_log import log_results, flush_delivery_log
+from .tracking import tracking_enabled
+from . import push
+
+
+def enqueue_campaign(payload, subscription_info_list, admin_token=None, chunk_size=None,
+                     priority=Campaign.PRIORITY_NORMAL, ttl=0, deadline=None, available_at=None,
+                     icon_asset=None):
+    """
+    Store a group send as a campaign split into fixed-size chunks.
+    
+    Args:
+        payload: JSON-encoded notification payload
+        subscription_info_list: List of subscription_info dicts
+        admin_token: AdminToken the campaign was sent with
+        chunk_size: Recipients per chunk (defaults to SEND_CHUNK_SIZE)
+        priority: Priority lane (Campaign.PRIORITY_*)
+        ttl: Web Push TTL in seconds
+        deadline: Datetime after which undelivered messages are dropped
+        available_at: Datetime before which workers must not claim the chunks
+        icon_asset: IconAsset the payload embeds a variant of
+        
+    Returns:
+        Campaign: The queued campaign
+    """
+    chunk_size = chunk_size or settings.SEND_CHUNK_SIZE
+    with transaction.atomic():
+        campaign = Campaign.objects.create(
+            admin_token=admin_token,
+            payload=payload,
+            icon_asset=icon_asset,
+            priority=priority,
+            ttl=ttl,
+            deadline=deadline,
+            total=len(subscription_info_list),
+        )
+        CampaignChunk.objects.bulk_create([
+            CampaignChunk(
+                campaign=campaign,
+                index=index,
+                priority=priority,
+                available_at=available_at,
+                recipients=subscription_info_list[start:start + chunk_size],
+            )
+            for index, start in enumerate(range(0, len(subscription_info_list), chunk_size))
+        ], batch_size=100)
+    return campaign
+
+
+def enqueue_audience(payload, subscription_ids, total, admin_token=None, chunk_size=None,
+                     priority=Campaign.PRIORITY_NORMAL, ttl=0, deadline=None, icon_asset=None):
+    """
+    Store a campaign targeting stored subscriptions, streaming their ids into chunks.
+    
+    Args:
+        payload: JSON-encoded notification payload
+        subscription_ids: Iterable of Subscription ids (e.g. from segments.resolve_audience)
+        total: Number of ids in the iterable
+        admin_token: AdminToken the campaign was sent with
+        chunk_size: Recipients per chunk (defaults to SEND_CHUNK_SIZE)
+        priority: Priority lane (Campaign.PRIORITY_*)
+        ttl: Web Push TTL in seconds
+        deadline: Datetime after which undelivered messages are dropped
+        icon_asset: IconAsset the payload embeds a variant of
+        
+    Returns:
+        Campaign: The queued campaign
+    """
+    chunk_size = chunk_size or settings.SEND_CHUNK_SIZE
+    with transaction.atomic():
+        campaign = Campaign.objects.create(
+            admin_token=admin_token,
+            payload=payload,
+            icon_asset=icon_asset,
+            priority=priority,
+            ttl=ttl,
+            deadline=deadline,
+            total=total,
+        )
+        pending, ids = [], []
+        for subscription_id in subscription_ids:
+            ids.append(subscription_id)
+            if len(ids) == chunk_size:
+                pending.append(CampaignChunk(campaign=campaign, index=len(pending), priority=priority, subscription_ids=ids))
+                ids = []
+        if ids:
+            pending.append(CampaignChunk(campaign=campaign, index=len(pending), priority=priority, subscription_ids=ids))
+        CampaignChunk.objects.bulk_create(pending, batch_size=100)
+    return campaign
+
+
+def get_chunk_recipients(chunk):
+    """
+    Return the decoded recipients of a chunk, in chunk order.
+    
+    Malformed subscriptions, and for chunks of stored subscriptions removed
+    or deactivated ones, are returned as None so positions (and progress)
+    stay stable.
+    
+    Returns:
+        list: SubscriptionRecord or None per recipient
+    """
+    if chunk.subscription_ids is None:
+        return load_records(chunk.recipients)
+    subscriptions = Subscription.objects.filter(is_active=True).in_bulk(chunk.subscription_ids)
+    return [
+        _load_stored(subscriptions.get(subscription_id))
+        for subscription_id in chunk.subscription_ids
+    ]
+
+
+def _load_stored(subscription):
+    """Decode a stored subscription, or return None if it is missing or malformed."""
+    if subscription is None:
+        return None
+    try:
+        return SubscriptionRecord.from_subscription(subscription)
+    except ValueError:
+        return None
+
+
+def iter_subscription_batches(subscription_ids, batch_size=1000):
+    """
+    Load stored subscriptions for a stream of ids, a batch at a time.
+    
+    Yields:
+        list: SubscriptionRecords of the active subscriptions in each batch
+            (None for malformed ones)
+    """
+    batch = []
+    for subscription_id in subscription_ids:
+        batch.append(subscription_id)
+        if len(batch) == batch_size:
+            yield [_load_stored(subscription) for subscription in Subscription.objects.filter(id__in=batch, is_active=True)]
+            batch = []
+    if batch:
+        yield [_load_stored(subscription) for subscription in Subscription.objects.filter(id__in=batch, is_active=True)]
+
+
+def claim_chunk(worker_id, lease_seconds=None, max_priority=Campaign.PRIORITY_BULK):
+    """
+    Lease the next available chunk, highest priority lane first.
+    
+    Pending chunks and chunks whose lease expired (crashed or stalled
+    workers) are both claimable. Rows locked by other workers are skipped
+    instead of waited on, so claims never serialize across workers.
+    
+    Args:
+        worker_id: Identifier of the claiming worker (e.g. host:pid)
+        lease_seconds: Visibility timeout (defaults to SEND_LEASE_SECONDS)
+        max_priority: Lowest lane this claimer may take work from; capacity
+            reserved for a lane never picks up chunks of lower lanes
+        
+    Returns:
+        CampaignChunk: The leased chunk, or None if there is no work
+    """
+    lease_seconds = lease_seconds or settings.SEND_LEASE_SECONDS
+    now = timezone.now()
+    with transaction.atomic():
+        chunk = (
+            CampaignChunk.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("campaign")
+            .filter(Q(status=CampaignChunk.PENDING) | Q(status=CampaignChunk.LEASED, leased_until__lt=now))
+            .filter(Q(available_at__isnull=True) | Q(available_at__lte=now))
+            .filter(priority__lte=max_priority)
+            .order_by("priority", "id")
+            .first()
+        )
+        if chunk is None:
+            return None
+        chunk.status = CampaignChunk.LEASED
+        chunk.lease_token = uuid.uuid4()
+        chunk.leased_by = worker_id
+        chunk.leased_until = now + timedelta(seconds=lease_seconds)
+        chunk.attempts += 1
+        chunk.save(update_fields=["status", "lease_token", "leased_by", "leased_until", "attempts", "updated_at"])
+    return chunk
+
+
+def _progress_fields(chunk):
+    """Progress and counter columns of a chunk, as written by checkpoints."""
+    return {
+        "progress": chunk.progress,
+        "success_count": chunk.success_count,
+        "error_count": chunk.error_count,
+        "expired_count": chunk.expired_count,
+        "deferred_count": chunk.deferred_count,
+        "updated_at": timezone.now(),
+    }
+
+
+def _save_progress(chunk, fields, deferred=None):
+    """
+    Write a fenced chunk update and, in the same transaction, queue the
+    recipients that were deferred since the previous write.
+    
+    Returns:
+        bool: False if the lease was lost
+    """
+    with transaction.atomic():
+        if CampaignChunk.objects.filter(pk=chunk.pk, lease_token=chunk.lease_token).update(**fields) != 1:
+            return False
+        if deferred:
+            defer_recipients(chunk.campaign_id, deferred, chunk.priority, stored=chunk.subscription_ids is not None)
+            deferred.clear()
+    return True
+
+
+def defer_recipients(campaign_id, recipients, priority, delay=None, stored=False):
+    """
+    Queue recipients for a later attempt as a new chunk of the campaign.
+    
+    Used for messages to push services whose circuit breaker is open; the
+    chunk only becomes claimable once the breaker is due for a probe.
+    
+    Args:
+        campaign_id: Campaign the recipients belong to
+        recipients: List of subscription_info dicts, or of Subscription ids
+            if `stored`
+        priority: Priority lane of the campaign
+        delay: Seconds before the chunk is claimable (defaults to PUSH_BREAKER_RECOVERY)
+        stored: Recipients are stored subscriptions; they are queued by id
+            so the retry keeps tracking and delivery log attribution
+    """
+    delay = settings.PUSH_BREAKER_RECOVERY if delay is None else delay
+    with transaction.atomic():
+        # Lock the campaign so concurrent deferrals get distinct chunk indexes
+        Campaign.objects.select_for_update().filter(pk=campaign_id).first()
+        index = CampaignChunk.objects.filter(campaign_id=campaign_id).count()
+        CampaignChunk.objects.create(
+            campaign_id=campaign_id,
+            index=index,
+            priority=priority,
+            recipients=[] if stored else list(recipients),
+            subscription_ids=list(recipients) if stored else None,
+            available_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+
+def checkpoint(chunk, lease_seconds=None, done=False, deferred=None):
+    """
+    Persist a chunk's progress and extend its lease (heartbeat).
+    
+    The update is fenced on the lease token: if the lease expired and the
+    chunk was claimed by another worker, nothing is written.
+    
+    Args:
+        chunk: Leased chunk with updated progress and counters
+        lease_seconds: Visibility timeout (defaults to SEND_LEASE_SECONDS)
+        done: Mark the chunk as completed and release the lease
+        deferred: Recipients deferred since the last checkpoint; they are
+            queued for retry atomically with the progress update
+        
+    Returns:
+        bool: False if the lease was lost and processing must stop
+    """
+    lease_seconds = lease_seconds or settings.SEND_LEASE_SECONDS
+    fields = _progress_fields(chunk)
+    if done:
+        fields.update(status=CampaignChunk.DONE, lease_token=None, leased_until=None)
+    else:
+        fields["leased_until"] = timezone.now() + timedelta(seconds=lease_seconds)
+    return _save_progress(chunk, fields, deferred)
+
+
+def release_chunk(chunk, deferred=None):
+    """Give a leased chunk back to the queue without waiting for the lease to expire."""
+    fields = _progress_fields(chunk)
+    fields.update(status=CampaignChunk.PENDING, lease_token=None, leased_until=None)
+    _save_progress(chunk, fields, deferred)
+
+
+def process_chunk(chunk, processes=1, should_stop=None):
+    """
+    Deliver a leased chunk, resuming after the last checkpoint.
+    
+    Recipients of push services whose circuit breaker is open are deferred
+    to a new chunk of the campaign instead of waiting on a failing service.
+    
+    Recipients are delivered in batches of SEND_SHARD_SIZE per process.
+    Progress is checkpointed once SEND_CHECKPOINT_EVERY recipients were
+    handled since the previous checkpoint, or SEND_HEARTBEAT_SECONDS passed,
+    which also extends the lease; checkpoints fall between batches.
+    
+    Args:
+        chunk: Leased chunk
+        processes: Number of send processes (see fanout.deliver)
+        should_stop: Optional callable; when it returns True the rest of
+            the chunk is released back to the queue
+        
+    Returns:
+        bool: True if the chunk was completed, False if it was released or
+        the lease was lost
+    """
+    processes = resolve_process_count(processes)
+    batch_size = processes * settings.SEND_SHARD_SIZE
+    checkpoint_every = settings.SEND_CHECKPOINT_EVERY
+    heartbeat_seconds = settings.SEND_HEARTBEAT_SECONDS
+    last_heartbeat = time.monotonic()
+    last_checkpoint = chunk.progress
+    
+    campaign = chunk.campaign
+    send_options = {
+        "urgency": Campaign.PRIORITY_URGENCY[chunk.priority],
+        "ttl": campaign.ttl,
+        "deadline": campaign.deadline.timestamp() if campaign.deadline else None,
+        "campaign_id": campaign.pk if tracking_enabled() else None,
+        "vapid_key_id": campaign.admin_token.vapid_key_id if campaign.admin_token_id else None,
+    }
+    
+    recipients = get_chunk_recipients(chunk)
+    deferred = []
+    
+    while chunk.progress < len(recipients):
+        if should_stop is not None and should_stop():
+            release_chunk(chunk, deferred)
+            return False
+        batch = recipients[chunk.progress:chunk.progress + batch_size]
+        
+        if campaign.deadline and campaign.deadline <= timezone.now():
+            # Stale campaign: drop the rest of the chunk without any send work
+            chunk.expired_count += len(recipients) - chunk.progress
+            chunk.progress = len(recipients)
+            break
+        
+        # Malformed subscriptions, or stored ones removed since the campaign was queued
+        live = [record for record in batch if record is not None]
+        chunk.error_count += len(batch) - len(live)
+        
+        results = deliver(live, campaign.payload, processes, lane=chunk.priority, **send_options)
+        for record, result in zip(live, results):
+            if result.outcome == push.SENT:
+                chunk.success_count += 1
+            elif result.outcome == push.EXPIRED:
+                chunk.expired_count += 1
+            elif result.outcome == push.DEFERRED:
+                # Push service circuit is open: retry in a later chunk
+                chunk.deferred_count += 1
+                deferred.append(record.subscription_id if chunk.subscription_ids is not None
+                                else record.as_subscription_info())
+            else:
+                chunk.error_count += 1
+                print(f"Error sending to {record.endpoint}: {result.error}")
+        log_results(live, results, campaign.pk, chunk.attempts)
+        chunk.progress += len(batch)
+        
+        if chunk.progress >= len(recipients):
+            break
+        if chunk.progress - last_checkpoint >= checkpoint_every \
+                or time.monotonic() - last_heartbeat >= heartbeat_seconds:
+            if not checkpoint(chunk, deferred=deferred):
+                return False
+            last_heartbeat = time.monotonic()
+            last_checkpoint = chunk.progress
+    
+    flush_delivery_log()
+    return checkpoint(chunk, done=True, deferred=deferred)
+
+
+def get_campaign_status(campaign):
+    """
+    Summarize a campaign's delivery progress from its chunks.
+    
+    Args:
+        campaign: Campaign instance
+        
+    Returns:
+        dict: Totals and chunk counts
+    """
+    totals = campaign.chunks.aggregate(
+        success_count=Sum("success_count"),
+        error_count=Sum("error_count"),
+        expired_count=Sum("expired_count"),
+        deferred_count=Sum("deferred_count"),
+    )
+    success_count = totals["success_count"] or 0
+    error_count = totals["error_count"] or 0
+    expired_count = totals["expired_count"] or 0
+    chunks_total = campaign.chunks.count()
+    chunks_done = campaign.chunks.filter(status=CampaignChunk.DONE).count()
+    return {
+        "campaign_id": campaign.pk,
+        "priority": campaign.get_priority_display().lower(),
+        "total": campaign.total,
+        "processed": success_count + error_count + expired_count,
+        "success_count": success_count,
+        "error_count": error_count,
+        "expired_count": expired_count,
+        "deferred_count": totals["deferred_count"] or 0,
+        # Reported by service workers; counters are flushed every TRACKING_FLUSH_SECONDS
+        "display_count": campaign.display_count,
+        "click_count": campaign.click_count,
+        "display_rate": round(campaign.display_count / success_count, 4) if success_count else None,
+        "click_rate": round(campaign.click_count / campaign.display_count, 4) if campaign.display_count else None,
+        "chunks": chunks_total,
+        "chunks_done": chunks_done,
+        "done": chunks_total == chunks_done,
+    }
@@ -0,0 +1,96 @@
+import threading
+import time
+from django.conf import settings
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a single push service origin.
+    
+    - closed: requests flow normally; consecutive failures are counted
+    - open: after PUSH_BREAKER_FAILURES consecutive failures (timeouts,
+      connection errors, 429 and 5xx responses) requests are refused for
+      PUSH_BREAKER_RECOVERY seconds
+    - half-open: after the recovery time one probe request is let through;
+      its success closes the circuit, its failure opens it again
+    
+    Breakers live in process memory, so every send process tracks the
+    health of each push service on its own.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold, recovery_timeout):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        """Return True if a request to this origin may be made now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+    
+    def release(self):
+        """Give back a probe slot without judging the push service's health."""
+        with self._lock:
+            self.probe_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+    
+    def retry_after(self):
+        """Seconds until the circuit lets a probe through."""
+        if self.state != self.OPEN:
+            return 0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker_state(origin):
+    """
+    Return (state, seconds until a probe) of an origin's breaker in this
+    process, without creating one; unknown origins are closed.
+    """
+    breaker = _breakers.get(origin)
+    if breaker is None:
+        return CircuitBreaker.CLOSED, 0
+    return breaker.state, breaker.retry_after()
+
+
+def get_breaker(origin):
+    """Return the circuit breaker for a push service origin, creating it on first use."""
+    breaker = _breakers.get(origin)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(origin, CircuitBreaker(
+                settings.PUSH_BREAKER_FAILURES,
+                settings.PUSH_BREAKER_RECOVERY,
+            ))
+    return breaker
@@ -0,0 +1,204 @@
+import atexit
+import threading
+import time
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import request_finished
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import DeliveryAttempt, Subscription, hash_endpoint
+from .push import GONE_STATUS_CODES
+from .rollups import RollupDeltas, get_bucket
+
+# push outcome -> DeliveryAttempt.outcome
+OUTCOME_VALUES = {
+    "sent": DeliveryAttempt.SENT,
+    "failed": DeliveryAttempt.FAILED,
+    "expired": DeliveryAttempt.EXPIRED,
+    "deferred": DeliveryAttempt.DEFERRED,
+}
+
+
+class DeliveryLogBuffer:
+    """
+    In-memory buffer of DeliveryAttempt rows.
+
+    Rows are written with one bulk_create per DELIVERY_LOG_BATCH_SIZE rows,
+    or once DELIVERY_LOG_FLUSH_MS have passed since the last write, so the
+    log never costs a database round trip per message. Rows buffered by
+    a request are flushed when it finishes (see _flush_after_request) and
+    send workers flush at the end of each chunk; anything left is flushed
+    at exit.
+    
+    Attempts of campaigns are also aggregated into rollup increments
+    (see server.rollups), applied on the same flushes. Stored subscriptions
+    the push service answered 404 or 410 for are deactivated on the same
+    flushes, so later campaigns skip them, and endpoints answered 410 Gone
+    have their django-webpush subscriptions deleted.
+    """
+
+    def __init__(self, batch_size=None, flush_ms=None):
+        self.batch_size = batch_size or settings.DELIVERY_LOG_BATCH_SIZE
+        self.flush_seconds = (flush_ms if flush_ms is not None else settings.DELIVERY_LOG_FLUSH_MS) / 1000
+        self.log_rows = settings.DELIVERY_LOG_ENABLED
+        self.rollup = settings.ANALYTICS_ENABLED
+        self.rows = []
+        self.pending = 0
+        self.deltas = RollupDeltas()
+        self.gone = set()  # endpoints of expired subscriptions
+        self.gone_ids = set()  # ids of expired stored subscriptions
+        self.delete_webpush = apps.is_installed("webpush")
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, record, result, campaign_id=None, attempt=1):
+        """
+        Buffer one attempt.
+
+        Args:
+            record: SubscriptionRecord the message was sent to
+            result: push.PushResult of the attempt
+            campaign_id: Campaign the message belongs to, if it was queued
+            attempt: Attempt number
+        """
+        gone = result.status_code == 410 and self.delete_webpush
+        gone_id = record.subscription_id if result.status_code in GONE_STATUS_CODES else None
+        if not self.log_rows and not self.rollup and not gone and gone_id is None:
+            return
+        now = timezone.now()
+        row = None
+        if self.log_rows:
+            row = DeliveryAttempt(
+                campaign_id=campaign_id,
+                subscription_id=record.subscription_id,
+                endpoint_hash=hash_endpoint(record.endpoint),
+                outcome=OUTCOME_VALUES[result.outcome],
+                status_code=result.status_code,
+                latency_ms=round(result.latency_ms, 2),
+                attempt=attempt,
+                day=now.date(),
+                created_at=now,
+            )
+        with self.lock:
+            if row is not None:
+                self.rows.append(row)
+            if self.rollup and campaign_id is not None:
+                self.deltas.add_result(campaign_id, record.origin, get_bucket(now), result.outcome, result.latency_ms)
+            if gone:
+                self.gone.add(record.endpoint)
+            if gone_id is not None:
+                self.gone_ids.add(gone_id)
+            self.pending += 1
+            due = self.pending >= self.batch_size or time.monotonic() - self.flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows and rollups. Failures are reported and the data dropped."""
+        with self.lock:
+            rows, self.rows = self.rows, []
+            deltas, self.deltas = self.deltas, RollupDeltas()
+            gone, self.gone = self.gone, set()
+            gone_ids, self.gone_ids = self.gone_ids, set()
+            self.pending = 0
+            self.flushed_at = time.monotonic()
+        # The log must never break sending
+        if rows:
+            try:
+                DeliveryAttempt.objects.bulk_create(rows, batch_size=self.batch_size)
+            except Exception as e:
+                print(f"Error writing {len(rows)} delivery attempts: {e}")
+        if deltas:
+            try:
+                deltas.apply()
+            except Exception as e:
+                print(f"Error writing campaign rollups: {e}")
+        if gone_ids:
+            try:
+                # update() skips auto_now; updated_at is set so segment indexes drop them
+                Subscription.objects.filter(pk__in=gone_ids).update(is_active=False, updated_at=timezone.now())
+            except Exception as e:
+                print(f"Error deactivating {len(gone_ids)} expired subscriptions: {e}")
+        if gone:
+            from .webpush_bridge import delete_expired_subscription_infos
+            try:
+                delete_expired_subscription_infos(gone)
+            except Exception as e:
+                print(f"Error deleting {len(gone)} expired webpush subscriptions: {e}")
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_delivery_log():
+    """Return this process's delivery log buffer."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = DeliveryLogBuffer()
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def log_results(records, results, campaign_id=None, attempt=1):
+    """
+    Buffer the attempts of a delivered batch.
+
+    Args:
+        records: SubscriptionRecords (None entries are skipped)
+        results: push.PushResult per record
+        campaign_id: Campaign the messages belong to, if queued
+        attempt: Attempt number
+    """
+    log = get_delivery_log()
+    for record, result in zip(records, results):
+        if record is not None:
+            log.add(record, result, campaign_id, attempt)
+
+
+@receiver(request_finished)
+def _flush_after_request(sender, **kwargs):
+    # Without this, the last sends before a quiet period would only be
+    # written by the next send or at exit
+    if _buffer is not None and _buffer.pending:
+        _buffer.flush()
+
+
+def flush_delivery_log():
+    """Write whatever this process has buffered."""
+    get_delivery_log().flush()
+
+
+def prune_delivery_log(days, batch_size=10000):
+    """
+    Delete attempts logged before the last `days` days.
+
+    Rows are appended in id order, so the first id of the oldest kept day
+    splits the table: everything below it is deleted in short primary key
+    ranges, each touching a contiguous part of the clustered index instead
+    of one huge DELETE that locks and scans the table.
+
+    Args:
+        days: Number of days to keep (today counts as one)
+        batch_size: Rows per DELETE statement
+
+    Returns:
+        int: Number of rows deleted
+    """
+    cutoff = timezone.now().date() - timedelta(days=days - 1)
+    first_kept = DeliveryAttempt.objects.filter(day__gte=cutoff).order_by("day", "id").values_list("id", flat=True).first()
+    oldest = DeliveryAttempt.objects.order_by("id").values_list("id", flat=True).first()
+    deleted = 0
+    if oldest is not None:
+        boundary = first_kept if first_kept is not None else \
+            DeliveryAttempt.objects.order_by("-id").values_list("id", flat=True).first() + 1
+        for start in range(oldest, boundary, batch_size):
+            deleted += DeliveryAttempt.objects.filter(
+                id__gte=start, id__lt=min(start + batch_size, boundary), day__lt=cutoff
+            ).delete()[0]
+    # Rows of old days flushed late, after the boundary
+    deleted += DeliveryAttempt.objects.filter(day__lt=cutoff).delete()[0]
+    return deleted
@@ -0,0 +1,294 @@
+import os
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from utils.utils import create_process_pool
+from . import push
+
+# Outcome codes returned by send processes, one byte per recipient
+OUTCOME_CODES = {push.SENT: 1, push.FAILED: 2, push.EXPIRED: 3, push.DEFERRED: 4}
+OUTCOME_NAMES = {code: outcome for outcome, code in OUTCOME_CODES.items()}
+
+_pools = {}  # lane -> (size, ProcessPoolExecutor)
+_pool_lock = threading.Lock()
+
+_inline_executor = None
+
+
+def resolve_process_count(processes=None):
+    """Translate a SEND_PROCESSES style value (0 = one per core) into a process count."""
+    if processes is None:
+        processes = settings.SEND_PROCESSES
+    if processes <= 0:
+        processes = os.cpu_count() or 1
+    return processes
+
+
+def _send_shard(subscriptions, payload, send_options):
+    """
+    Deliver one shard inside a send process.
+    
+    Returns:
+        tuple: (outcome bytes, {index: error} for unsuccessful recipients only,
+        HTTP status codes (0 = no response), latencies in milliseconds)
+    """
+    outcomes = bytearray(len(subscriptions))
+    errors = {}
+    status_codes = array("H")
+    latencies = array("f")
+    for index, record in enumerate(subscriptions):
+        result = push.send_push(record, payload, **send_options)
+        outcomes[index] = OUTCOME_CODES[result.outcome]
+        if result.error:
+            errors[index] = result.error
+        status_codes.append(result.status_code or 0)
+        latencies.append(result.latency_ms)
+    return bytes(outcomes), errors, status_codes, latencies
+
+
+def get_pool(processes, lane=None):
+    """
+    Return the process pool of a lane, (re)creating it for a new size.
+    
+    Every lane (a Campaign priority, or e.g. "import") has its own
+    processes, so shards of a bulk campaign never queue ahead of a
+    high-priority chunk's shards.
+    
+    Processes are spawned (see utils.create_process_pool).
+    """
+    with _pool_lock:
+        size, pool = _pools.get(lane, (None, None))
+        if pool is None or size != processes:
+            if pool is not None:
+                pool.shutdown(wait=True)
+            pool = create_process_pool(processes)
+            _pools[lane] = (processes, pool)
+        return pool
+
+
+def _send_inline(record, payload, send_options):
+    try:
+        return push.send_push(record, payload, **send_options)
+    finally:
+        # Executor threads live on; do not keep a connection per thread
+        connection.close()
+
+
+def deliver_inline(subscriptions, payload, **send_options):
+    """
+    Deliver a small group within a request, sending concurrently.
+    
+    Sends are network-bound, so up to SEND_INLINE_THREADS of them wait on
+    push services at the same time in a thread pool shared by the process.
+    Larger groups are queued for the send workers instead (see
+    SEND_INLINE_MAX_RECIPIENTS).
+    
+    Returns:
+        list: push.PushResult per recipient, in the order of `subscriptions`
+    """
+    global _inline_executor
+    if len(subscriptions) <= 1 or settings.SEND_INLINE_THREADS <= 1:
+        return [push.send_push(record, payload, **send_options) for record in subscriptions]
+    if _inline_executor is None:
+        with _pool_lock:
+            if _inline_executor is None:
+                _inline_executor = ThreadPoolExecutor(settings.SEND_INLINE_THREADS, thread_name_prefix="inline-send")
+    futures = [_inline_executor.submit(_send_inline, record, payload, send_options) for record in subscriptions]
+    return [future.result() for future in futures]
+
+
+def deliver(subscriptions, payload, processes=1, lane=None, **send_options):
+    """
+    Deliver a payload to a list of subscriptions.
+    
+    With more than one process the list is sharded across a process pool,
+    so the per-recipient encryption and VAPID work runs on every core.
+    Results come back as one outcome byte, status code and latency per
+    recipient plus the error messages of unsuccessful recipients.
+    
+    Args:
+        subscriptions: List of SubscriptionRecords (None for malformed
+            subscriptions, which fail)
+        payload: JSON-encoded notification payload
+        processes: Number of send processes (1 = deliver in this process)
+        lane: Process pool to use (see get_pool)
+        **send_options: Passed on to push.send_push (urgency, ttl, deadline, ...)
+        
+    Returns:
+        list: push.PushResult per recipient, in the order of `subscriptions`
+    """
+    processes = resolve_process_count(processes)
+    if processes == 1 or len(subscriptions) <= 1:
+        return [push.send_push(record, payload, **send_options) for record in subscriptions]
+    
+    shard_size = settings.SEND_SHARD_SIZE
+    pool = get_pool(processes, lane)
+    futures = [
+        pool.submit(_send_shard, subscriptions[start:start + shard_size], payload, send_options)
+        for start in range(0, len(subscriptions), shard_size)
+    ]
+    
+    results = []
+    for future in futures:
+        outcomes, errors, status_codes, latencies = future.result()
+        for index, code in enumerate(outcomes):
+            results.append(push.PushResult(OUTCOME_NAMES[code], errors.get(index), status_codes[index] or None, latencies[index]))
+    return results
+
+
+def new_dry_run_report():
+    """Return an empty dry-run report (see simulate)."""
+    return {"recipients": 0, "invalid": 0, "encrypted_bytes": 0, "max_encrypted_bytes": 0, "origins": {},
+            "sampled": None}
+
+
+def get_sample_step(total):
+    """Return the stride that picks at most DRY_RUN_SAMPLE_SIZE of `total` recipients."""
+    return max(1, -(-total // settings.DRY_RUN_SAMPLE_SIZE))
+
+
+def scale_dry_run_report(report, total):
+    """
+    Extrapolate the report of an evenly spread sample to `total` recipients.
+
+    Counts and byte totals are scaled; the largest encrypted size is kept
+    as measured. The number of recipients actually simulated is kept
+    under "sampled".
+    """
+    sampled = report["recipients"]
+    report["sampled"] = sampled
+    if sampled and sampled < total:
+        factor = total / sampled
+        report["recipients"] = total
+        report["invalid"] = round(report["invalid"] * factor)
+        report["encrypted_bytes"] = round(report["encrypted_bytes"] * factor)
+        for totals in report["origins"].values():
+            totals[0] = round(totals[0] * factor)
+            totals[1] = round(totals[1] * factor)
+    return report
+
+
+def merge_dry_run_reports(report, other):
+    """Add the counts of `other` to `report` and return it."""
+    report["recipients"] += other["recipients"]
+    report["invalid"] += other["invalid"]
+    report["encrypted_bytes"] += other["encrypted_bytes"]
+    report["max_encrypted_bytes"] = max(report["max_encrypted_bytes"], other["max_encrypted_bytes"])
+    for origin, (count, size) in other["origins"].items():
+        totals = report["origins"].setdefault(origin, [0, 0])
+        totals[0] += count
+        totals[1] += size
+    return report
+
+
+def _simulate_shard(subscriptions, payload, send_options):
+    """Dry-run one shard: encrypt for every recipient and count, without sending."""
+    report = new_dry_run_report()
+    for record in subscriptions:
+        origin, result = push.simulate_push(record, payload, **send_options)
+        report["recipients"] += 1
+        if origin is None:
+            report["invalid"] += 1
+            continue
+        report["encrypted_bytes"] += result
+        report["max_encrypted_bytes"] = max(report["max_encrypted_bytes"], result)
+        totals = report["origins"].setdefault(origin, [0, 0])
+        totals[0] += 1
+        totals[1] += result
+    return report
+
+
+def simulate(subscriptions, payload, processes=1, **send_options):
+    """
+    Dry-run a delivery: the same per-recipient work as deliver() (VAPID
+    headers, payload encryption) on the same processes, minus the network.
+    
+    Args:
+        subscriptions: List of SubscriptionRecords (None for malformed ones)
+        payload: JSON-encoded notification payload
+        processes: Number of send processes (1 = in this process)
+        **send_options: Send options (urgency, ttl, ...)
+        
+    Returns:
+        dict: Recipient, invalid and encrypted size counts, per origin
+    """
+    processes = resolve_process_count(processes)
+    if processes == 1 or len(subscriptions) <= 1:
+        return _simulate_shard(subscriptions, payload, send_options)
+    
+    shard_size = settings.SEND_SHARD_SIZE
+    pool = get_pool(processes)
+    futures = [
+        pool.submit(_simulate_shard, subscriptions[start:start + shard_size], payload, send_options)
+        for start in range(0, len(subscriptions), shard_size)
+    ]
+    report = new_dry_run_report()
+    for future in futures:
+        merge_dry_run_reports(report, future.result())
+    return report
+
+
+def summarize_dry_run(report, payload, elapsed, token=None):
+    """
+    Turn a dry-run report into the API response.
+    
+    Nothing enforces a per-origin rate, so the projected duration is an
+    estimate: it assumes every push service origin is sent to in parallel
+    at PUSH_ORIGIN_RATE_LIMIT messages per second (reported under
+    "assumptions"), so the busiest origin dictates the campaign's length.
+    Origins whose circuit breaker is open in this process are projected to
+    start once it lets a probe through. With a token, the response also
+    says whether its quotas would accept the send right now. For sampled
+    reports (see scale_dry_run_report) the counts are estimates and the
+    throughput is measured on the sample.
+    
+    Args:
+        report: Merged dry-run report
+        payload: JSON-encoded notification payload
+        elapsed: Seconds the dry run took (network-free CPU path)
+        token: AdminToken the send would be attributed to
+        
+    Returns:
+        dict: Summary with per-origin breakdown and projected duration
+    """
+    from .circuit import CircuitBreaker, get_breaker_state
+    from .quotas import get_remaining_quota
+
+    rate = settings.PUSH_ORIGIN_RATE_LIMIT
+    valid = report["recipients"] - report["invalid"]
+    origins = {}
+    for origin, (count, size) in sorted(report["origins"].items(), key=lambda item: -item[1][0]):
+        breaker, retry_after = get_breaker_state(origin)
+        delay = retry_after if breaker == CircuitBreaker.OPEN else 0
+        origins[origin] = {
+            "recipients": count,
+            "encrypted_bytes": size,
+            "breaker": breaker,
+            "projected_seconds": round(delay + count / rate, 2),
+        }
+    simulated = report["recipients"] if report["sampled"] is None else report["sampled"]
+    summary = {
+        "dry_run": True,
+        "total": report["recipients"],
+        "valid_count": valid,
+        "invalid_count": report["invalid"],
+        "payload_bytes": len(payload.encode("utf-8")),
+        "encrypted_bytes_total": report["encrypted_bytes"],
+        "encrypted_bytes_max": report["max_encrypted_bytes"],
+        "origins": origins,
+        "projected_seconds": max((origin["projected_seconds"] for origin in origins.values()), default=0),
+        "cpu_path_seconds": round(elapsed, 3),
+        "cpu_path_recipients_per_second": round(simulated / elapsed) if elapsed else None,
+        "sampled": simulated,
+        "assumptions": {"origin_messages_per_second": rate},
+    }
+    if token is not None:
+        quota = get_remaining_quota(token)
+        summary["quota"] = quota
+        summary["within_quota"] = all(
+            report["recipients"] <= (limit if name == "max_group_size" else limit["remaining"])
+            for name, limit in quota.items()
+        )
+    return summary
@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import threading
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from utils.utils import create_process_pool, render_icon_variants
+from .models import IconAsset
+
+# Formats every icon size is rendered in
+ICON_FORMATS = ("JPEG", "WEBP")
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+class IconError(ValueError):
+    """Raised when an uploaded icon is rejected or cannot be processed."""
+
+
+def get_icon_pool():
+    """
+    Return the icon process pool, or None when ICON_PROCESSES is 0.
+    
+    The pool is bounded twice: ICON_PROCESSES processes decode images, and
+    at most ICON_QUEUE_SIZE uploads may be in flight at once. Processes
+    are spawned (see utils.create_process_pool).
+    """
+    global _pool, _slots
+    if settings.ICON_PROCESSES <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_process_pool(settings.ICON_PROCESSES)
+            _slots = threading.BoundedSemaphore(settings.ICON_QUEUE_SIZE)
+        return _pool
+
+
+def reset_icon_pool():
+    """Drop a broken icon pool so the next upload starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def check_icon_upload(upload):
+    """
+    Reject uploads larger than ICON_MAX_UPLOAD_BYTES before reading them.
+    
+    Raises:
+        IconError: If the upload is too large
+    """
+    if upload.size > settings.ICON_MAX_UPLOAD_BYTES:
+        raise IconError(f"Icon must be at most {settings.ICON_MAX_UPLOAD_BYTES} bytes")
+
+
+def run_icon_job(function, *args):
+    """
+    Run an image function in the icon process pool and wait for its result.
+    
+    The request thread only waits (without holding the GIL) instead of
+    spending hundreds of milliseconds of CPU on a large photo.
+    
+    Raises:
+        IconError: If the pool is saturated, the job times out or fails
+    """
+    pool = get_icon_pool()
+    try:
+        if pool is None:
+            return function(*args)
+        if not _slots.acquire(timeout=settings.ICON_TIMEOUT):
+            raise IconError("Icon processing is busy")
+        try:
+            future = pool.submit(function, *args)
+        except BaseException:
+            _slots.release()
+            raise
+        # The slot is held until the image is done, even if we stop waiting
+        future.add_done_callback(lambda future: _slots.release())
+        return future.result(timeout=settings.ICON_TIMEOUT)
+    except TimeoutError:
+        raise IconError("Icon processing timed out")
+    except BrokenProcessPool:
+        # A pool process died (e.g. killed for memory); start a new pool next time
+        reset_icon_pool()
+        raise IconError("Icon processing failed")
+    except IconError:
+        raise
+    except ValueError as e:
+        raise IconError(str(e))
+
+
+def create_icon_asset(upload, admin_token=None):
+    """
+    Store an uploaded icon with all its variants, rendered once.
+    
+    An upload identical to an existing asset of the same token returns
+    that asset without any image work.
+    
+    Args:
+        upload: Uploaded image file
+        admin_token: AdminToken the icon was uploaded with
+        
+    Returns:
+        IconAsset: The new or existing asset
+        
+    Raises:
+        IconError: If the upload is rejected or cannot be processed
+    """
+    check_icon_upload(upload)
+    data = upload.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+    asset = IconAsset.objects.filter(admin_token=admin_token, content_hash=content_hash).first()
+    if asset is not None:
+        return asset
+    
+    (width, height), variants = run_icon_job(
+        render_icon_variants, data, settings.ICON_SIZES, ICON_FORMATS, settings.ICON_QUALITY, settings.ICON_MAX_PIXELS
+    )
+    asset, _ = IconAsset.objects.get_or_create(
+        admin_token=admin_token,
+        content_hash=content_hash,
+        defaults={
+            "width": width,
+            "height": height,
+            "variants": [
+                {
+                    "size": size,
+                    "format": format.lower(),
+                    "uri": f"data:image/{format.lower()};base64,{base64.b64encode(variant).decode('ascii')}",
+                }
+                for size, format, variant in variants
+            ],
+        },
+    )
+    return asset
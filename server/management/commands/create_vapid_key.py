@@ -0,0 +1,34 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from server.models import AdminToken
+from server.vapid_keys import create_key_set
+
+
+class Command(BaseCommand):
+    help = "Create (or import) a tenant VAPID key set and link admin tokens to it."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("name", help="Tenant name")
+        parser.add_argument("--subject", required=True, help="VAPID subject, e.g. mailto:push@example.com")
+        parser.add_argument("--private-key", help="Existing private key to import instead of generating one")
+        parser.add_argument("--token", action="append", default=[],
+                            help="Admin token to sign with this key set (repeatable)")
+    
+    def handle(self, *args, **options):
+        try:
+            tokens = [AdminToken.objects.get(token=token) for token in options["token"]]
+        except (AdminToken.DoesNotExist, ValidationError):
+            raise CommandError("Admin token not found")
+        
+        try:
+            key_set = create_key_set(options["name"], options["subject"], options["private_key"])
+        except Exception as ex:
+            raise CommandError(f"Invalid VAPID key: {ex}")
+        
+        # Browsers subscribed with another applicationServerKey must resubscribe with the new one
+        for token in tokens:
+            token.vapid_key = key_set
+            token.save(update_fields=["vapid_key"])
+        
+        self.stdout.write(self.style.SUCCESS(f"Created key set {key_set.pk} for {len(tokens)} token(s)."))
+        self.stdout.write(f"Public key (applicationServerKey): {key_set.public_key}")
@@ -0,0 +1,40 @@
+import sys
+import time
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from server.models import AdminToken
+from server.transfer import export_subscriptions
+
+
+class Command(BaseCommand):
+    help = "Export stored subscriptions as NDJSON or CSV (to stdout by default)."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="-", help="Output file, or - for stdout")
+        parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+        parser.add_argument("--active-only", action="store_true", help="Skip inactive subscriptions")
+        parser.add_argument("--token", help="Only export this admin token's subscriptions")
+    
+    def handle(self, *args, **options):
+        token = None
+        if options["token"]:
+            try:
+                token = AdminToken.objects.get(token=options["token"])
+            except (AdminToken.DoesNotExist, ValidationError):
+                raise CommandError("Admin token not found")
+        
+        started = time.perf_counter()
+        stream = sys.stdout if options["output"] == "-" else open(options["output"], "w", newline="")
+        rows = 0
+        try:
+            for line in export_subscriptions(options["format"], active_only=options["active_only"], admin_token=token):
+                stream.write(line)
+                rows += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        
+        elapsed = time.perf_counter() - started
+        if options["format"] == "csv":
+            rows -= 1  # Header line
+        self.stderr.write(f"Exported {rows} rows in {elapsed:.3f}s, {rows / elapsed if elapsed else 0:.0f} rows/s.")
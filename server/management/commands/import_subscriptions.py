@@ -0,0 +1,55 @@
+import sys
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from server.models import AdminToken
+from server.fanout import get_pool, resolve_process_count
+from server.transfer import import_subscriptions, PARSERS
+
+
+class Command(BaseCommand):
+    help = "Import subscriptions from an NDJSON or CSV file (use - for stdin)."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file, or - for stdin")
+        parser.add_argument("--format", choices=sorted(PARSERS), default="ndjson")
+        parser.add_argument("--batch-size", type=int, default=settings.IMPORT_BATCH_SIZE,
+                            help="Rows per bulk insert")
+        parser.add_argument("--processes", type=int, default=0,
+                            help="Processes validating keys (0 = one per CPU core)")
+        parser.add_argument("--skip-existing", action="store_true",
+                            help="Leave endpoints that already exist untouched")
+        parser.add_argument("--token", help="Import for this admin token: rows it does not own are rejected")
+    
+    def handle(self, *args, **options):
+        token = None
+        if options["token"]:
+            try:
+                token = AdminToken.objects.get(token=options["token"])
+            except (AdminToken.DoesNotExist, ValidationError):
+                raise CommandError("Admin token not found")
+        
+        processes = resolve_process_count(options["processes"])
+        pool = get_pool(processes, lane="import") if processes > 1 else None
+        
+        stream = sys.stdin.buffer if options["path"] == "-" else open(options["path"], "rb")
+        try:
+            report = import_subscriptions(
+                stream,
+                format=options["format"],
+                batch_size=options["batch_size"],
+                update=not options["skip_existing"],
+                pool=pool,
+                processes=processes,
+                admin_token=token,
+            )
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        
+        for error in report["errors"]:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['written']} of {report['rows']} rows ({report['invalid']} invalid) "
+            f"in {report['seconds']}s, {report['rows_per_second']} rows/s."
+        ))
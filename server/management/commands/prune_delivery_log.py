@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from server.delivery_log import prune_delivery_log
+
+
+class Command(BaseCommand):
+    help = "Delete delivery attempts older than the retention period, oldest days first."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.DELIVERY_LOG_RETENTION_DAYS,
+                            help="Number of days of attempts to keep (including today)")
+        parser.add_argument("--batch-size", type=int, default=10000,
+                            help="Number of rows deleted per query")
+    
+    def handle(self, *args, **options):
+        if options["days"] < 1:
+            self.stderr.write("--days must be at least 1")
+            return
+        deleted = prune_delivery_log(options["days"], options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} delivery attempts."))
@@ -0,0 +1,97 @@
+import os
+import signal
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from server.campaigns import claim_chunk, process_chunk
+from server.models import Campaign
+
+
+def parse_lanes(value):
+    """
+    Parse a lane concurrency spec such as "high=2,normal=2,bulk=1".
+    
+    Returns:
+        list: (priority, threads) tuples
+    """
+    lanes = []
+    for item in value.split(","):
+        name, _, threads = item.strip().partition("=")
+        if name not in Campaign.PRIORITY_NAMES:
+            raise CommandError(f"Unknown lane '{name}', expected one of: {', '.join(Campaign.PRIORITY_NAMES)}")
+        lanes.append((Campaign.PRIORITY_NAMES[name], int(threads or 1)))
+    return lanes
+
+
+class Command(BaseCommand):
+    help = "Run a send worker that leases campaign chunks and delivers them."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--worker-id", default=f"{socket.gethostname()}:{os.getpid()}",
+                            help="Identifier recorded on leased chunks")
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+                            help="Seconds to sleep when there is no work")
+        parser.add_argument("--processes", type=int, default=settings.SEND_PROCESSES,
+                            help="Send processes per worker (0 = one per CPU core)")
+        parser.add_argument("--lanes", default=settings.SEND_LANES,
+                            help="Threads reserved per priority lane, e.g. high=2,normal=2,bulk=1")
+        parser.add_argument("--once", action="store_true",
+                            help="Exit when the queue is empty")
+    
+    def handle(self, *args, **options):
+        worker_id = options["worker_id"]
+        self.stop = threading.Event()
+        
+        # A thread reserved for a lane takes work from that lane and the lanes
+        # above it, so high-priority chunks always have threads that no bulk
+        # campaign can occupy.
+        threads = []
+        for priority, count in parse_lanes(options["lanes"]):
+            for number in range(count):
+                thread = threading.Thread(
+                    target=self.work,
+                    args=(f"{worker_id}:{Campaign.PRIORITY_URGENCY[priority]}{number}", priority, options),
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+        self.stdout.write(f"Send worker {worker_id} started with {len(threads)} lane threads.")
+        
+        # systemd and container runtimes stop workers with SIGTERM: release
+        # the leased chunks instead of leaving them until the lease expires
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            # Lane threads release their chunks back to the queue and exit
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+    
+    def handle_sigterm(self, signum, frame):
+        """Stop claiming; lane threads release their chunks and exit."""
+        self.stdout.write("SIGTERM received, releasing leased chunks.")
+        self.stop.set()
+    
+    def work(self, worker_id, max_priority, options):
+        """Claim and deliver chunks from lanes up to max_priority until stopped."""
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                chunk = claim_chunk(worker_id, max_priority=max_priority)
+                if chunk is None:
+                    if options["once"]:
+                        break
+                    self.stop.wait(options["poll_interval"])
+                    continue
+                
+                completed = process_chunk(chunk, options["processes"], should_stop=self.stop.is_set)
+                if not completed and not self.stop.is_set():
+                    self.stdout.write(f"Lost lease on chunk {chunk.pk}, it was re-leased by another worker.")
+        finally:
+            connection.close()
@@ -0,0 +1,33 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from server.models import AdminToken
+
+
+class Command(BaseCommand):
+    help = "Set the send quotas of an admin token (0 = unlimited, -1 = use the QUOTA_* default)."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("token", help="Admin token UUID")
+        parser.add_argument("--per-minute", type=int, help="Messages per sliding minute")
+        parser.add_argument("--per-day", type=int, help="Messages per sliding day")
+        parser.add_argument("--max-group-size", type=int, help="Recipients per send")
+    
+    def handle(self, *args, **options):
+        try:
+            token = AdminToken.objects.get(token=options["token"])
+        except (AdminToken.DoesNotExist, ValidationError):
+            raise CommandError("Admin token not found")
+        
+        fields = {
+            "messages_per_minute": options["per_minute"],
+            "messages_per_day": options["per_day"],
+            "max_group_size": options["max_group_size"],
+        }
+        for field, value in fields.items():
+            if value is not None:
+                setattr(token, field, None if value < 0 else value)
+        token.save(update_fields=list(fields))
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"{token.name}: " + ", ".join(f"{field}={getattr(token, field)}" for field in fields)
+        ))
@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
-import uuid, string, random
+from urllib.parse import urlparse
+import uuid, string, random, hashlib
 
 def generate_random_name():
     """
@@ -13,6 +14,31 @@ def generate_random_name():
     return ''.join(random.choices(string.ascii_letters + string.digits, k=20))
 
 
+class VapidKeySet(models.Model):
+    """
+    A tenant's VAPID application server key pair.
+    
+    The private key is stored encrypted (see server.vapid_keys). Key sets
+    are never modified: rotating a tenant's key creates a new set and
+    points its tokens at it, so cached keys never go stale.
+    """
+    name = models.CharField(max_length=100)
+    
+    # Uncompressed P-256 public key, base64url; the applicationServerKey browsers subscribe with
+    public_key = models.CharField(max_length=100)
+    
+    # Encrypted raw private key
+    private_key_encrypted = models.TextField()
+    
+    # VAPID "sub" claim (mailto: or https: contact of the tenant)
+    subject = models.CharField(max_length=255)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.public_key[:10]})"
+
+
 class AdminToken(models.Model):
     """
     Model for API authentication tokens used by administrators.
@@ -21,6 +47,7 @@ class AdminToken(models.Model):
     - A unique UUID identifier
     - A human-readable name (random by default)
     - A timestamp of when it was created
+    - Optionally its tenant's VAPID key set and send quotas
     
     These tokens are used to authenticate push notification API requests.
     """
@@ -33,9 +60,379 @@ class AdminToken(models.Model):
     # When the token was created
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # VAPID keys the token's sends are signed with; null uses VAPID_PRIVATE_KEY/VAPID_SUBJECT
+    vapid_key = models.ForeignKey(VapidKeySet, null=True, blank=True, on_delete=models.SET_NULL, related_name="admin_tokens")
+    
+    # Quotas (see server.quotas); null uses the QUOTA_* setting, 0 means unlimited
+    messages_per_minute = models.PositiveIntegerField(null=True, blank=True)
+    messages_per_day = models.PositiveIntegerField(null=True, blank=True)
+    max_group_size = models.PositiveIntegerField(null=True, blank=True)
+    
     def __str__(self):
         """
         String representation showing name and last 10 characters of token
         for easy identification without exposing the full token.
         """
-        return f"{self.name} - {self.token}"[-10:]
\ No newline at end of file
+        return f"{self.name} - {self.token}"[-10:]
+
+
+def hash_endpoint(endpoint):
+    """
+    Hash a push endpoint for the unique index (endpoints are too long to index directly).
+    
+    Returns:
+        str: Hex SHA-256 digest of the endpoint
+    """
+    return hashlib.sha256(endpoint.encode("utf-8")).hexdigest()
+
+
+# Push service hosts and the browser vendor behind them
+PUSH_SERVICE_VENDORS = (
+    ("fcm.googleapis.com", "google"),
+    ("push.services.mozilla.com", "mozilla"),
+    ("push.apple.com", "apple"),
+    ("notify.windows.com", "microsoft"),
+)
+
+
+def get_endpoint_vendor(endpoint):
+    """Return the browser vendor for a push endpoint, based on its push service host."""
+    host = urlparse(endpoint).hostname or ""
+    for suffix, vendor in PUSH_SERVICE_VENDORS:
+        if host == suffix or host.endswith("." + suffix):
+            return vendor
+    return "other"
+
+
+class TokenUsage(models.Model):
+    """
+    Daily usage of an admin token.
+    
+    Counted in memory by each process and added here periodically
+    (see server.quotas.UsageCounters), never written per request.
+    """
+    admin_token = models.ForeignKey(AdminToken, on_delete=models.CASCADE, related_name="usage")
+    day = models.DateField()
+    
+    # Send requests accepted, messages they sent or queued, and requests rejected by a quota
+    requests = models.PositiveIntegerField(default=0)
+    messages = models.PositiveBigIntegerField(default=0)
+    rejected = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ("admin_token", "day")
+    
+    def __str__(self):
+        return f"{self.admin_token} {self.day}: {self.messages} messages"
+
+
+class Subscription(models.Model):
+    """
+    A stored browser push subscription.
+    
+    Tags, attributes, vendor and last activity feed the segmentation
+    indexes in server.segments, so campaigns can target an audience
+    expression instead of posting an explicit subscription list.
+    """
+    VENDOR_CHOICES = (
+        ("google", "Google"),
+        ("mozilla", "Mozilla"),
+        ("apple", "Apple"),
+        ("microsoft", "Microsoft"),
+        ("other", "Other"),
+    )
+    # Token the subscription was registered or imported with. Tokens only
+    # export, overwrite and target their own subscriptions; null for
+    # subscriptions imported from the command line without --token.
+    admin_token = models.ForeignKey(AdminToken, null=True, blank=True, on_delete=models.SET_NULL, related_name="subscriptions")
+    
+    # Key set the browser subscribed with (its applicationServerKey); null
+    # is the default VAPID_PRIVATE_KEY. Push services reject messages signed
+    # with any other key, so audiences only ever include a token's own key set.
+    vapid_key = models.ForeignKey(VapidKeySet, null=True, blank=True, on_delete=models.SET_NULL, related_name="subscriptions")
+    
+    endpoint = models.TextField()
+    endpoint_hash = models.CharField(max_length=64, unique=True, editable=False)
+    p256dh = models.CharField(max_length=255)
+    auth = models.CharField(max_length=64)
+    vendor = models.CharField(max_length=20, choices=VENDOR_CHOICES, default="other")
+    
+    # Free-form targeting data, e.g. ["news", "sports"] and {"lang": "fa"}
+    tags = models.JSONField(default=list, blank=True)
+    attributes = models.JSONField(default=dict, blank=True)
+    
+    # Inactive subscriptions are kept but never targeted
+    is_active = models.BooleanField(default=True)
+    last_active_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    # Watermark for incremental segment index updates
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    def save(self, *args, **kwargs):
+        self.endpoint_hash = hash_endpoint(self.endpoint)
+        self.vendor = get_endpoint_vendor(self.endpoint)
+        super().save(*args, **kwargs)
+    
+    def as_subscription_info(self):
+        """Return the subscription in the format browsers and pywebpush use."""
+        return {
+            "endpoint": self.endpoint,
+            "keys": {"p256dh": self.p256dh, "auth": self.auth},
+        }
+    
+    def __str__(self):
+        return f"{self.vendor} - {self.endpoint_hash[:10]}"
+
+
+class IconAsset(models.Model):
+    """
+    An uploaded notification icon with pre-rendered variants.
+    
+    Every size in ICON_SIZES is rendered as JPEG and WebP from a single
+    decode when the icon is first uploaded. Variants are stored as data
+    URIs ready to embed in a payload, so sending never touches the image.
+    """
+    admin_token = models.ForeignKey(AdminToken, null=True, blank=True, on_delete=models.SET_NULL, related_name="icons")
+    
+    # SHA-256 of the uploaded file; the same token uploading the same image
+    # again reuses the asset (tokens never share icons)
+    content_hash = models.CharField(max_length=64)
+    
+    # Dimensions of the original image
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    
+    # [{"size": 64, "format": "webp", "uri": "data:image/webp;base64,..."}, ...]
+    variants = models.JSONField(default=list)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ("admin_token", "content_hash")
+    
+    def choose_variant(self, budget):
+        """
+        Return the data URI of the largest variant whose URI fits in `budget` bytes.
+        
+        For each size the smaller of the two encodings is preferred.
+        
+        Returns:
+            str: Data URI, or None if no variant fits
+        """
+        best = None
+        for variant in self.variants:
+            size = len(variant["uri"])
+            if size > budget:
+                continue
+            if best is None or variant["size"] > best["size"] or \
+                    (variant["size"] == best["size"] and size < len(best["uri"])):
+                best = variant
+        return best["uri"] if best else None
+    
+    def __str__(self):
+        return f"{self.width}x{self.height} - {self.content_hash[:10]}"
+
+
+class Campaign(models.Model):
+    """
+    A group send queued for delivery by the send workers.
+    
+    The recipients are split into fixed-size CampaignChunk rows which any
+    number of worker processes (on any number of hosts) can lease.
+    """
+    # Token the campaign was sent with
+    admin_token = models.ForeignKey(AdminToken, null=True, blank=True, on_delete=models.SET_NULL, related_name="campaigns")
+    
+    # Priority lanes: workers always drain higher lanes first
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_BULK = 2
+    PRIORITY_CHOICES = (
+        (PRIORITY_HIGH, "High"),
+        (PRIORITY_NORMAL, "Normal"),
+        (PRIORITY_BULK, "Bulk"),
+    )
+    PRIORITY_NAMES = {"high": PRIORITY_HIGH, "normal": PRIORITY_NORMAL, "bulk": PRIORITY_BULK}
+    
+    # Web Push Urgency header sent for each lane
+    PRIORITY_URGENCY = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_BULK: "low"}
+    
+    # JSON-encoded notification payload, built once for all recipients
+    payload = models.TextField()
+    
+    # Icon the payload embeds a variant of
+    icon_asset = models.ForeignKey(IconAsset, null=True, blank=True, on_delete=models.SET_NULL, related_name="campaigns")
+    
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_NORMAL)
+    
+    # Web Push TTL header (seconds the push service keeps the message for offline devices)
+    ttl = models.PositiveIntegerField(default=0)
+    
+    # Messages still queued after this moment are dropped and counted as expired
+    deadline = models.DateTimeField(null=True, blank=True)
+    
+    # Number of recipients over all chunks
+    total = models.PositiveIntegerField(default=0)
+    
+    # Displays and clicks reported by service workers (see server.tracking)
+    display_count = models.PositiveIntegerField(default=0)
+    click_count = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Campaign {self.pk} ({self.total} recipients)"
+
+
+class CampaignChunk(models.Model):
+    """
+    A fixed-size slice of a campaign's recipients.
+    
+    Workers claim chunks with SELECT ... FOR UPDATE SKIP LOCKED and hold
+    them under a lease that is extended on every checkpoint (heartbeat).
+    A chunk whose lease expired is claimed again by another worker and
+    resumes at `progress`, so recipients that were already handled are
+    not sent twice.
+    """
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (LEASED, "Leased"),
+        (DONE, "Done"),
+    )
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name="chunks")
+    index = models.PositiveIntegerField()
+    
+    # List of subscription_info dicts, or ids of stored Subscriptions for
+    # campaigns targeting an audience expression
+    recipients = models.JSONField(default=list)
+    subscription_ids = models.JSONField(null=True, blank=True)
+    
+    # Copy of the campaign's priority so claims can order on an index
+    priority = models.PositiveSmallIntegerField(choices=Campaign.PRIORITY_CHOICES, default=Campaign.PRIORITY_NORMAL)
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    
+    # Lease held by a worker; lease_token fences out workers whose lease expired
+    lease_token = models.UUIDField(null=True, blank=True)
+    leased_by = models.CharField(max_length=100, blank=True)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    
+    # Recipients [0, progress) have been handled
+    progress = models.PositiveIntegerField(default=0)
+    success_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    expired_count = models.PositiveIntegerField(default=0)
+    
+    # Recipients moved to a retry chunk because their push service's circuit was open
+    deferred_count = models.PositiveIntegerField(default=0)
+    
+    # Retry chunks are not claimable before this moment
+    available_at = models.DateTimeField(null=True, blank=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ("campaign", "index")
+        indexes = [
+            models.Index(fields=["status", "priority", "leased_until"]),
+        ]
+    
+    def __str__(self):
+        return f"Campaign {self.campaign_id} chunk {self.index} ({self.status})"
+
+
+class DeliveryAttempt(models.Model):
+    """
+    Log of a single delivery attempt.
+    
+    Rows are written in batches by server.delivery_log and rotated by day
+    with the prune_delivery_log command. Campaign and subscription are not
+    enforced by database constraints, so inserts take no locks on them
+    and deleting a campaign never cascades into hundreds of millions of rows.
+    """
+    # Same codes as fanout.OUTCOME_CODES
+    SENT = 1
+    FAILED = 2
+    EXPIRED = 3
+    DEFERRED = 4
+    OUTCOME_CHOICES = (
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+        (EXPIRED, "Expired"),
+        (DEFERRED, "Deferred"),
+    )
+    
+    # Null for sends that were not queued as a campaign
+    campaign = models.ForeignKey(Campaign, null=True, blank=True, on_delete=models.DO_NOTHING,
+                                 db_constraint=False, db_index=False, related_name="delivery_attempts")
+    
+    # Null for recipients that are not stored subscriptions
+    subscription = models.ForeignKey(Subscription, null=True, blank=True, on_delete=models.DO_NOTHING,
+                                     db_constraint=False, related_name="delivery_attempts")
+    endpoint_hash = models.CharField(max_length=64)
+    
+    outcome = models.PositiveSmallIntegerField(choices=OUTCOME_CHOICES)
+    
+    # HTTP status of the push service's response (null if none was received)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    
+    # Encryption and request time in milliseconds
+    latency_ms = models.FloatField(default=0)
+    
+    # Lease attempt of the chunk the message was sent from (1 for inline sends)
+    attempt = models.PositiveSmallIntegerField(default=1)
+    
+    # Rotation key: whole days are pruned at once
+    day = models.DateField(db_index=True)
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=["campaign", "outcome"]),
+            models.Index(fields=["endpoint_hash", "day"]),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_outcome_display()} {self.endpoint_hash[:10]} ({self.day})"
+
+
+class CampaignRollup(models.Model):
+    """
+    Delivery and engagement counters of a campaign per push service and time bucket.
+    
+    Maintained incrementally by the delivery log and tracking flushes (see
+    server.rollups), so analytics never scan raw attempts. Latencies are kept
+    as a mergeable sketch (server.sketch.LatencySketch) from which any
+    percentile of any set of rows can be computed.
+    """
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name="rollups")
+    
+    # Push service origin, e.g. https://fcm.googleapis.com ("" if unknown)
+    origin = models.CharField(max_length=255)
+    
+    # Start of the ANALYTICS_BUCKET_SECONDS bucket
+    bucket = models.DateTimeField()
+    
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    expired_count = models.PositiveIntegerField(default=0)
+    deferred_count = models.PositiveIntegerField(default=0)
+    
+    # Reported by service workers
+    display_count = models.PositiveIntegerField(default=0)
+    click_count = models.PositiveIntegerField(default=0)
+    
+    # LatencySketch.to_dict() of the attempts' latencies in milliseconds
+    latency_sketch = models.JSONField(default=dict)
+    
+    class Meta:
+        unique_together = ("campaign", "origin", "bucket")
+    
+    def __str__(self):
+        return f"Campaign {self.campaign_id} {self.origin} {self.bucket:%Y-%m-%d %H:%M}"
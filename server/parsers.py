@@ -0,0 +1,43 @@
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:  # Optional; the standard library is used without it
+    orjson = None
+
+
+def use_orjson():
+    """Return True if orjson is installed and enabled by JSON_BACKEND."""
+    return orjson is not None and settings.JSON_BACKEND != "json"
+
+
+def loads(data):
+    """
+    Parse a JSON document (str or bytes) with the fastest available backend.
+    
+    Raises:
+        json.JSONDecodeError: If the document is invalid (orjson's error is a subclass)
+    """
+    if use_orjson():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser backed by orjson when it is installed.
+    
+    Large group sends post hundreds of thousands of subscriptions in one
+    body; orjson parses them several times faster than the json module.
+    """
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        if not use_orjson():
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -0,0 +1,194 @@
+import cProfile
+import os
+import pstats
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from .models import AdminToken
+
+# Request header that asks for a profile: "1" (summary headers) or "store"
+# (summary headers and the full profile saved for download)
+PROFILE_HEADER = "HTTP_X_PROFILE"
+TOKEN_HEADER = "HTTP_X_ADMIN_TOKEN"
+
+# Stages reported in the Server-Timing header: (name, file suffix, function)
+STAGES = (
+    ("parse", "rest_framework/request.py", "_parse"),
+    ("db", "django/db/backends/utils.py", "_execute"),
+    ("vapid", "server/push.py", "get_vapid_headers"),
+    ("encrypt", "server/push.py", "encrypt_payload"),
+    ("deliver", "server/fanout.py", "deliver"),
+    ("http", "requests/sessions.py", "request"),
+    ("render", "rest_framework/response.py", "rendered_content"),
+)
+
+# One profile at a time per process: cProfile cannot nest
+_profile_lock = threading.Lock()
+
+
+def _allow_profile():
+    """Count a profile against the cache-wide PROFILING_MAX_PER_MINUTE limit."""
+    key = f"profiling:{int(time.time() // 60)}"
+    cache.add(key, 0, timeout=120)
+    try:
+        return cache.incr(key) <= settings.PROFILING_MAX_PER_MINUTE
+    except ValueError:
+        return False
+
+
+def _get_admin_token_id(request):
+    """Return the id of the admin token in the request headers, or None."""
+    token = request.META.get(TOKEN_HEADER)
+    if not token:
+        return None
+    try:
+        return AdminToken.objects.filter(token=token).values_list("pk", flat=True).first()
+    except (ValueError, ValidationError):
+        return None
+
+
+def _function_name(function):
+    filename, line, name = function
+    parts = filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{name} ({'/'.join(parts[-2:])}:{line})"
+
+
+def summarize_profile(stats, elapsed, top=None):
+    """
+    Summarize a profile as response headers.
+
+    Args:
+        stats: pstats.Stats of the request
+        elapsed: Wall time of the request in seconds
+        top: Number of hot functions to list (defaults to PROFILING_TOP)
+
+    Returns:
+        dict: Server-Timing (total and stage durations) and X-Profile-Top
+        (functions with the most own time) headers
+    """
+    top = top or settings.PROFILING_TOP
+    timings = [f"total;dur={elapsed * 1000:.1f}"]
+    stage_times = dict.fromkeys(name for name, _, _ in STAGES)
+    for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items():
+        for name, suffix, stage_function in STAGES:
+            if function == stage_function and filename.replace(os.sep, "/").endswith(suffix):
+                stage_times[name] = (stage_times[name] or 0) + cumulative
+    timings.extend(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stage_times.items() if seconds)
+
+    hot = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return {
+        "Server-Timing": ", ".join(timings),
+        "X-Profile-Top": "; ".join(
+            f"{_function_name(function)} {own * 1000:.1f}ms/{calls}"
+            for function, (_, calls, own, _, _) in hot
+        ),
+    }
+
+
+def store_profile(profiler, token_id):
+    """
+    Save a full profile (pstats format) to PROFILING_DIR.
+
+    Args:
+        profiler: cProfile.Profile of the request
+        token_id: AdminToken that requested the profile; only it can download it
+
+    Returns:
+        str: Profile id, to download it from the profiles endpoint
+    """
+    profile_id = uuid.uuid4().hex
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    profiler.dump_stats(get_profile_path(profile_id, token_id))
+    prune_profiles()
+    return profile_id
+
+
+def get_profile_path(profile_id, token_id):
+    """Return the file a stored profile is saved to; the owning token is part of the name."""
+    return os.path.join(settings.PROFILING_DIR, f"{token_id}-{profile_id}.prof")
+
+
+def prune_profiles():
+    """
+    Delete stored profiles older than PROFILING_RETENTION_HOURS, and the
+    oldest ones beyond PROFILING_MAX_STORED.
+
+    Runs whenever a profile is stored, so the directory stays bounded
+    without a separate job.
+
+    Returns:
+        int: Number of profiles deleted
+    """
+    try:
+        entries = [entry for entry in os.scandir(settings.PROFILING_DIR) if entry.name.endswith(".prof")]
+    except FileNotFoundError:
+        return 0
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    cutoff = time.time() - settings.PROFILING_RETENTION_HOURS * 3600
+    deleted = 0
+    for position, entry in enumerate(entries):
+        if position >= settings.PROFILING_MAX_STORED or entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                deleted += 1
+            except FileNotFoundError:
+                # Pruned concurrently by another process
+                pass
+    return deleted
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request on demand.
+
+    A request carrying X-Profile and a valid X-Admin-Token header is run
+    under cProfile. Timings per stage are returned in the Server-Timing
+    header and the functions with the most own time in X-Profile-Top. With
+    "X-Profile: store" the full profile is saved and its id returned in
+    X-Profile-Id; only the token that asked for it can download it. At
+    most PROFILING_MAX_PER_MINUTE requests are profiled (over all processes
+    sharing the cache), one at a time per process; others get
+    "X-Profile: skipped".
+
+    cProfile only sees the request's own thread: time spent in the inline
+    send thread pool or in send processes shows up as waiting in deliver.
+
+    Requests without the header cost one dictionary lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = request.META.get(PROFILE_HEADER)
+        if not mode or not settings.PROFILING_ENABLED:
+            return self.get_response(request)
+        token_id = _get_admin_token_id(request)
+        if token_id is None:
+            return self.get_response(request)
+
+        if not _allow_profile() or not _profile_lock.acquire(blocking=False):
+            response = self.get_response(request)
+            response["X-Profile"] = "skipped"
+            return response
+
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+        finally:
+            _profile_lock.release()
+
+        for header, value in summarize_profile(pstats.Stats(profiler), elapsed).items():
+            response[header] = value
+        if mode.strip().lower() == "store":
+            response["X-Profile-Id"] = store_profile(profiler, token_id)
+        return response
@@ -0,0 +1,341 @@
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from decouple import config
+from django.conf import settings
+from py_vapid import Vapid
+from .circuit import get_breaker
+from .records import SubscriptionRecord
+from .tracking import add_tracking, tracking_overhead
+from .vapid_keys import load_key_set
+
+# Seconds a signed VAPID JWT is valid for, and how long before expiry it is renewed
+VAPID_JWT_LIFETIME = 12 * 60 * 60
+VAPID_JWT_RENEW_MARGIN = 10 * 60
+
+# aes128gcm record size (RFC 8188); payloads always fit in a single record
+RECORD_SIZE = 4096
+
+# Largest payload push services must accept (RFC 8291 section 4): a 4096-byte
+# body less the header (16-byte salt, record size, key id length and the
+# 65-byte server key), the 16-byte AES-GCM tag and the padding delimiter
+MAX_PAYLOAD_SIZE = RECORD_SIZE - (16 + 4 + 1 + 65) - 16 - 1
+
+# Outcomes of a single delivery
+SENT = "sent"
+FAILED = "failed"
+EXPIRED = "expired"
+DEFERRED = "deferred"  # Push service circuit is open, retry later
+
+# Push service answers for subscriptions that no longer exist (RFC 8030 section 7.3)
+GONE_STATUS_CODES = (404, 410)
+
+# Result of a single delivery. status_code is the push service's HTTP status
+# (None if no response was received); latency_ms covers encryption and the request.
+PushResult = namedtuple("PushResult", ["outcome", "error", "status_code", "latency_ms"], defaults=[None, 0.0])
+
+# Per-process state (send processes are spawned, so they start empty)
+_local = threading.local()
+_vapid_lock = threading.Lock()
+_vapid_keys = OrderedDict()  # key set id (None = environment keys) -> VapidKey, least recently used first
+
+
+class VapidKey:
+    """A parsed VAPID key with its own cache of signed JWTs."""
+    __slots__ = ("vapid", "subject", "headers")
+    
+    def __init__(self, vapid, subject):
+        self.vapid = vapid
+        self.subject = subject
+        self.headers = {}  # origin -> (headers, expires_at)
+
+
+def get_session():
+    """
+    Return this thread's HTTP session, keeping connections to push services alive.
+    
+    Returns:
+        requests.Session: Session with a pooled HTTPS adapter
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=settings.PUSH_POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _local.session = session
+    return session
+
+
+def get_endpoint_origin(endpoint):
+    """Return the scheme://host[:port] origin of a push endpoint (the VAPID audience)."""
+    parsed = urlparse(endpoint)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def get_vapid_key(key_set_id=None):
+    """
+    Return a parsed VAPID key, loading and decrypting it once per process.
+    
+    At most VAPID_KEY_CACHE_SIZE tenant keys are kept; the least recently
+    used one is dropped (with its JWTs) when another tenant's key is loaded.
+    The environment key is never evicted.
+    
+    Args:
+        key_set_id: VapidKeySet id, or None for VAPID_PRIVATE_KEY/VAPID_SUBJECT
+        
+    Returns:
+        VapidKey: The key and its JWT cache
+        
+    Raises:
+        ValueError: If the key set does not exist or cannot be decrypted
+    """
+    key = _vapid_keys.get(key_set_id)
+    if key is not None:
+        if key_set_id is not None:
+            with _vapid_lock:
+                if key_set_id in _vapid_keys:
+                    _vapid_keys.move_to_end(key_set_id)
+        return key
+    
+    if key_set_id is None:
+        private_key, subject = config("VAPID_PRIVATE_KEY"), config("VAPID_SUBJECT")
+    else:
+        private_key, subject = load_key_set(key_set_id)
+    loaded = VapidKey(Vapid.from_string(private_key=private_key), subject)
+    with _vapid_lock:
+        key = _vapid_keys.setdefault(key_set_id, loaded)
+        tenants = [cached for cached in _vapid_keys if cached is not None]
+        for evicted in tenants[:max(0, len(tenants) - settings.VAPID_KEY_CACHE_SIZE)]:
+            del _vapid_keys[evicted]
+    return key
+
+
+def get_vapid():
+    """Parse the environment VAPID private key once per process."""
+    return get_vapid_key().vapid
+
+
+def get_vapid_headers(origin, key_set_id=None):
+    """
+    Return VAPID authorization headers for a push service origin.
+    
+    Signed JWTs are cached per key and origin and reused until shortly
+    before they expire, instead of signing a new one for every message.
+    
+    Args:
+        origin: Push service origin (the JWT audience)
+        key_set_id: VapidKeySet to sign with, or None for the environment key
+        
+    Returns:
+        dict: Authorization headers
+    """
+    key = get_vapid_key(key_set_id)
+    now = time.time()
+    cached = key.headers.get(origin)
+    if cached and cached[1] - VAPID_JWT_RENEW_MARGIN > now:
+        return cached[0]
+    
+    expires_at = int(now) + VAPID_JWT_LIFETIME
+    headers = key.vapid.sign({
+        "sub": key.subject,
+        "aud": origin,
+        "exp": expires_at,
+    })
+    key.headers[origin] = (headers, expires_at)
+    return headers
+
+
+class PayloadTooLarge(ValueError):
+    """Raised for payloads that do not fit in a single push message."""
+
+
+def check_payload_size(payload, tracking=False):
+    """
+    Reject a payload that push services would refuse, before anything is sent.
+    
+    Args:
+        payload: JSON-encoded notification payload
+        tracking: Keep room for the tracking field added to campaign messages
+        
+    Raises:
+        PayloadTooLarge: If the payload exceeds MAX_PAYLOAD_SIZE bytes
+    """
+    size = len(payload.encode("utf-8"))
+    if tracking:
+        size += tracking_overhead()
+    if size > MAX_PAYLOAD_SIZE:
+        raise PayloadTooLarge(f"Payload is {size} bytes, push services accept at most {MAX_PAYLOAD_SIZE}")
+
+
+def _hkdf(salt, ikm, info, length):
+    """Single-block HKDF-SHA256 (RFC 5869); every key derived here is <= 32 bytes."""
+    prk = hmac.new(salt, ikm, hashlib.sha256).digest()
+    return hmac.new(prk, info + b"\x01", hashlib.sha256).digest()[:length]
+
+
+def encrypt_payload(record, data, server_key=None, salt=None):
+    """
+    Encrypt a payload for one subscription (RFC 8291, aes128gcm).
+    
+    Uses the record's pre-decoded keys and cached public key, so the only
+    per-message EC work is the ephemeral key pair and the ECDH exchange.
+    Checked against the RFC 8291 section 5 example in server/tests.py.
+    
+    Args:
+        record: SubscriptionRecord of the recipient
+        data: Payload bytes
+        server_key: Ephemeral EC private key; only tests pass a fixed one
+        salt: 16-byte salt; only tests pass a fixed one
+        
+    Returns:
+        bytes: Encrypted request body
+        
+    Raises:
+        PayloadTooLarge: If the payload does not fit in a single record
+        ValueError: If the subscription's public key is invalid
+    """
+    if len(data) > MAX_PAYLOAD_SIZE:
+        raise PayloadTooLarge(f"Payload is {len(data)} bytes, push services accept at most {MAX_PAYLOAD_SIZE}")
+    server_key = server_key or ec.generate_private_key(ec.SECP256R1())
+    server_public = server_key.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    shared_secret = server_key.exchange(ec.ECDH(), record.public_key)
+    
+    ikm = _hkdf(record.auth, shared_secret, b"WebPush: info\x00" + record.p256dh + server_public, 32)
+    salt = salt or os.urandom(16)
+    key = _hkdf(salt, ikm, b"Content-Encoding: aes128gcm\x00", 16)
+    nonce = _hkdf(salt, ikm, b"Content-Encoding: nonce\x00", 12)
+    
+    # A single (last) record: the payload followed by the 0x02 padding delimiter
+    ciphertext = AESGCM(key).encrypt(nonce, data + b"\x02", None)
+    header = salt + struct.pack("!IB", RECORD_SIZE, len(server_public)) + server_public
+    return header + ciphertext
+
+
+def encode_push(record, payload, urgency=None, ttl=0, vapid_key_id=None):
+    """
+    Build the headers and encrypted (aes128gcm) body of a push request.
+    
+    This is all the per-recipient CPU work of a send; dry runs stop here.
+    
+    Args:
+        record: SubscriptionRecord of the recipient
+        payload: JSON-encoded notification payload
+        urgency: Web Push Urgency header value (very-low, low, normal, high)
+        ttl: Web Push TTL header value in seconds
+        vapid_key_id: VapidKeySet of the sending tenant (None = environment key)
+        
+    Returns:
+        tuple: (headers dict, encrypted body bytes)
+    """
+    headers = dict(get_vapid_headers(record.origin, vapid_key_id))
+    headers["TTL"] = str(ttl)
+    headers["Content-Encoding"] = "aes128gcm"
+    if urgency:
+        headers["Urgency"] = urgency
+    body = encrypt_payload(record, payload.encode("utf-8"))
+    return headers, body
+
+
+def send_push(subscription, payload, timeout=None, urgency=None, ttl=0, deadline=None, campaign_id=None,
+              vapid_key_id=None):
+    """
+    Send a prepared payload to a single subscription.
+    
+    Messages whose deadline has passed are dropped before any encryption or
+    network work is done. Otherwise the TTL header is capped at the time
+    left until the deadline. Messages for a push service whose circuit
+    breaker is open are not attempted and come back as DEFERRED.
+    
+    Args:
+        subscription: SubscriptionRecord, or a subscription_info dict
+        payload: JSON-encoded notification payload
+        timeout: Request timeout in seconds (defaults to PUSH_TIMEOUT)
+        urgency: Web Push Urgency header value (very-low, low, normal, high)
+        ttl: Seconds the push service should keep the message for offline devices
+        deadline: Unix timestamp after which the message must not be delivered
+        campaign_id: Campaign to sign into the payload's tracking field
+            (see tracking.add_tracking); None sends the payload as is
+        vapid_key_id: VapidKeySet of the sending tenant (None = environment key)
+        
+    Returns:
+        PushResult: outcome (SENT, FAILED, EXPIRED or DEFERRED), error
+        message or None, HTTP status code and latency
+    """
+    if deadline is not None:
+        remaining = int(deadline - time.time())
+        if remaining <= 0:
+            return PushResult(EXPIRED, "Deadline has passed")
+        ttl = min(ttl, remaining)
+    
+    try:
+        record = SubscriptionRecord.from_info(subscription)
+    except ValueError as ex:
+        return PushResult(FAILED, str(ex))
+    
+    breaker = get_breaker(record.origin)
+    if not breaker.allow():
+        return PushResult(DEFERRED, f"Circuit open for {record.origin}")
+    
+    if campaign_id is not None:
+        payload = add_tracking(payload, campaign_id, record.subscription_id, record.origin, record.endpoint)
+    
+    started = time.perf_counter()
+    try:
+        headers, body = encode_push(record, payload, urgency, ttl, vapid_key_id)
+        response = get_session().post(
+            record.endpoint,
+            data=body,
+            headers=headers,
+            timeout=timeout or settings.PUSH_TIMEOUT,
+        )
+    except requests.RequestException as ex:
+        breaker.record_failure()
+        return PushResult(FAILED, str(ex), None, (time.perf_counter() - started) * 1000)
+    except Exception as ex:
+        # Encryption errors (e.g. malformed keys) say nothing about the push service
+        breaker.release()
+        return PushResult(FAILED, str(ex))
+    latency_ms = (time.perf_counter() - started) * 1000
+    
+    # Throttling and server errors count against the push service; other
+    # responses (including 404/410 for stale subscriptions) show it is healthy
+    if response.status_code == 429 or response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    
+    if response.status_code > 202:
+        return PushResult(FAILED, f"Push failed: {response.status_code} {response.reason}", response.status_code, latency_ms)
+    return PushResult(SENT, None, response.status_code, latency_ms)
+
+
+def simulate_push(subscription, payload, urgency=None, ttl=0, campaign_id=None, vapid_key_id=None,
+                  **unused_options):
+    """
+    Do everything send_push does except the network request (dry run).
+    
+    Returns:
+        tuple: (origin, encrypted body size in bytes), or (None, error) for
+        subscriptions that cannot be encrypted for
+    """
+    try:
+        record = SubscriptionRecord.from_info(subscription)
+        if campaign_id is not None:
+            payload = add_tracking(payload, campaign_id, record.subscription_id, record.origin, record.endpoint)
+        headers, body = encode_push(record, payload, urgency, ttl, vapid_key_id)
+    except Exception as ex:
+        return None, str(ex)
+    return record.origin, len(body)
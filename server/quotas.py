@@ -0,0 +1,245 @@
+import atexit
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import TokenUsage
+
+# Sliding windows: (name, AdminToken field, QUOTA_* setting, seconds)
+WINDOWS = (
+    ("minute", "messages_per_minute", "QUOTA_MESSAGES_PER_MINUTE", 60),
+    ("day", "messages_per_day", "QUOTA_MESSAGES_PER_DAY", 24 * 60 * 60),
+)
+
+
+class QuotaExceeded(Exception):
+    """Raised when a send would exceed one of the token's quotas."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_limit(token, field, setting):
+    """Return a token's limit: its own value, or the setting's default (0 = unlimited)."""
+    value = getattr(token, field)
+    return getattr(settings, setting) if value is None else value
+
+
+def _window_key(token, name, index):
+    return f"quota:{token.pk}:{name}:{index}"
+
+
+def _increment_window(token, name, seconds, now, messages):
+    """
+    Add messages to the current window and estimate the sliding window total.
+
+    Two fixed windows are kept in the cache; the previous one is weighted
+    by how much of it still overlaps the sliding window. The current
+    window's count is the value returned by the atomic increment, so it
+    includes every concurrent request counted before this one.
+
+    Returns:
+        tuple: (estimated messages in the last `seconds` seconds, current window key)
+    """
+    index, offset = divmod(now, seconds)
+    index = int(index)
+    current_key = _window_key(token, name, index)
+    # Both windows overlap the sliding window for up to 2 windows
+    cache.add(current_key, 0, timeout=2 * seconds)
+    try:
+        current = cache.incr(current_key, messages)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.add(current_key, 0, timeout=2 * seconds)
+        current = cache.incr(current_key, messages)
+    previous = cache.get(_window_key(token, name, index - 1), 0)
+    return current + previous * (1 - offset / seconds), current_key
+
+
+def get_remaining_quota(token):
+    """
+    Estimate what is left of a token's quotas, without consuming any.
+
+    Returns:
+        dict: Window name -> {"limit", "remaining"} for each limited window,
+        plus "max_group_size" if the token has one
+    """
+    quota = {}
+    if not settings.QUOTAS_ENABLED:
+        return quota
+    max_group_size = get_limit(token, "max_group_size", "QUOTA_MAX_GROUP_SIZE")
+    if max_group_size:
+        quota["max_group_size"] = max_group_size
+    now = time.time()
+    for name, field, setting, seconds in WINDOWS:
+        limit = get_limit(token, field, setting)
+        if not limit:
+            continue
+        index, offset = divmod(now, seconds)
+        index = int(index)
+        counts = cache.get_many([_window_key(token, name, index), _window_key(token, name, index - 1)])
+        used = counts.get(_window_key(token, name, index), 0)
+        used += counts.get(_window_key(token, name, index - 1), 0) * (1 - offset / seconds)
+        quota[name] = {"limit": limit, "remaining": max(0, int(limit - used))}
+    return quota
+
+
+def consume_quota(token, messages):
+    """
+    Count messages against a token's sliding-window quotas.
+
+    Counters are incremented first and the limit is checked against the
+    incremented value; a rejected request rolls its increment back. Two
+    concurrent requests therefore never both pass on the same count. The
+    counters live in the Django cache: with a shared cache the quotas hold
+    across all processes, with the per-process LocMem default each worker
+    enforces them on its own.
+
+    Args:
+        token: AdminToken sending
+        messages: Number of messages the request sends or queues
+
+    Returns:
+        list: Cache keys of the windows counted, for release_quota
+
+    Raises:
+        QuotaExceeded: If the group is too large or a window is full
+    """
+    if not settings.QUOTAS_ENABLED:
+        return []
+    max_group_size = get_limit(token, "max_group_size", "QUOTA_MAX_GROUP_SIZE")
+    if max_group_size and messages > max_group_size:
+        raise QuotaExceeded(f"At most {max_group_size} recipients per send")
+
+    now = time.time()
+    consumed = []
+    try:
+        for name, field, setting, seconds in WINDOWS:
+            limit = get_limit(token, field, setting)
+            if not limit:
+                continue
+            count, key = _increment_window(token, name, seconds, now, messages)
+            consumed.append(key)
+            if count > limit:
+                raise QuotaExceeded(
+                    f"Quota of {limit} messages per {name} exceeded",
+                    retry_after=max(1, int(seconds - now % seconds)),
+                )
+    except QuotaExceeded:
+        release_quota(consumed, messages)
+        raise
+    return consumed
+
+
+def release_quota(keys, messages):
+    """Give back messages counted in the windows returned by consume_quota."""
+    for key in keys:
+        try:
+            cache.decr(key, messages)
+        except ValueError:
+            # The window expired meanwhile
+            pass
+
+
+class UsageCounters:
+    """
+    Per-token usage counted in memory.
+
+    Every USAGE_FLUSH_SECONDS (checked on each request, and at exit) the
+    counts are added to TokenUsage with one UPDATE ... SET n = n + delta
+    per token and day.
+    """
+
+    def __init__(self, flush_seconds=None):
+        self.flush_seconds = settings.USAGE_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.counts = {}  # (token id, day) -> Counter of requests, messages, rejected
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, token_id, requests=0, messages=0, rejected=0):
+        key = (token_id, timezone.now().date())
+        with self.lock:
+            counts = self.counts.get(key)
+            if counts is None:
+                counts = self.counts[key] = Counter()
+            counts["requests"] += requests
+            counts["messages"] += messages
+            counts["rejected"] += rejected
+            due = time.monotonic() - self.flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the aggregated usage. Failures are reported and the counts dropped."""
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            self.flushed_at = time.monotonic()
+        if not counts:
+            return
+        try:
+            with transaction.atomic():
+                TokenUsage.objects.bulk_create(
+                    [TokenUsage(admin_token_id=token_id, day=day) for token_id, day in counts],
+                    ignore_conflicts=True,
+                )
+                for (token_id, day), delta in counts.items():
+                    TokenUsage.objects.filter(admin_token_id=token_id, day=day).update(
+                        **{field: F(field) + value for field, value in delta.items() if value}
+                    )
+        except Exception as e:
+            print(f"Error writing token usage: {e}")
+
+
+_usage = None
+_usage_lock = threading.Lock()
+
+
+def get_usage_counters():
+    """Return this process's usage counters."""
+    global _usage
+    if _usage is None:
+        with _usage_lock:
+            if _usage is None:
+                _usage = UsageCounters()
+                atexit.register(_usage.flush)
+    return _usage
+
+
+def reserve_send(token, messages):
+    """
+    Apply the token's quotas to a send and account for it.
+
+    Returns:
+        tuple: (QuotaExceeded or None, reservation for refund_send)
+    """
+    try:
+        keys = consume_quota(token, messages)
+    except QuotaExceeded as ex:
+        get_usage_counters().add(token.pk, rejected=1)
+        return ex, None
+    get_usage_counters().add(token.pk, requests=1, messages=messages)
+    return None, (keys, messages)
+
+
+def refund_send(reservation):
+    """
+    Give back the quota of a reserved send that sent nothing (e.g. deferred).
+
+    Usage counters keep the request: it was made, only not delivered.
+    """
+    release_quota(*reservation)
+
+
+def check_send(token, messages):
+    """
+    Apply the token's quotas to a send and account for it.
+
+    Returns:
+        QuotaExceeded or None: The exceeded quota, if the send is rejected
+    """
+    return reserve_send(token, messages)[0]
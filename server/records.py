@@ -0,0 +1,132 @@
+import base64
+import sys
+from urllib.parse import urlparse
+
+
+def decode_key(value):
+    """Decode a base64url (padding optional) subscription key."""
+    value = value.strip()
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def encode_key(value):
+    """Encode key bytes as unpadded base64url, the format browsers use."""
+    return base64.urlsafe_b64encode(value).decode("ascii").rstrip("=")
+
+
+class SubscriptionRecord:
+    """
+    Compact, pre-decoded push subscription used by the send hot loop.
+
+    Keys are base64-decoded and the endpoint origin parsed once, when the
+    subscription enters the server, instead of on every send. The receiver's
+    EC public key is loaded on first use and kept on the record; it is not
+    pickled, so records stay cheap to ship to send processes.
+    """
+    __slots__ = ("endpoint", "origin", "p256dh", "auth", "subscription_id", "_public_key")
+
+    def __init__(self, endpoint, p256dh, auth, subscription_id=None):
+        """
+        Args:
+            endpoint: Push service endpoint URL
+            p256dh: Uncompressed P-256 public key of the browser (65 bytes)
+            auth: Authentication secret (16 bytes)
+            subscription_id: Id of the stored Subscription, if any
+
+        Raises:
+            ValueError: If the endpoint or keys are malformed
+        """
+        if not isinstance(endpoint, str) or not endpoint.startswith(("https://", "http://")):
+            raise ValueError("endpoint must be an http(s) URL")
+        if len(p256dh) != 65 or p256dh[0] != 4:
+            raise ValueError("p256dh must be an uncompressed P-256 point")
+        if len(auth) != 16:
+            raise ValueError("auth must be 16 bytes")
+        parsed = urlparse(endpoint)
+        self.endpoint = endpoint
+        # Origins repeat across millions of records; share one string per origin
+        self.origin = sys.intern(f"{parsed.scheme}://{parsed.netloc}")
+        self.p256dh = p256dh
+        self.auth = auth
+        self.subscription_id = subscription_id
+        self._public_key = None
+
+    @classmethod
+    def from_info(cls, subscription_info):
+        """
+        Build a record from a browser-format subscription dict.
+
+        Args:
+            subscription_info: {"endpoint": ..., "keys": {"p256dh": ..., "auth": ...}}
+
+        Returns:
+            SubscriptionRecord: The decoded subscription
+
+        Raises:
+            ValueError: If the subscription is malformed
+        """
+        if isinstance(subscription_info, cls):
+            return subscription_info
+        if not isinstance(subscription_info, dict):
+            raise ValueError("invalid subscription: expected an object")
+        try:
+            keys = subscription_info["keys"]
+            return cls(subscription_info["endpoint"], decode_key(keys["p256dh"]), decode_key(keys["auth"]))
+        except (KeyError, TypeError, AttributeError) as ex:
+            raise ValueError(f"invalid subscription: missing {ex}")
+
+    @classmethod
+    def from_subscription(cls, subscription):
+        """Build a record from a stored Subscription."""
+        return cls(subscription.endpoint, decode_key(subscription.p256dh), decode_key(subscription.auth), subscription.pk)
+
+    @property
+    def public_key(self):
+        """
+        The receiver's EC public key, loaded once per record.
+
+        Raises:
+            ValueError: If p256dh is not a point on P-256
+        """
+        if self._public_key is None:
+            # Imported here so that importing records (views, serializers) stays cheap
+            from cryptography.hazmat.primitives.asymmetric import ec
+            self._public_key = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), self.p256dh)
+        return self._public_key
+
+    def as_subscription_info(self):
+        """Return the subscription in the format browsers and pywebpush use."""
+        return {
+            "endpoint": self.endpoint,
+            "keys": {"p256dh": encode_key(self.p256dh), "auth": encode_key(self.auth)},
+        }
+
+    def __getstate__(self):
+        return self.endpoint, self.origin, self.p256dh, self.auth, self.subscription_id
+
+    def __setstate__(self, state):
+        self.endpoint, origin, self.p256dh, self.auth, self.subscription_id = state
+        self.origin = sys.intern(origin)
+        self._public_key = None
+
+    def __repr__(self):
+        return f"<SubscriptionRecord {self.origin}>"
+
+
+def load_records(subscription_infos):
+    """
+    Decode a list of browser-format subscriptions.
+
+    Args:
+        subscription_infos: List of subscription_info dicts
+
+    Returns:
+        list: SubscriptionRecord per entry, or None for malformed entries
+    """
+    records = []
+    for subscription_info in subscription_infos:
+        try:
+            records.append(SubscriptionRecord.from_info(subscription_info))
+        except ValueError:
+            records.append(None)
+    return records
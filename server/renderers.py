@@ -0,0 +1,24 @@
+from rest_framework.renderers import JSONRenderer
+from .parsers import orjson, use_orjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson when it is installed.
+    
+    Values orjson does not handle natively (Decimal, lazy strings, ...) and
+    datetimes go through DRF's encoder, so the output matches JSONRenderer.
+    Indented (browsable or ?indent) responses still use JSONRenderer.
+    """
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        renderer_context = renderer_context or {}
+        if not use_orjson() or self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(
+            data,
+            default=self.encoder_class().default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        )
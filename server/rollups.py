@@ -0,0 +1,135 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from .models import CampaignRollup
+from .sketch import LatencySketch
+
+# Counter columns of CampaignRollup
+COUNT_FIELDS = ("sent_count", "failed_count", "expired_count", "deferred_count", "display_count", "click_count")
+
+# push outcome -> counter column
+OUTCOME_FIELDS = {
+    "sent": "sent_count",
+    "failed": "failed_count",
+    "expired": "expired_count",
+    "deferred": "deferred_count",
+}
+
+# Percentiles reported by the analytics API
+PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+
+def get_bucket(moment):
+    """Return the start of the ANALYTICS_BUCKET_SECONDS time bucket a moment falls in."""
+    seconds = settings.ANALYTICS_BUCKET_SECONDS
+    return moment.replace(microsecond=0) - timedelta(seconds=int(moment.timestamp()) % seconds)
+
+
+class RollupDeltas:
+    """
+    Rollup increments accumulated in memory between flushes.
+
+    Keyed by (campaign id, push service origin, time bucket); apply() adds
+    them to the CampaignRollup rows in one transaction.
+    """
+
+    def __init__(self):
+        self.counts = {}  # key -> Counter of COUNT_FIELDS
+        self.sketches = {}  # key -> LatencySketch
+
+    def __bool__(self):
+        return bool(self.counts)
+
+    def _counts(self, key):
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = Counter()
+        return counts
+
+    def add_result(self, campaign_id, origin, bucket, outcome, latency_ms):
+        """Count a delivery attempt and its latency (only attempts that made a request)."""
+        key = (campaign_id, origin, bucket)
+        self._counts(key)[OUTCOME_FIELDS[outcome]] += 1
+        if latency_ms:
+            sketch = self.sketches.get(key)
+            if sketch is None:
+                sketch = self.sketches[key] = LatencySketch()
+            sketch.add(latency_ms)
+
+    def add_count(self, campaign_id, origin, bucket, field, count=1):
+        """Add to one counter column (e.g. display_count)."""
+        self._counts((campaign_id, origin, bucket))[field] += count
+
+    def apply(self):
+        """
+        Add the increments to the rollup tables.
+
+        Missing rows are inserted first, then all touched rows are locked in
+        primary key order, merged and written back with one bulk_update, so
+        concurrent flushes from several processes never lose increments.
+        """
+        keys = list(self.counts)
+        with transaction.atomic():
+            CampaignRollup.objects.bulk_create(
+                [CampaignRollup(campaign_id=campaign_id, origin=origin, bucket=bucket)
+                 for campaign_id, origin, bucket in keys],
+                ignore_conflicts=True,
+            )
+            query = Q()
+            for campaign_id, origin, bucket in keys:
+                query |= Q(campaign_id=campaign_id, origin=origin, bucket=bucket)
+            rows = list(CampaignRollup.objects.select_for_update().filter(query).order_by("pk"))
+            for row in rows:
+                key = (row.campaign_id, row.origin, row.bucket)
+                for field, count in self.counts.get(key, {}).items():
+                    setattr(row, field, getattr(row, field) + count)
+                if key in self.sketches:
+                    sketch = LatencySketch.from_dict(row.latency_sketch)
+                    sketch.merge(self.sketches[key])
+                    row.latency_sketch = sketch.to_dict()
+            CampaignRollup.objects.bulk_update(rows, COUNT_FIELDS + ("latency_sketch",))
+
+
+def summarize_rows(rows):
+    """Sum counters and merge latency sketches of rollup rows."""
+    totals = dict.fromkeys(COUNT_FIELDS, 0)
+    sketch = LatencySketch()
+    for row in rows:
+        for field in COUNT_FIELDS:
+            totals[field] += row[field]
+        sketch.merge(LatencySketch.from_dict(row["latency_sketch"]))
+    totals["latency_ms"] = {
+        name: round(value, 2) if value is not None else None
+        for name, value in ((name, sketch.quantile(q)) for name, q in PERCENTILES)
+    }
+    return totals
+
+
+def get_campaign_analytics(campaign, group_by=None):
+    """
+    Campaign analytics from the rollup tables only.
+
+    Reads one row per push service and time bucket, never the raw
+    delivery log, so the cost does not depend on the campaign's size.
+
+    Args:
+        campaign: Campaign instance
+        group_by: None, "origin" or "bucket"
+
+    Returns:
+        dict: Totals, latency percentiles and optional groups
+    """
+    rows = list(campaign.rollups.values("origin", "bucket", "latency_sketch", *COUNT_FIELDS))
+    result = {"campaign_id": campaign.pk, "bucket_seconds": settings.ANALYTICS_BUCKET_SECONDS}
+    result.update(summarize_rows(rows))
+    if group_by in ("origin", "bucket"):
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[group_by], []).append(row)
+        result["groups"] = [
+            {group_by: key or None, **summarize_rows(group)}
+            for key, group in sorted(groups.items())
+        ]
+    return result
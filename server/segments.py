@@ -0,0 +1,428 @@
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Subscription
+
+# Last-active buckets, from most to least recent: (name, maximum age in days)
+ACTIVITY_BUCKETS = (("1d", 1), ("7d", 7), ("30d", 30), ("90d", 90))
+
+# Overlap used when reading rows changed since the last refresh, so rows
+# committed with a slightly older updated_at are not missed
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+TOKEN_PATTERN = re.compile(r"\s*(\(|\)|[^\s()]+)")
+
+# Bitmap blocks cover 2**16 ids; a block holds up to ARRAY_LIMIT ids as a
+# sorted array of 16-bit offsets (at 4096 ids that is as large as its 8 KB
+# of bits) and switches to a bit block beyond that
+BLOCK_BITS = 16
+BLOCK_MASK = (1 << BLOCK_BITS) - 1
+BLOCK_BYTES = 1 << (BLOCK_BITS - 3)
+ARRAY_LIMIT = 4096
+
+# Deletion log in the cache: incremental refreshes only see rows that still
+# exist, so hard-deleted ids are published here for every process to drop
+DELETION_SEQUENCE_KEY = "segments:deleted:seq"
+DELETION_ENTRY_KEY = "segments:deleted:{}"
+
+# Deletions a refresh applies one by one; more than that triggers a rebuild
+MAX_DELETIONS = 10000
+
+
+class SegmentError(ValueError):
+    """Raised for audience expressions that cannot be parsed."""
+
+
+def _to_bit_block(offsets):
+    bits = bytearray(BLOCK_BYTES)
+    for offset in offsets:
+        bits[offset >> 3] |= 1 << (offset & 7)
+    return bits
+
+
+class Bitmap:
+    """
+    Compressed, mutable bitmap over subscription ids.
+
+    Ids are split into blocks of 2**16 (as in Roaring bitmaps). A block is a
+    sorted array of offsets while it is sparse and a bytearray of bits once
+    it holds more than ARRAY_LIMIT ids, so a tag on a few thousand
+    subscriptions costs a few KB however large the ids grow. Boolean algebra
+    converts to Python ints, whose &, | and ~ run over the whole bitmap in C;
+    only the query's operands are expanded, never the stored index.
+    """
+    __slots__ = ("blocks",)
+
+    def __init__(self):
+        self.blocks = {}  # block number -> array("H") of offsets, or bytearray of bits
+
+    def add(self, position):
+        number, offset = position >> BLOCK_BITS, position & BLOCK_MASK
+        block = self.blocks.get(number)
+        if block is None:
+            self.blocks[number] = array("H", (offset,))
+        elif isinstance(block, bytearray):
+            block[offset >> 3] |= 1 << (offset & 7)
+        else:
+            index = bisect_left(block, offset)
+            if index < len(block) and block[index] == offset:
+                return
+            if len(block) < ARRAY_LIMIT:
+                block.insert(index, offset)
+            else:
+                bits = self.blocks[number] = _to_bit_block(block)
+                bits[offset >> 3] |= 1 << (offset & 7)
+
+    def discard(self, position):
+        number, offset = position >> BLOCK_BITS, position & BLOCK_MASK
+        block = self.blocks.get(number)
+        if block is None:
+            return
+        if isinstance(block, bytearray):
+            # Bit blocks are compacted by the next full rebuild
+            block[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+            return
+        index = bisect_left(block, offset)
+        if index < len(block) and block[index] == offset:
+            del block[index]
+            if not block:
+                del self.blocks[number]
+
+    def to_int(self):
+        if not self.blocks:
+            return 0
+        data = bytearray((max(self.blocks) + 1) * BLOCK_BYTES)
+        for number, block in self.blocks.items():
+            start = number * BLOCK_BYTES
+            if isinstance(block, bytearray):
+                data[start:start + BLOCK_BYTES] = block
+            else:
+                for offset in block:
+                    data[start + (offset >> 3)] |= 1 << (offset & 7)
+        return int.from_bytes(data, "little")
+
+
+def iter_positions(value):
+    """Yield the positions of the set bits of an int bitmap in ascending order."""
+    data = value.to_bytes((value.bit_length() + 7) // 8, "little")
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield (index << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+def get_key_term(vapid_key_id):
+    """Return the index term of the subscriptions made with a key set (None = the default key)."""
+    return f"key:{vapid_key_id or 'default'}"
+
+
+def get_owner_term(admin_token_id):
+    """Return the index term of the subscriptions owned by a token (None = no owner)."""
+    return f"token:{admin_token_id or 'none'}"
+
+
+def get_activity_bucket(last_active_at, now):
+    """Return the name of the last-active bucket a timestamp falls in."""
+    if last_active_at is None:
+        return "never"
+    age = now - last_active_at
+    for name, days in ACTIVITY_BUCKETS:
+        if age <= timedelta(days=days):
+            return name
+    return "older"
+
+
+class SegmentIndex:
+    """
+    In-memory bitmap indexes over active subscriptions.
+
+    Indexed terms (the keys of `self.bitmaps`):
+    - tag:<name>
+    - vendor:<google|mozilla|apple|microsoft|other>
+    - attr:<key>=<value>
+    - bucket:<1d|7d|30d|90d|older|never>   (last-active bucket)
+    - key:<key set id|default>            (VAPID key set, see get_key_term;
+                                           not usable in expressions)
+    - token:<admin token id|none>         (owner, see get_owner_term;
+                                           not usable in expressions)
+
+    The index is refreshed incrementally from rows whose updated_at is newer
+    than the previous refresh and from the deletion log, and rebuilt
+    completely every SEGMENT_FULL_REBUILD_SECONDS so that last-active
+    buckets age. Rebuilds run in a background thread and the new bitmaps
+    are swapped in at once; queries are answered from the old ones meanwhile.
+    """
+
+    def __init__(self):
+        self.bitmaps = {}
+        self.members = {}  # subscription id -> tuple of terms it is indexed under
+        self.all = Bitmap()
+        self.synced_at = None
+        self.deletion_seq = None  # Last deletion log entry applied
+        self.built_at = 0.0
+        self.lock = threading.Lock()
+        self.rebuild_lock = threading.Lock()
+
+    def _add(self, row, now):
+        terms = [f"tag:{tag}" for tag in row["tags"] or []]
+        terms.append(f"vendor:{row['vendor']}")
+        terms.extend(f"attr:{key}={value}" for key, value in (row["attributes"] or {}).items())
+        terms.append(f"bucket:{get_activity_bucket(row['last_active_at'], now)}")
+        terms.append(get_key_term(row["vapid_key_id"]))
+        terms.append(get_owner_term(row["admin_token_id"]))
+        for term in terms:
+            bitmap = self.bitmaps.get(term)
+            if bitmap is None:
+                bitmap = self.bitmaps[term] = Bitmap()
+            bitmap.add(row["id"])
+        self.all.add(row["id"])
+        self.members[row["id"]] = tuple(terms)
+
+    def _remove(self, subscription_id):
+        for term in self.members.pop(subscription_id, ()):
+            self.bitmaps[term].discard(subscription_id)
+        self.all.discard(subscription_id)
+
+    @staticmethod
+    def _rows():
+        return Subscription.objects.values(
+            "id", "tags", "vendor", "attributes", "last_active_at", "is_active", "vapid_key_id",
+            "admin_token_id",
+        ).order_by("id")
+
+    def rebuild(self):
+        """
+        Build every bitmap from scratch and swap them in.
+
+        The new bitmaps are built without holding the index lock. Rows
+        changed while building are picked up by the refresh that follows.
+        """
+        started = timezone.now()
+        deletion_seq = cache.get(DELETION_SEQUENCE_KEY, 0)
+        fresh = SegmentIndex()
+        for row in self._rows().filter(is_active=True).iterator(chunk_size=5000):
+            fresh._add(row, started)
+        with self.lock:
+            self.bitmaps, self.members, self.all = fresh.bitmaps, fresh.members, fresh.all
+            self.synced_at = started
+            self.deletion_seq = deletion_seq
+            self.built_at = time.monotonic()
+        self.refresh()
+
+    def start_rebuild(self):
+        """Rebuild in a background thread, unless a rebuild is already running."""
+        if not self.rebuild_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception as e:
+                # Retried after another SEGMENT_FULL_REBUILD_SECONDS
+                self.built_at = time.monotonic()
+                print(f"Error rebuilding segment index: {e}")
+            finally:
+                connection.close()
+                self.rebuild_lock.release()
+
+        threading.Thread(target=run, name="segment-rebuild", daemon=True).start()
+
+    def refresh(self):
+        """Apply rows changed and ids deleted since the previous refresh."""
+        now = timezone.now()
+        with self.lock:
+            rows = self._rows().filter(updated_at__gte=self.synced_at - REFRESH_OVERLAP)
+            for row in rows.iterator(chunk_size=5000):
+                self._remove(row["id"])
+                if row["is_active"]:
+                    self._add(row, now)
+            complete = self._apply_deletions()
+            self.synced_at = now
+        if not complete:
+            self.start_rebuild()
+
+    def _apply_deletions(self):
+        """
+        Drop ids published to the deletion log since the last refresh.
+
+        Returns:
+            bool: False if entries were lost or too many to apply, and the
+            index needs a rebuild
+        """
+        seq = cache.get(DELETION_SEQUENCE_KEY, 0)
+        if seq == self.deletion_seq:
+            return True
+        if seq < self.deletion_seq or seq - self.deletion_seq > MAX_DELETIONS:
+            self.deletion_seq = seq
+            return False
+        keys = [DELETION_ENTRY_KEY.format(number) for number in range(self.deletion_seq + 1, seq + 1)]
+        entries = cache.get_many(keys)
+        for subscription_id in entries.values():
+            self._remove(subscription_id)
+        self.deletion_seq = seq
+        return len(entries) == len(keys)
+
+    def ensure_fresh(self):
+        """
+        Refresh the index if it is older than SEGMENT_REFRESH_SECONDS.
+
+        The first build runs in the calling thread; later full rebuilds run
+        in the background (see rebuild).
+        """
+        if self.synced_at is None:
+            with self.rebuild_lock:
+                if self.synced_at is None:
+                    self.rebuild()
+            return
+        if time.monotonic() - self.built_at >= settings.SEGMENT_FULL_REBUILD_SECONDS:
+            self.start_rebuild()
+        if timezone.now() - self.synced_at >= timedelta(seconds=settings.SEGMENT_REFRESH_SECONDS):
+            self.refresh()
+
+    def term(self, token, everyone):
+        """Return the int bitmap for a single expression term."""
+        field, _, value = token.partition(":")
+        if token == "*":
+            return everyone
+        if not value:
+            raise SegmentError(f"Invalid term '{token}', expected field:value")
+        if field == "active":
+            # active:7d matches every bucket up to 7 days
+            days = value[:-1] if value.endswith("d") else value
+            if not days.isdigit():
+                raise SegmentError(f"Invalid activity window '{value}'")
+            result = 0
+            for name, bucket_days in ACTIVITY_BUCKETS:
+                if bucket_days <= int(days):
+                    result |= self._bitmap(f"bucket:{name}")
+            return result
+        if field not in ("tag", "vendor", "attr"):
+            raise SegmentError(f"Unknown field '{field}'")
+        return self._bitmap(token)
+
+    def _bitmap(self, key):
+        bitmap = self.bitmaps.get(key)
+        return bitmap.to_int() if bitmap is not None else 0
+
+    def evaluate(self, expression, scope=None):
+        """
+        Evaluate a boolean audience expression.
+
+        Grammar (AND binds tighter than OR):
+            expr := and ("OR" and)*
+            and  := not ("AND" not)*
+            not  := "NOT" not | "(" expr ")" | term
+            term := tag:<name> | vendor:<name> | attr:<key>=<value> | active:<days>d | *
+
+        Args:
+            expression: e.g. "tag:news AND NOT vendor:apple"
+            scope: Terms the whole evaluation is restricted to (their
+                intersection), e.g. an owner and a key term; "*" and NOT
+                then only cover those subscriptions
+
+        Returns:
+            int: Bitmap of matching subscription ids
+
+        Raises:
+            SegmentError: If the expression is invalid
+        """
+        tokens = TOKEN_PATTERN.findall(expression)
+        if not tokens:
+            raise SegmentError("Audience expression is empty")
+        with self.lock:
+            everyone = self.all.to_int()
+            for term in scope or ():
+                everyone &= self._bitmap(term)
+            result, position = self._parse_or(tokens, 0, everyone)
+            result &= everyone
+        if position != len(tokens):
+            raise SegmentError(f"Unexpected '{tokens[position]}'")
+        return result
+
+    def _parse_or(self, tokens, position, everyone):
+        result, position = self._parse_and(tokens, position, everyone)
+        while position < len(tokens) and tokens[position].upper() == "OR":
+            right, position = self._parse_and(tokens, position + 1, everyone)
+            result |= right
+        return result, position
+
+    def _parse_and(self, tokens, position, everyone):
+        result, position = self._parse_not(tokens, position, everyone)
+        while position < len(tokens) and tokens[position].upper() == "AND":
+            right, position = self._parse_not(tokens, position + 1, everyone)
+            result &= right
+        return result, position
+
+    def _parse_not(self, tokens, position, everyone):
+        if position >= len(tokens):
+            raise SegmentError("Unexpected end of expression")
+        token = tokens[position]
+        if token.upper() == "NOT":
+            result, position = self._parse_not(tokens, position + 1, everyone)
+            return everyone & ~result, position
+        if token == "(":
+            result, position = self._parse_or(tokens, position + 1, everyone)
+            if position >= len(tokens) or tokens[position] != ")":
+                raise SegmentError("Missing ')'")
+            return result, position + 1
+        if token == ")" or token.upper() in ("AND", "OR"):
+            raise SegmentError(f"Unexpected '{token}'")
+        return self.term(token, everyone), position + 1
+
+
+@receiver(post_delete, sender=Subscription)
+def _publish_deletion(sender, instance, **kwargs):
+    # Also sent for each row of a QuerySet.delete(); raw SQL deletes are
+    # only dropped by the next full rebuild
+    cache.add(DELETION_SEQUENCE_KEY, 0, None)
+    try:
+        seq = cache.incr(DELETION_SEQUENCE_KEY)
+    except ValueError:
+        return
+    # Entries older than a full rebuild are covered by the rebuild
+    cache.set(DELETION_ENTRY_KEY.format(seq), instance.pk, 2 * settings.SEGMENT_FULL_REBUILD_SECONDS)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_segment_index():
+    """Return this process's segment index, refreshed if it is stale."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SegmentIndex()
+    _index.ensure_fresh()
+    return _index
+
+
+def resolve_audience(expression, admin_token_id, vapid_key_id=None):
+    """
+    Resolve an audience expression to a stream of subscription ids.
+
+    Only subscriptions owned by the sending token and made with its key set
+    are matched: tokens never reach other tenants' subscribers, and messages
+    signed with another key would be rejected by the push service.
+
+    Args:
+        expression: Boolean audience expression (see SegmentIndex.evaluate)
+        admin_token_id: Sending token
+        vapid_key_id: Key set of the sending token (None = the default key)
+
+    Returns:
+        tuple: (number of matching subscriptions, iterator of ids in ascending order)
+    """
+    scope = (get_owner_term(admin_token_id), get_key_term(vapid_key_id))
+    result = get_segment_index().evaluate(expression, scope=scope)
+    return result.bit_count(), iter_positions(result)
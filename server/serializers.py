@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .records import SubscriptionRecord
 
 class NotificationSerializer(serializers.Serializer):
     title = serializers.CharField(max_length=255)
@@ -8,4 +9,26 @@ class NotificationSerializer(serializers.Serializer):
     def validate_token(self, value):
         if not value:
             raise serializers.ValidationError("Token is required for sending notifications.")
-        return value
\ No newline at end of file
+        return value
+
+
+class SubscriptionKeysSerializer(serializers.Serializer):
+    p256dh = serializers.CharField(max_length=255)
+    auth = serializers.CharField(max_length=64)
+
+
+class SubscriptionSerializer(serializers.Serializer):
+    endpoint = serializers.URLField(max_length=2048)
+    keys = SubscriptionKeysSerializer()
+    tags = serializers.ListField(child=serializers.CharField(max_length=100), required=False)
+    attributes = serializers.DictField(child=serializers.CharField(max_length=255), required=False)
+    
+    def validate(self, data):
+        # Decode and check the keys once at registration, not on every send
+        try:
+            record = SubscriptionRecord.from_info(data)
+            record.public_key
+        except ValueError as ex:
+            raise serializers.ValidationError({"keys": str(ex)})
+        data["keys"] = record.as_subscription_info()["keys"]
+        return data
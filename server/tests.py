@@ -1,3 +1,536 @@
-from django.test import TestCase
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.core import signing
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from . import push
+from .campaigns import checkpoint, claim_chunk, enqueue_audience, process_chunk
+from .circuit import CircuitBreaker
+from .fanout import new_dry_run_report, scale_dry_run_report, summarize_dry_run
+from .models import AdminToken, Campaign, CampaignChunk, Subscription, VapidKeySet
+from .quotas import QuotaExceeded, consume_quota, release_quota
+from .push import MAX_PAYLOAD_SIZE, PayloadTooLarge, encrypt_payload
+from .records import SubscriptionRecord, decode_key, encode_key
+from .segments import (
+    ARRAY_LIMIT, DELETION_SEQUENCE_KEY, Bitmap, SegmentError, SegmentIndex, get_key_term, get_owner_term,
+    iter_positions,
+)
+from .tracking import add_tracking, parse_token
+from .transfer import export_subscriptions, import_subscriptions
 
-# Create your tests here.
+
+class EncryptPayloadTests(SimpleTestCase):
+    """encrypt_payload against the example message of RFC 8291 section 5."""
+
+    PLAINTEXT = b"When I grow up, I want to be a watermelon"
+    SERVER_PRIVATE_KEY = "yfWPiYE-n46HLnH0KqZOF1fJJU3MYrct3AELtAQ-oRw"
+    RECEIVER_PUBLIC_KEY = "BCVxsr7N_eNgVRqvHtD0zTZsEc6-VV-JvLexhqUzORcxaOzi6-AYWXvTBHm4bjyPjs7Vd8pZGH6SRpkNtoIAiw4"
+    AUTH_SECRET = "BTBZMqHH6r4Tts7J_aSIgg"
+    SALT = "DGv6ra1nlYgDCS1FRnbzlw"
+    MESSAGE = (
+        "DGv6ra1nlYgDCS1FRnbzlwAAEABBBP4z9KsN6nGRTbVYI_c7VJSPQTBtkgcy27mlmlMoZIIgDll6e3vCYLocInmYWAmS6TlzAC8wEqKK"
+        "6PBru3jl7A_yl95bQpu6cVPTpK4Mqgkf1CXztLVBSt2Ks3oZwbuwXPXLWyouBWLVWGNWQexSgSxsj_Qulcy4a-fN"
+    )
+
+    def setUp(self):
+        self.record = SubscriptionRecord(
+            "https://push.example.net/push/JzLQ3raZJfFBR0aqvOMsLrt54w4rJUsV",
+            decode_key(self.RECEIVER_PUBLIC_KEY),
+            decode_key(self.AUTH_SECRET),
+        )
+
+    def test_rfc8291_example(self):
+        server_key = ec.derive_private_key(int.from_bytes(decode_key(self.SERVER_PRIVATE_KEY), "big"), ec.SECP256R1())
+        body = encrypt_payload(self.record, self.PLAINTEXT, server_key=server_key, salt=decode_key(self.SALT))
+        self.assertEqual(body, decode_key(self.MESSAGE))
+
+    def test_largest_payload_fits_in_4096_bytes(self):
+        body = encrypt_payload(self.record, b"x" * MAX_PAYLOAD_SIZE)
+        self.assertEqual(len(body), 4096)
+
+    def test_oversized_payload_is_rejected(self):
+        with self.assertRaises(PayloadTooLarge):
+            encrypt_payload(self.record, b"x" * (MAX_PAYLOAD_SIZE + 1))
+
+
+class SegmentScopeTests(SimpleTestCase):
+    """Audiences only reach the sending token's own subscriptions."""
+
+    def setUp(self):
+        self.index = SegmentIndex()
+        now = timezone.now()
+        rows = (
+            # id, owner token, key set, tags
+            (1, 1, None, ["news"]),
+            (2, 1, None, ["sports"]),
+            (3, 2, None, ["news"]),
+            (70000, 2, None, ["sports"]),
+            (4, 1, 5, ["news"]),
+        )
+        for subscription_id, token_id, key_id, tags in rows:
+            self.index._add({
+                "id": subscription_id, "tags": tags, "vendor": "google", "attributes": {},
+                "last_active_at": now, "vapid_key_id": key_id, "admin_token_id": token_id,
+            }, now)
+
+    def resolve(self, expression, token_id, key_id=None):
+        scope = (get_owner_term(token_id), get_key_term(key_id))
+        return list(iter_positions(self.index.evaluate(expression, scope=scope)))
+
+    def test_everyone_is_limited_to_the_token(self):
+        self.assertEqual(self.resolve("*", 1), [1, 2])
+        self.assertEqual(self.resolve("*", 2), [3, 70000])
+
+    def test_not_does_not_reach_other_tokens(self):
+        self.assertEqual(self.resolve("NOT tag:news", 1), [2])
+        self.assertEqual(self.resolve("tag:news OR NOT tag:news", 2), [3, 70000])
+
+    def test_token_without_subscriptions_reaches_nobody(self):
+        self.assertEqual(self.resolve("*", 3), [])
+
+    def test_key_set_is_part_of_the_scope(self):
+        self.assertEqual(self.resolve("*", 1, key_id=5), [4])
+
+    def test_scope_terms_are_not_usable_in_expressions(self):
+        with self.assertRaises(SegmentError):
+            self.resolve("token:2", 1)
+
+    def test_removed_subscription_leaves_the_audience(self):
+        self.index._remove(1)
+        self.assertEqual(self.resolve("tag:news", 1), [])
+
+
+class BitmapTests(SimpleTestCase):
+    """Compressed bitmaps convert between array and bit blocks transparently."""
+
+    def test_sparse_and_dense_blocks(self):
+        bitmap = Bitmap()
+        dense = list(range(0, 2 * (ARRAY_LIMIT + 1), 2))
+        sparse = [3 << 16, (3 << 16) + 7, 70000]
+        for position in dense + sparse + sparse:
+            bitmap.add(position)
+        self.assertIsInstance(bitmap.blocks[0], bytearray)
+        self.assertNotIsInstance(bitmap.blocks[3], bytearray)
+        self.assertEqual(list(iter_positions(bitmap.to_int())), sorted(dense + sparse))
+        for position in (0, 70000, 3 << 16):
+            bitmap.discard(position)
+        self.assertEqual(list(iter_positions(bitmap.to_int())), dense[1:] + [(3 << 16) + 7])
+
+    def test_empty_bitmap(self):
+        bitmap = Bitmap()
+        bitmap.add(5)
+        bitmap.discard(5)
+        self.assertEqual((bitmap.blocks, bitmap.to_int()), ({}, 0))
+
+
+class SegmentExpressionTests(SimpleTestCase):
+    """Audience expressions follow the documented grammar."""
+
+    def setUp(self):
+        self.index = SegmentIndex()
+        now = timezone.now()
+        for subscription_id, tags, vendor in ((1, ["a"], "google"), (2, ["b"], "apple"), (3, ["b", "c"], "google")):
+            self.index._add({
+                "id": subscription_id, "tags": tags, "vendor": vendor, "attributes": {"lang": "fa"},
+                "last_active_at": now, "vapid_key_id": None, "admin_token_id": None,
+            }, now)
+
+    def evaluate(self, expression):
+        return list(iter_positions(self.index.evaluate(expression)))
+
+    def test_and_binds_tighter_than_or(self):
+        self.assertEqual(self.evaluate("tag:a OR tag:b AND NOT tag:c"), [1, 2])
+        self.assertEqual(self.evaluate("(tag:a OR tag:b) AND NOT tag:c"), [1, 2])
+        self.assertEqual(self.evaluate("(tag:a OR tag:c) AND vendor:google"), [1, 3])
+
+    def test_other_fields(self):
+        self.assertEqual(self.evaluate("attr:lang=fa AND active:1d"), [1, 2, 3])
+        self.assertEqual(self.evaluate("NOT *"), [])
+
+    def test_invalid_expressions(self):
+        for expression in ("", "tag:a AND", "(tag:a", "tag:a )", "name:x", "tag", "active:xd"):
+            with self.assertRaises(SegmentError):
+                self.index.evaluate(expression)
+
+
+class SegmentRefreshTests(TestCase):
+    """Incremental refreshes pick up changed, deactivated and deleted rows."""
+
+    def setUp(self):
+        cache.clear()
+        self.ids = create_subscriptions(3)
+        Subscription.objects.update(tags=["news"])
+        self.index = SegmentIndex()
+        self.index.rebuild()
+
+    def audience(self, expression="tag:news"):
+        return list(iter_positions(self.index.evaluate(expression)))
+
+    def test_rebuild_indexes_active_rows(self):
+        self.assertEqual(self.audience(), self.ids)
+
+    def test_changed_rows_are_reindexed(self):
+        subscription = Subscription.objects.get(pk=self.ids[0])
+        subscription.tags = ["sports"]
+        subscription.save()
+        self.index.refresh()
+        self.assertEqual(self.audience(), self.ids[1:])
+        self.assertEqual(self.audience("tag:sports"), self.ids[:1])
+
+    def test_deactivated_rows_are_dropped(self):
+        Subscription.objects.filter(pk=self.ids[1]).update(is_active=False, updated_at=timezone.now())
+        self.index.refresh()
+        self.assertEqual(self.audience("*"), [self.ids[0], self.ids[2]])
+
+    def test_deleted_rows_are_dropped(self):
+        Subscription.objects.filter(pk=self.ids[2]).delete()
+        with mock.patch.object(self.index, "start_rebuild") as start_rebuild:
+            self.index.refresh()
+        start_rebuild.assert_not_called()
+        self.assertEqual(self.audience("*"), self.ids[:2])
+
+    def test_lost_deletions_trigger_a_rebuild(self):
+        Subscription.objects.filter(pk=self.ids[2]).delete()
+        cache.clear()
+        cache.set(DELETION_SEQUENCE_KEY, 5)
+        with mock.patch.object(self.index, "start_rebuild") as start_rebuild:
+            self.index.refresh()
+        start_rebuild.assert_called_once_with()
+
+
+class AddTrackingTests(SimpleTestCase):
+    """Tracking fields are only added to JSON object payloads."""
+
+    def test_object_payload_gets_a_tracking_field(self):
+        payload = json.loads(add_tracking('{"title": "Hi"}', 7, 3, "https://fcm.googleapis.com"))
+        self.assertEqual(payload["title"], "Hi")
+        self.assertEqual(parse_token(payload["tracking"]["token"])[:2], (7, 3))
+
+    def test_empty_object_payload(self):
+        self.assertIn("tracking", json.loads(add_tracking("{}", 7)))
+
+    def test_other_payloads_are_unchanged(self):
+        for payload in ('"hello"', "[1, 2]", "42"):
+            self.assertEqual(add_tracking(payload, 7), payload)
+
+
+class TrackingTokenTests(SimpleTestCase):
+    """Tracking tokens are signed and expire after TRACKING_TOKEN_MAX_AGE."""
+
+    def setUp(self):
+        self.token = json.loads(add_tracking("{}", 7, 3))["tracking"]["token"]
+
+    @override_settings(TRACKING_TOKEN_MAX_AGE=60)
+    def test_token_is_valid_until_max_age(self):
+        with mock.patch("django.core.signing.time.time", return_value=time.time() + 59):
+            self.assertEqual(parse_token(self.token)[:2], (7, 3))
+
+    @override_settings(TRACKING_TOKEN_MAX_AGE=60)
+    def test_expired_token_is_rejected(self):
+        with mock.patch("django.core.signing.time.time", return_value=time.time() + 61):
+            with self.assertRaises(signing.SignatureExpired):
+                parse_token(self.token)
+
+    def test_tampered_token_is_rejected(self):
+        value, _, signature = self.token.rpartition(":")
+        with self.assertRaises(signing.BadSignature):
+            parse_token(value.replace("7:3", "8:3", 1) + ":" + signature)
+
+
+def make_subscription_info(endpoint):
+    """Return a subscription_info dict with valid keys for an endpoint."""
+    public_key = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    return {"endpoint": endpoint, "keys": {"p256dh": encode_key(public_key), "auth": encode_key(os.urandom(16))}}
+
+
+class TransferTests(TestCase):
+    """Imports and exports of stored subscriptions."""
+
+    def setUp(self):
+        self.key_set = VapidKeySet.objects.create(name="tenant", public_key="x", private_key_encrypted="x", subject="mailto:a@b.c")
+        self.token = AdminToken.objects.create(vapid_key=self.key_set)
+        self.other = AdminToken.objects.create()
+
+    def ndjson(self, *rows):
+        return [json.dumps(row) + "\n" for row in rows]
+
+    def test_ndjson_round_trip(self):
+        info = make_subscription_info("https://fcm.googleapis.com/fcm/send/a")
+        row = dict(info, tags=["news"], attributes={"lang": "fa"}, is_active=False)
+        report = import_subscriptions(self.ndjson(row), admin_token=self.token)
+        self.assertEqual((report["written"], report["invalid"]), (1, 0))
+        self.assertEqual([json.loads(line) for line in export_subscriptions(admin_token=self.token)], [row])
+
+    def test_csv_round_trip(self):
+        info = make_subscription_info("https://fcm.googleapis.com/fcm/send/a")
+        import_subscriptions(self.ndjson(dict(info, tags=["news"])), admin_token=self.token)
+        exported = "".join(export_subscriptions("csv", admin_token=self.token))
+        Subscription.objects.all().delete()
+        report = import_subscriptions(exported.splitlines(keepends=True), format="csv", admin_token=self.token)
+        self.assertEqual(report["written"], 1)
+        self.assertEqual("".join(export_subscriptions("csv", admin_token=self.token)), exported)
+
+    def test_string_is_active_values_are_parsed(self):
+        rows = [
+            dict(make_subscription_info(f"https://fcm.googleapis.com/fcm/send/{index}"), is_active=value)
+            for index, value in enumerate(["false", "0", "no", "true", 1])
+        ]
+        import_subscriptions(self.ndjson(*rows), admin_token=self.token)
+        active = Subscription.objects.order_by("endpoint").values_list("is_active", flat=True)
+        self.assertEqual(list(active), [False, False, False, True, True])
+
+    def test_invalid_is_active_is_rejected(self):
+        row = dict(make_subscription_info("https://fcm.googleapis.com/fcm/send/a"), is_active=[1])
+        report = import_subscriptions(self.ndjson(row), admin_token=self.token)
+        self.assertEqual((report["written"], report["invalid"]), (0, 1))
+
+    def test_endpoints_of_other_tokens_are_not_overwritten(self):
+        info = make_subscription_info("https://fcm.googleapis.com/fcm/send/a")
+        import_subscriptions(self.ndjson(dict(info, tags=["mine"])), admin_token=self.token)
+        report = import_subscriptions(self.ndjson(dict(info, tags=["theirs"])), admin_token=self.other)
+        self.assertEqual((report["written"], report["invalid"]), (0, 1))
+        subscription = Subscription.objects.get()
+        self.assertEqual((subscription.admin_token_id, subscription.tags), (self.token.pk, ["mine"]))
+
+    def test_import_without_token_keeps_owner_and_key_set(self):
+        info = make_subscription_info("https://fcm.googleapis.com/fcm/send/a")
+        import_subscriptions(self.ndjson(info), admin_token=self.token)
+        import_subscriptions(self.ndjson(dict(info, tags=["news"])))
+        subscription = Subscription.objects.get()
+        self.assertEqual(subscription.tags, ["news"])
+        self.assertEqual((subscription.admin_token_id, subscription.vapid_key_id), (self.token.pk, self.key_set.pk))
+
+
+def create_subscriptions(count, admin_token=None):
+    """Store `count` subscriptions with valid keys and return their ids."""
+    for index in range(count):
+        info = make_subscription_info(f"https://fcm.googleapis.com/fcm/send/{index}")
+        Subscription.objects.create(
+            admin_token=admin_token, endpoint=info["endpoint"], p256dh=info["keys"]["p256dh"], auth=info["keys"]["auth"],
+        )
+    return list(Subscription.objects.order_by("id").values_list("id", flat=True))
+
+
+def results_for(outcome):
+    """Return a fake fanout.deliver answering `outcome` for every recipient."""
+    return lambda records, payload, *args, **kwargs: [push.PushResult(outcome, None, 201, 1.0) for _ in records]
+
+
+class ProcessChunkTests(TestCase):
+    """Delivery of leased chunks."""
+
+    def setUp(self):
+        self.ids = create_subscriptions(4)
+        self.campaign = enqueue_audience('{"title": "Hi"}', iter(self.ids), len(self.ids), chunk_size=10)
+
+    @mock.patch("server.campaigns.deliver", side_effect=results_for(push.DEFERRED))
+    def test_deferred_stored_recipients_are_queued_by_id(self, _):
+        chunk = claim_chunk("worker")
+        self.assertTrue(process_chunk(chunk))
+        retry = CampaignChunk.objects.get(campaign=self.campaign, index=1)
+        self.assertEqual(retry.subscription_ids, self.ids)
+        self.assertEqual(retry.recipients, [])
+        self.assertIsNotNone(retry.available_at)
+
+    @mock.patch("server.campaigns.deliver")
+    def test_gone_subscriptions_are_deactivated(self, deliver):
+        deliver.side_effect = lambda records, *args, **kwargs: [
+            push.PushResult(push.FAILED, "Gone", 410, 1.0) if index % 2 else push.PushResult(push.SENT, None, 201, 1.0)
+            for index, _ in enumerate(records)
+        ]
+        self.assertTrue(process_chunk(claim_chunk("worker")))
+        active = Subscription.objects.order_by("id").values_list("is_active", flat=True)
+        self.assertEqual(list(active), [True, False, True, False])
+
+
+class LeaseTests(TestCase):
+    """Chunks are leased to one worker at a time and resume where they stopped."""
+
+    def setUp(self):
+        self.ids = create_subscriptions(4)
+        self.campaign = enqueue_audience('{"title": "Hi"}', iter(self.ids), len(self.ids), chunk_size=10)
+
+    def expire_leases(self):
+        CampaignChunk.objects.update(leased_until=timezone.now() - timedelta(seconds=1))
+
+    def test_leased_chunk_is_not_claimed_twice(self):
+        self.assertIsNotNone(claim_chunk("a"))
+        self.assertIsNone(claim_chunk("b"))
+
+    def test_expired_lease_fences_the_previous_worker(self):
+        stalled = claim_chunk("a")
+        self.expire_leases()
+        current = claim_chunk("b")
+        self.assertEqual(current.pk, stalled.pk)
+        self.assertNotEqual(current.lease_token, stalled.lease_token)
+        stalled.progress = 4
+        self.assertFalse(checkpoint(stalled, done=True))
+        self.assertTrue(checkpoint(current))
+        chunk = CampaignChunk.objects.get(pk=current.pk)
+        self.assertEqual((chunk.status, chunk.progress, chunk.leased_by), (CampaignChunk.LEASED, 0, "b"))
+
+    @mock.patch("server.campaigns.deliver", side_effect=results_for(push.SENT))
+    def test_reclaimed_chunk_resumes_after_the_checkpoint(self, deliver):
+        chunk = claim_chunk("a")
+        chunk.progress, chunk.success_count = 2, 2
+        self.assertTrue(checkpoint(chunk))
+        self.expire_leases()
+        chunk = claim_chunk("b")
+        self.assertEqual(chunk.attempts, 2)
+        self.assertTrue(process_chunk(chunk))
+        delivered = [record.subscription_id for record in deliver.call_args.args[0]]
+        self.assertEqual(delivered, self.ids[2:])
+        chunk = CampaignChunk.objects.get(pk=chunk.pk)
+        self.assertEqual((chunk.status, chunk.progress, chunk.success_count), (CampaignChunk.DONE, 4, 4))
+        self.assertIsNone(chunk.lease_token)
+
+
+class PriorityLaneTests(TestCase):
+    """Higher lanes are claimed first and reserved capacity keeps to its lanes."""
+
+    def setUp(self):
+        ids = create_subscriptions(2)
+        self.bulk = enqueue_audience("{}", iter(ids), len(ids), priority=Campaign.PRIORITY_BULK)
+        self.high = enqueue_audience("{}", iter(ids), len(ids), priority=Campaign.PRIORITY_HIGH)
+
+    def test_highest_lane_is_claimed_first(self):
+        self.assertEqual(claim_chunk("a").campaign_id, self.high.pk)
+        self.assertEqual(claim_chunk("a").campaign_id, self.bulk.pk)
+
+    def test_reserved_capacity_never_takes_lower_lanes(self):
+        self.assertEqual(claim_chunk("a", max_priority=Campaign.PRIORITY_HIGH).campaign_id, self.high.pk)
+        self.assertIsNone(claim_chunk("a", max_priority=Campaign.PRIORITY_HIGH))
+
+    def test_chunks_are_not_claimed_before_they_are_available(self):
+        CampaignChunk.objects.filter(campaign=self.high).update(available_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(claim_chunk("a").campaign_id, self.bulk.pk)
+        self.assertIsNone(claim_chunk("a"))
+
+
+@mock.patch("server.circuit.time.monotonic")
+class CircuitBreakerTests(SimpleTestCase):
+    """Closed, open and half-open transitions of a push service breaker."""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+
+    def open(self, clock):
+        clock.return_value = 100.0
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self, clock):
+        clock.return_value = 100.0
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.open(clock)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        clock.return_value = 110.0
+        self.assertEqual(self.breaker.retry_after(), 20)
+
+    def test_lets_one_probe_through_after_recovery(self, clock):
+        self.open(clock)
+        clock.return_value = 130.0
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_probe_closes(self, clock):
+        self.open(clock)
+        clock.return_value = 130.0
+        self.breaker.allow()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_opens_again(self, clock):
+        self.open(clock)
+        clock.return_value = 130.0
+        self.breaker.allow()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+    def test_released_probe_can_be_retried(self, clock):
+        self.open(clock)
+        clock.return_value = 130.0
+        self.breaker.allow()
+        self.breaker.release()
+        self.assertTrue(self.breaker.allow())
+
+
+class DryRunSampleTests(SimpleTestCase):
+    """Dry runs over a sample are extrapolated to the whole group."""
+
+    def test_sample_is_scaled_to_the_total(self):
+        report = new_dry_run_report()
+        report.update(recipients=10, invalid=1, encrypted_bytes=900, max_encrypted_bytes=100,
+                      origins={"https://fcm.googleapis.com": [9, 900]})
+        summary = summarize_dry_run(scale_dry_run_report(report, 1000), "{}", 0.5)
+        self.assertEqual((summary["total"], summary["invalid_count"], summary["sampled"]), (1000, 100, 10))
+        self.assertEqual(summary["origins"]["https://fcm.googleapis.com"]["recipients"], 900)
+        self.assertEqual(summary["encrypted_bytes_max"], 100)
+        self.assertEqual(summary["cpu_path_recipients_per_second"], 20)
+
+
+@override_settings(QUOTAS_ENABLED=True, QUOTA_MESSAGES_PER_DAY=0, QUOTA_MAX_GROUP_SIZE=0)
+class QuotaTests(SimpleTestCase):
+    """Sliding-window quotas counted in the cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.token = AdminToken(pk=1, messages_per_minute=5)
+
+    def test_rejected_send_is_rolled_back(self):
+        consume_quota(self.token, 3)
+        with self.assertRaises(QuotaExceeded) as raised:
+            consume_quota(self.token, 3)
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        # Only the accepted 3 messages count
+        consume_quota(self.token, 2)
+        with self.assertRaises(QuotaExceeded):
+            consume_quota(self.token, 1)
+
+    def test_released_messages_are_available_again(self):
+        keys = consume_quota(self.token, 5)
+        release_quota(keys, 5)
+        consume_quota(self.token, 5)
+
+    def test_concurrent_sends_never_exceed_the_limit(self):
+        accepted = []
+        barrier = threading.Barrier(20)
+
+        def send():
+            barrier.wait()
+            try:
+                consume_quota(self.token, 1)
+                accepted.append(1)
+            except QuotaExceeded:
+                pass
+
+        threads = [threading.Thread(target=send) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(accepted), 5)
+
+    def test_group_size_limit(self):
+        self.token.max_group_size = 10
+        with self.assertRaises(QuotaExceeded):
+            consume_quota(self.token, 11)
@@ -0,0 +1,217 @@
+import atexit
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Campaign, Subscription
+from .rollups import RollupDeltas, get_bucket
+
+# Events service workers report
+DISPLAY = "display"
+CLICK = "click"
+EVENTS = (DISPLAY, CLICK)
+
+# Campaign counter column per event
+EVENT_FIELDS = {DISPLAY: "display_count", CLICK: "click_count"}
+
+# Largest id and push service origin the tracking field is sized for
+MAX_ID = 2 ** 64 - 1
+MAX_ORIGIN = "https://" + "x" * 56
+
+_signer = None
+
+
+def tracking_enabled():
+    """Return True if tracking fields are added to campaign payloads."""
+    return settings.TRACKING_ENABLED and bool(settings.TRACKING_URL)
+
+
+def get_signer():
+    global _signer
+    if _signer is None:
+        _signer = signing.TimestampSigner(salt="server.tracking")
+    return _signer
+
+
+def get_recipient_key(endpoint):
+    """Return a short digest identifying a recipient that is not a stored subscription."""
+    return hashlib.sha256(endpoint.encode("utf-8")).hexdigest()[:16]
+
+
+def add_tracking(payload, campaign_id, subscription_id=None, origin="", endpoint=None):
+    """
+    Add a signed tracking field to a JSON-encoded payload object.
+
+    Payloads that are not a JSON object (e.g. a bare string sent through
+    the django-webpush helpers) are returned unchanged. The payload is shared by all recipients of a campaign; only this short
+    field differs per recipient, so it is appended to the encoded string
+    instead of re-encoding the whole payload. The token is timestamped and
+    accepted for TRACKING_TOKEN_MAX_AGE seconds.
+
+    Args:
+        payload: JSON-encoded payload object
+        campaign_id: Campaign the message belongs to
+        subscription_id: Stored subscription the message goes to, if any
+        origin: Push service origin of the subscription, for the rollups
+        endpoint: Endpoint of the recipient; identifies recipients without
+            a subscription id, so their events are deduplicated too
+
+    Returns:
+        str: Payload with "tracking": {"url": ..., "token": ...}
+    """
+    stripped = payload.strip()
+    if not (stripped.startswith("{") and stripped.endswith("}")):
+        return payload
+    recipient = get_recipient_key(endpoint) if subscription_id is None and endpoint else ""
+    token = get_signer().sign(f"{campaign_id}:{subscription_id or ''}:{recipient}:{origin}")
+    field = json.dumps({"url": settings.TRACKING_URL, "token": token})
+    separator = ", " if stripped[:-1].strip() != "{" else ""
+    return f'{stripped[:-1]}{separator}"tracking": {field}}}'
+
+
+def tracking_overhead():
+    """Return the bytes add_tracking adds at most, to keep free in the payload budget."""
+    return len(add_tracking('{"a": 0}', MAX_ID, MAX_ID, MAX_ORIGIN).encode("utf-8")) - len('{"a": 0}')
+
+
+def parse_token(token):
+    """
+    Verify a tracking token.
+
+    Returns:
+        tuple: (campaign id, subscription id or None, recipient key or "",
+        origin or "")
+
+    Raises:
+        signing.BadSignature: If the token was not issued by this server, or
+            is older than TRACKING_TOKEN_MAX_AGE (signing.SignatureExpired)
+    """
+    value = get_signer().unsign(token, max_age=settings.TRACKING_TOKEN_MAX_AGE)
+    campaign_id, subscription_id, recipient, origin = value.split(":", 3)
+    return int(campaign_id), int(subscription_id) if subscription_id else None, recipient, origin
+
+
+def is_first_event(campaign_id, recipient, event):
+    """
+    Return True the first time a recipient reports an event for a campaign.
+
+    Replayed pings (retries, or a token posted repeatedly) are not counted
+    again. The marks live in the cache for TRACKING_TOKEN_MAX_AGE, after
+    which the token itself is rejected; with a per-process cache, a replay
+    reaching another process is still counted.
+    """
+    return cache.add(f"tracking:{campaign_id}:{recipient}:{event}", 1, settings.TRACKING_TOKEN_MAX_AGE)
+
+
+class TrackingCounters:
+    """
+    In-memory display and click counters.
+
+    Events only increment counters in memory. Every TRACKING_FLUSH_SECONDS
+    (checked on each event and by a background thread, see start; and at
+    exit) the counts are written as one UPDATE ... SET count = count + n
+    per campaign, and the subscriptions seen get one bulk last_active_at
+    update, however many events arrived.
+    With ANALYTICS_ENABLED the counts are also added to the campaign rollups
+    per push service and time bucket.
+    """
+
+    def __init__(self, flush_seconds=None):
+        self.flush_seconds = settings.TRACKING_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.counts = Counter()  # (campaign id, origin, bucket, event) -> count
+        self.active = set()  # subscription ids that displayed or clicked
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, campaign_id, subscription_id, origin, event):
+        bucket = get_bucket(timezone.now())
+        with self.lock:
+            self.counts[campaign_id, origin, bucket, event] += 1
+            if subscription_id is not None:
+                self.active.add(subscription_id)
+            due = time.monotonic() - self.flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def start(self):
+        """Flush due counts in a background thread, so they never wait for the next event."""
+        threading.Thread(target=self._flush_periodically, name="tracking-flush", daemon=True).start()
+
+    def _flush_periodically(self):
+        interval = max(self.flush_seconds, 1)
+        while True:
+            time.sleep(interval)
+            if self.counts and time.monotonic() - self.flushed_at >= self.flush_seconds:
+                self.flush()
+                connection.close()
+
+    def flush(self):
+        """Write the aggregated increments. Failures are reported and the counts dropped."""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            active, self.active = self.active, set()
+            self.flushed_at = time.monotonic()
+        if not counts and not active:
+            return
+
+        totals = Counter()
+        deltas = RollupDeltas()
+        for (campaign_id, origin, bucket, event), count in counts.items():
+            totals[campaign_id, EVENT_FIELDS[event]] += count
+            deltas.add_count(campaign_id, origin, bucket, EVENT_FIELDS[event], count)
+        increments = {}
+        for (campaign_id, field), count in totals.items():
+            increments.setdefault(campaign_id, {})[field] = F(field) + count
+        try:
+            with transaction.atomic():
+                for campaign_id, fields in increments.items():
+                    Campaign.objects.filter(pk=campaign_id).update(**fields)
+                if active:
+                    # update() skips auto_now; updated_at is set so segment indexes see the change
+                    now = timezone.now()
+                    Subscription.objects.filter(pk__in=active).update(last_active_at=now, updated_at=now)
+                if deltas and settings.ANALYTICS_ENABLED:
+                    deltas.apply()
+        except Exception as e:
+            print(f"Error writing tracking counters: {e}")
+
+
+_counters = None
+_counters_lock = threading.Lock()
+
+
+def get_counters():
+    """Return this process's tracking counters."""
+    global _counters
+    if _counters is None:
+        with _counters_lock:
+            if _counters is None:
+                _counters = TrackingCounters()
+                _counters.start()
+                atexit.register(_counters.flush)
+    return _counters
+
+
+def record_event(token, event):
+    """
+    Count a display or click reported by a service worker.
+
+    Each recipient's first event of a kind per campaign is counted;
+    repeats are ignored.
+
+    Raises:
+        signing.BadSignature: If the token is invalid or expired
+        ValueError: If the event is unknown
+    """
+    if event not in EVENTS:
+        raise ValueError(f"event must be one of {', '.join(EVENTS)}")
+    campaign_id, subscription_id, recipient, origin = parse_token(token)
+    if is_first_event(campaign_id, subscription_id or recipient, event):
+        get_counters().add(campaign_id, subscription_id, origin, event)
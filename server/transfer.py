@@ -0,0 +1,313 @@
+import csv
+import io
+import json
+import time
+from django.db import connection, transaction
+from .models import Subscription, hash_endpoint, get_endpoint_vendor
+from .records import SubscriptionRecord
+from .parsers import loads
+
+# Columns of CSV imports and exports; tags and attributes are JSON-encoded cells
+CSV_COLUMNS = ["endpoint", "p256dh", "auth", "tags", "attributes", "is_active"]
+
+# Columns refreshed when an imported endpoint already exists
+UPDATE_FIELDS = ["endpoint", "p256dh", "auth", "vendor", "tags", "attributes", "is_active", "updated_at"]
+
+# Also refreshed when importing for a token (rows of other owners are rejected first)
+OWNER_FIELDS = ["admin_token", "vapid_key"]
+
+
+def parse_bool(value, default=True):
+    """
+    Parse an is_active value: a JSON boolean or number, or "1"/"true"/"yes"
+    (any case) for true and any other string for false.
+
+    Raises:
+        ValueError: For other types (lists, objects)
+    """
+    if value is None or value == "":
+        return default
+    if isinstance(value, (bool, int, float)):
+        return bool(value)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    raise ValueError("is_active must be a boolean")
+
+
+def parse_ndjson(lines):
+    """
+    Parse NDJSON subscription rows.
+
+    Each line is either a browser subscription ({"endpoint", "keys": {...}})
+    or a flat row with p256dh/auth, optionally with tags and attributes.
+
+    Yields:
+        dict: Raw row, or {"error": ...} for unparsable lines
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = loads(line)
+        except json.JSONDecodeError:
+            yield {"error": "invalid JSON"}
+            continue
+        if not isinstance(row, dict):
+            yield {"error": "row must be an object"}
+            continue
+        keys = row.get("keys") or {}
+        try:
+            is_active = parse_bool(row.get("is_active"))
+        except ValueError as ex:
+            yield {"error": str(ex)}
+            continue
+        yield {
+            "endpoint": row.get("endpoint"),
+            "p256dh": keys.get("p256dh", row.get("p256dh")),
+            "auth": keys.get("auth", row.get("auth")),
+            "tags": row.get("tags") or [],
+            "attributes": row.get("attributes") or {},
+            "is_active": is_active,
+        }
+
+
+def parse_csv(lines):
+    """
+    Parse CSV subscription rows with a header line (see CSV_COLUMNS).
+
+    Yields:
+        dict: Raw row, or {"error": ...} for malformed rows
+    """
+    decoded = (line.decode("utf-8") if isinstance(line, bytes) else line for line in lines)
+    for row in csv.DictReader(decoded):
+        try:
+            yield {
+                "endpoint": row.get("endpoint"),
+                "p256dh": row.get("p256dh"),
+                "auth": row.get("auth"),
+                "tags": json.loads(row["tags"]) if row.get("tags") else [],
+                "attributes": json.loads(row["attributes"]) if row.get("attributes") else {},
+                "is_active": parse_bool(row.get("is_active")),
+            }
+        except json.JSONDecodeError:
+            yield {"error": "invalid JSON in tags or attributes"}
+
+
+PARSERS = {"ndjson": parse_ndjson, "csv": parse_csv}
+
+
+def validate_rows(rows):
+    """
+    Validate subscription rows; runs in a process pool for large imports.
+
+    p256dh must be an uncompressed point on P-256 and auth a 16-byte secret.
+
+    Args:
+        rows: List of raw rows
+
+    Returns:
+        list: (row, None) for valid rows, (None, error) for invalid ones
+    """
+    results = []
+    for row in rows:
+        if "error" in row:
+            results.append((None, row["error"]))
+            continue
+        endpoint = row.get("endpoint")
+        if not isinstance(endpoint, str) or not endpoint.startswith("https://"):
+            results.append((None, "endpoint must be an https URL"))
+            continue
+        try:
+            SubscriptionRecord.from_info({
+                "endpoint": endpoint,
+                "keys": {"p256dh": row["p256dh"], "auth": row["auth"]},
+            }).public_key
+        except ValueError as ex:
+            results.append((None, f"invalid keys: {ex}"))
+            continue
+        if not isinstance(row["tags"], list) or not isinstance(row["attributes"], dict):
+            results.append((None, "tags must be a list and attributes an object"))
+            continue
+        results.append((row, None))
+    return results
+
+
+def _validate_batch(rows, pool, processes):
+    """Validate a batch in this process or split across the process pool."""
+    if pool is None:
+        return validate_rows(rows)
+    step = max(1, -(-len(rows) // processes))
+    results = []
+    for part in pool.map(validate_rows, [rows[start:start + step] for start in range(0, len(rows), step)]):
+        results.extend(part)
+    return results
+
+
+def _owned_elsewhere(rows, admin_token):
+    """
+    Return the endpoint hashes of rows already stored for another token (or for none).
+
+    Must run in the transaction that writes the batch: the endpoints are
+    locked (SELECT ... FOR UPDATE, which on MySQL also locks the index gaps
+    of endpoints not stored yet) until it commits, so no other import or
+    registration can take them over between this check and the upsert.
+    """
+    hashes = [hash_endpoint(row["endpoint"]) for row in rows]
+    stored = Subscription.objects.select_for_update().filter(endpoint_hash__in=hashes) \
+        .values_list("endpoint_hash", "admin_token_id")
+    return {endpoint_hash for endpoint_hash, owner_id in stored if owner_id != admin_token.pk}
+
+
+def _write_batch(rows, update, admin_token=None):
+    """Upsert a batch of valid rows keyed on the endpoint hash."""
+    objects = [
+        Subscription(
+            admin_token=admin_token,
+            vapid_key_id=admin_token.vapid_key_id if admin_token is not None else None,
+            endpoint=row["endpoint"],
+            endpoint_hash=hash_endpoint(row["endpoint"]),
+            vendor=get_endpoint_vendor(row["endpoint"]),
+            p256dh=row["p256dh"],
+            auth=row["auth"],
+            tags=row["tags"],
+            attributes=row["attributes"],
+            is_active=row["is_active"],
+        )
+        for row in rows
+    ]
+    if not update:
+        Subscription.objects.bulk_create(objects, batch_size=len(objects), ignore_conflicts=True)
+        return
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    unique_fields = ["endpoint_hash"] if connection.features.supports_update_conflicts_with_target else None
+    Subscription.objects.bulk_create(
+        objects,
+        batch_size=len(objects),
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        # Command line imports (no token) keep the owner and key set of existing rows
+        update_fields=UPDATE_FIELDS + (OWNER_FIELDS if admin_token is not None else []),
+    )
+
+
+def import_subscriptions(lines, format="ndjson", batch_size=1000, update=True, pool=None, processes=1,
+                         max_errors=100, admin_token=None):
+    """
+    Stream subscriptions into the database in batches.
+
+    Only one batch is held in memory at a time, so memory use does not grow
+    with the size of the input.
+
+    Args:
+        lines: Iterable of input lines (str or bytes)
+        format: "ndjson" or "csv"
+        batch_size: Rows per bulk_create
+        update: Update existing endpoints (otherwise they are skipped)
+        pool: Optional process pool for key validation
+        processes: Number of processes in the pool
+        max_errors: Number of error messages kept for the report
+        admin_token: Token that owns the imported subscriptions; they are
+            stored under its VAPID key set. Endpoints stored for another
+            token are rejected, never overwritten. Without a token (command
+            line imports) every row is written; new rows get the default
+            key and existing rows keep their owner and key set.
+
+    Returns:
+        dict: Row counts, sample errors and rows per second
+    """
+    started = time.perf_counter()
+    report = {"rows": 0, "written": 0, "invalid": 0, "errors": []}
+
+    def reject(number, error):
+        report["invalid"] += 1
+        if len(report["errors"]) < max_errors:
+            report["errors"].append({"row": number, "error": error})
+
+    def flush(batch):
+        valid = []
+        for number, (row, error) in enumerate(_validate_batch(batch, pool, processes), start=report["rows"] + 1):
+            if row is None:
+                reject(number, error)
+            else:
+                valid.append((number, row))
+        # The ownership check and the upsert see the same rows
+        with transaction.atomic():
+            if valid and admin_token is not None:
+                taken = _owned_elsewhere([row for _, row in valid], admin_token)
+                if taken:
+                    for number, row in valid:
+                        if hash_endpoint(row["endpoint"]) in taken:
+                            reject(number, "endpoint is registered with another admin token")
+                    valid = [(number, row) for number, row in valid if hash_endpoint(row["endpoint"]) not in taken]
+            valid = [row for _, row in valid]
+            if valid:
+                _write_batch(valid, update, admin_token)
+        report["written"] += len(valid)
+        report["rows"] += len(batch)
+
+    batch = []
+    for row in PARSERS[format](lines):
+        batch.append(row)
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_second"] = round(report["rows"] / elapsed) if elapsed else None
+    return report
+
+
+def export_subscriptions(format="ndjson", chunk_size=2000, active_only=False, admin_token=None):
+    """
+    Stream stored subscriptions as NDJSON or CSV lines.
+
+    Args:
+        format: "ndjson" or "csv"
+        chunk_size: Rows fetched per query
+        active_only: Skip inactive subscriptions
+        admin_token: Only export this token's subscriptions (None = all,
+            for the command line)
+
+    Yields:
+        str: One line (newline-terminated) per subscription, plus a CSV header
+    """
+    queryset = Subscription.objects.order_by("id").values(
+        "endpoint", "p256dh", "auth", "tags", "attributes", "is_active"
+    )
+    if active_only:
+        queryset = queryset.filter(is_active=True)
+    if admin_token is not None:
+        queryset = queryset.filter(admin_token=admin_token)
+
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        for row in queryset.iterator(chunk_size=chunk_size):
+            writer.writerow([
+                row["endpoint"], row["p256dh"], row["auth"],
+                json.dumps(row["tags"]), json.dumps(row["attributes"]),
+                "true" if row["is_active"] else "false",
+            ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Header only for empty exports
+        if buffer.getvalue():
+            yield buffer.getvalue()
+        return
+
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield json.dumps({
+            "endpoint": row["endpoint"],
+            "keys": {"p256dh": row["p256dh"], "auth": row["auth"]},
+            "tags": row["tags"],
+            "attributes": row["attributes"],
+            "is_active": row["is_active"],
+        }) + "\n"
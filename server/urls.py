@@ -5,4 +5,14 @@ urlpatterns = [
     path("token/generate/", views.GenerateAdminTokenView.as_view(), name="generate_token"),
     path("send/single/", views.SendSingleNotificationView.as_view(), name="send_single"),
     path("send/group/", views.SendGroupNotificationView.as_view(), name="send_group"),
+    path("campaigns/<int:pk>/", views.CampaignStatusView.as_view(), name="campaign_status"),
+    path("campaigns/<int:pk>/analytics/", views.CampaignAnalyticsView.as_view(), name="campaign_analytics"),
+    path("vapid-key/", views.VapidPublicKeyView.as_view(), name="vapid_public_key"),
+    path("profiles/<str:profile_id>/", views.ProfileDownloadView.as_view(), name="download_profile"),
+    path("usage/", views.TokenUsageView.as_view(), name="token_usage"),
+    path("track/", views.TrackEventView.as_view(), name="track_event"),
+    path("subscriptions/", views.RegisterSubscriptionView.as_view(), name="register_subscription"),
+    path("icons/", views.IconUploadView.as_view(), name="upload_icon"),
+    path("subscriptions/import/", views.ImportSubscriptionsView.as_view(), name="import_subscriptions"),
+    path("subscriptions/export/", views.ExportSubscriptionsView.as_view(), name="export_subscriptions"),
 ]
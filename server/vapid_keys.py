@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import os
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from .models import VapidKeySet
+from .records import encode_key
+
+# Prefix of the stored ciphertext format, so the scheme can change later
+FORMAT_PREFIX = "v1:"
+
+# Bound to the ciphertext, so it cannot be reused for anything else
+ASSOCIATED_DATA = b"server.vapid_keys"
+
+
+def get_encryption_key():
+    """Return the AES-256 key stored private keys are encrypted with (VAPID_ENCRYPTION_KEY, or SECRET_KEY)."""
+    secret = settings.VAPID_ENCRYPTION_KEY or settings.SECRET_KEY
+    return hashlib.sha256(ASSOCIATED_DATA + b":" + secret.encode("utf-8")).digest()
+
+
+def encrypt_private_key(private_key):
+    """
+    Encrypt a base64url raw private key for storage.
+
+    Returns:
+        str: "v1:" followed by base64 of nonce + AES-GCM ciphertext
+    """
+    nonce = os.urandom(12)
+    ciphertext = AESGCM(get_encryption_key()).encrypt(nonce, private_key.encode("ascii"), ASSOCIATED_DATA)
+    return FORMAT_PREFIX + base64.b64encode(nonce + ciphertext).decode("ascii")
+
+
+def decrypt_private_key(value):
+    """
+    Decrypt a stored private key.
+
+    Raises:
+        ValueError: If the value is malformed or was encrypted with another key
+    """
+    if not value.startswith(FORMAT_PREFIX):
+        raise ValueError("Unknown VAPID key format")
+    data = base64.b64decode(value[len(FORMAT_PREFIX):])
+    try:
+        plaintext = AESGCM(get_encryption_key()).decrypt(data[:12], data[12:], ASSOCIATED_DATA)
+    except Exception:
+        raise ValueError("VAPID private key cannot be decrypted (VAPID_ENCRYPTION_KEY changed?)")
+    return plaintext.decode("ascii")
+
+
+def create_key_set(name, subject, private_key=None):
+    """
+    Store a VAPID key set.
+
+    Args:
+        name: Tenant name
+        subject: VAPID "sub" claim, e.g. mailto:push@example.com
+        private_key: Existing private key (PEM, DER or raw, as accepted for
+            VAPID_PRIVATE_KEY); a new key pair is generated if omitted
+
+    Returns:
+        VapidKeySet: The stored key set
+
+    Raises:
+        ValueError: If the key or subject is invalid
+    """
+    if not subject.startswith(("mailto:", "https://")):
+        raise ValueError("subject must be a mailto: or https: URL")
+    if private_key is None:
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        from py_vapid import Vapid
+        key = Vapid.from_string(private_key=private_key).private_key
+    raw = encode_key(key.private_numbers().private_value.to_bytes(32, "big"))
+    public_key = encode_key(key.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint,
+    ))
+    return VapidKeySet.objects.create(
+        name=name,
+        subject=subject,
+        public_key=public_key,
+        private_key_encrypted=encrypt_private_key(raw),
+    )
+
+
+def load_key_set(key_set_id):
+    """
+    Load and decrypt a key set.
+
+    Returns:
+        tuple: (raw base64url private key, subject)
+
+    Raises:
+        ValueError: If the key set does not exist or cannot be decrypted
+    """
+    key_set = VapidKeySet.objects.filter(pk=key_set_id).values("private_key_encrypted", "subject").first()
+    if key_set is None:
+        raise ValueError(f"VAPID key set {key_set_id} does not exist")
+    return decrypt_private_key(key_set["private_key_encrypted"]), key_set["subject"]
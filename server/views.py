@@ -1,29 +1,42 @@
 from django.shortcuts import render
 from rest_framework import generics, status
 from rest_framework.views import Response, APIView
-from utils.utils import resize_and_compress_image
-from .models import AdminToken
-import json, base64, uuid
-from pywebpush import webpush, WebPushException
-from decouple import config
-from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from .models import AdminToken, Campaign, Subscription, IconAsset, hash_endpoint
+from .segments import resolve_audience, SegmentError
+from .transfer import import_subscriptions, export_subscriptions, PARSERS
+from .records import SubscriptionRecord, load_records
+from .delivery_log import log_results
+from .icons import create_icon_asset, check_icon_upload, IconError
+from .tracking import record_event, tracking_enabled, tracking_overhead
+from .rollups import get_campaign_analytics
+from .quotas import check_send, get_limit, refund_send, reserve_send
+from django.core.signing import BadSignature
+import itertools, json, os, re, time
+from rest_framework.parsers import MultiPartParser, FormParser
+from .parsers import FastJSONParser, loads
+from .serializers import SubscriptionSerializer
+from django.http import FileResponse, StreamingHttpResponse
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta, timezone as dt_timezone
+
+# The send pipeline (push, fanout, campaigns) pulls in cryptography, requests
+# and py_vapid. It is imported by the views that send, not at module import,
+# so management commands and URL checks stay fast; serving processes load it
+# up front in ServerConfig.ready().
 
 # Allowed image formats
 ALLOWED_MIME_TYPES = ['image/jpeg', 'image/png', 'image/jpg']
 
-def convert_to_base64(file):
-    """Convert a file to base64 encoding for embedding in notification."""
-    try:
-        with file.open('rb') as f:
-            encoded_string = base64.b64encode(f.read()).decode("utf-8")
-        return f"data:{file.content_type};base64,{encoded_string}"
-    except Exception as e:
-        print(f"Error converting file to base64: {e}")
-        return None
-
-def prepare_notification_payload(title, body, url=None, icon=None):
-    """Prepare a consistent notification payload format."""
+def prepare_notification_payload(title, body, url=None, icon=None, icon_asset=None):
+    """
+    Prepare a consistent notification payload format.
+    
+    With an icon asset, the largest variant that keeps the payload within
+    PUSH_PAYLOAD_BUDGET is embedded; if none fits the icon is left out.
+    Room for the tracking field added at send time is kept free.
+    """
     payload = {
         "title": title,
         "body": body,
@@ -36,9 +49,112 @@ def prepare_notification_payload(title, body, url=None, icon=None):
     
     if icon:
         payload["icon"] = icon
+    elif icon_asset is not None:
+        # Bytes left for the data URI once the "icon" key is added
+        budget = settings.PUSH_PAYLOAD_BUDGET - len(json.dumps(payload).encode("utf-8")) - len(', "icon": ""')
+        if tracking_enabled():
+            budget -= tracking_overhead()
+        icon = icon_asset.choose_variant(budget)
+        if icon:
+            payload["icon"] = icon
         
     return json.dumps(payload)
 
+def quota_exceeded_response(ex):
+    """Return the 429 response for a send rejected by a token quota."""
+    headers = {"Retry-After": str(ex.retry_after)} if ex.retry_after else None
+    return Response({"error": str(ex)}, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=headers)
+
+def get_icon_asset(request, token):
+    """
+    Resolve the icon of a send request: an `icon` upload or an `icon_id`.
+    
+    Uploads are rendered into an IconAsset (or matched to an identical
+    existing one). Processing failures are logged and the notification is
+    sent without an icon.
+    
+    Returns:
+        tuple: (IconAsset or None, error dict or None)
+    """
+    icon = request.FILES.get("icon")
+    if icon:
+        # Validate icon mime type
+        if icon.content_type not in ALLOWED_MIME_TYPES:
+            return None, {"error": "Unsupported file type. Only JPEG and PNG are allowed."}
+        try:
+            check_icon_upload(icon)
+        except IconError as e:
+            return None, {"icon": str(e)}
+        try:
+            return create_icon_asset(icon, token), None
+        except Exception as e:
+            print(f"Error processing image: {e}")
+            # Continue without the icon if processing fails
+            return None, None
+    
+    icon_id = request.data.get("icon_id")
+    if icon_id:
+        # Only the token's own icons; other tenants' ids are not found
+        asset = IconAsset.objects.filter(pk=icon_id, admin_token=token).first() if str(icon_id).isdigit() else None
+        if asset is None:
+            return None, {"icon_id": "icon not found"}
+        return asset, None
+    return None, None
+
+def get_json_field(request, name, default):
+    """
+    Read a structured field of a send request.
+    
+    JSON bodies carry objects and arrays natively; multipart and form
+    bodies (needed for icon uploads) carry them as JSON-encoded strings.
+    
+    Raises:
+        json.JSONDecodeError: If a string value is not valid JSON
+    """
+    value = request.data.get(name, default)
+    if isinstance(value, (str, bytes)):
+        return loads(value)
+    return value
+
+def get_priority(request, default):
+    """
+    Read the priority lane of a send request.
+    
+    Returns:
+        int: Campaign.PRIORITY_* value, or None if the value is unknown
+    """
+    name = str(request.data.get("priority") or default).lower()
+    return Campaign.PRIORITY_NAMES.get(name)
+
+def get_expiry(request):
+    """
+    Read the TTL (seconds) and optional deadline (ISO 8601) of a send request.
+    
+    Returns:
+        tuple: (ttl, deadline datetime or None, error dict or None)
+    """
+    try:
+        ttl = int(request.data.get("ttl") or settings.PUSH_DEFAULT_TTL)
+        if ttl < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return None, None, {"ttl": "must be a non-negative number of seconds"}
+    
+    deadline = request.data.get("deadline")
+    if not deadline:
+        return ttl, None, None
+    try:
+        deadline = parse_datetime(str(deadline))
+    except ValueError:
+        deadline = None
+    if deadline is None:
+        return None, None, {"deadline": "must be an ISO 8601 datetime"}
+    if timezone.is_naive(deadline):
+        deadline = timezone.make_aware(deadline, dt_timezone.utc)
+    if deadline <= timezone.now():
+        return None, None, {"deadline": "has already passed"}
+    return ttl, deadline, None
+
 class GenerateAdminTokenView(APIView):
     def post(self, request):
         token = AdminToken.objects.create()
@@ -48,158 +164,530 @@ class GenerateAdminTokenView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 class SendSingleNotificationView(APIView):
-    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    parser_classes = (MultiPartParser, FormParser, FastJSONParser)
     
     def post(self, request):
+        from . import push
+        from .push import send_push
+        
         # Validate admin token
         admin_token = request.data.get("admin_token")
         if not admin_token:
             return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
         
-        if not AdminToken.objects.filter(token=admin_token).exists():
+        token = AdminToken.objects.filter(token=admin_token).first()
+        if not token:
             return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
         
         # Get notification parameters
         try:
-            subscription_info = json.loads(request.data.get("subscription_info", "{}"))
+            subscription_info = get_json_field(request, "subscription_info", "{}")
         except json.JSONDecodeError:
             return Response({"subscription_info": "invalid JSON format"}, status=status.HTTP_400_BAD_REQUEST)
         
         title = request.data.get('title')
         body = request.data.get("body")
         url = request.data.get("url")
-        icon = request.FILES.get("icon")
 
         # Validate required fields
         if not subscription_info:
             return Response({"subscription_info": "is a required field"}, status=status.HTTP_400_BAD_REQUEST)
         
+        # Decode the keys once, up front
+        try:
+            record = SubscriptionRecord.from_info(subscription_info)
+        except ValueError as ex:
+            return Response({"subscription_info": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        
         if not title or not body:
             return Response({"error": "Title and body are required fields"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Process icon if provided
-        icon_base64 = None
-        if icon:
-            # Validate icon mime type
-            if icon.content_type not in ALLOWED_MIME_TYPES:
-                return Response({
-                    "error": "Unsupported file type. Only JPEG and PNG are allowed."
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Resize and compress
-            try:
-                compressed_image = resize_and_compress_image(icon)
-                compressed_file = InMemoryUploadedFile(
-                    compressed_image,
-                    None,
-                    f"{uuid.uuid4()}.jpg",  # Unique name with jpg extension
-                    'image/jpeg',
-                    compressed_image.getbuffer().nbytes,
-                    None
-                )
-                icon_base64 = convert_to_base64(compressed_file)
-            except Exception as e:
-                print(f"Error processing image: {e}")
-                # Continue without the icon if processing fails
-        
-        # Prepare and send notification
-        payload = prepare_notification_payload(title, body, url, icon_base64)
+        # Icon: an uploaded file (rendered into an asset once) or an existing asset
+        icon_asset, icon_error = get_icon_asset(request, token)
+        if icon_error:
+            return Response(icon_error, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Single sends are transactional and go out inline on the high lane by default
+        priority = get_priority(request, default="high")
+        if priority is None:
+            return Response({"priority": "must be one of high, normal, bulk"}, status=status.HTTP_400_BAD_REQUEST)
         
+        ttl, deadline, expiry_error = get_expiry(request)
+        if expiry_error:
+            return Response(expiry_error, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Prepare notification; oversized payloads are rejected before counting against the quota
+        payload = prepare_notification_payload(title, body, url, icon_asset=icon_asset)
         try:
-            webpush(
-                subscription_info,
-                data=payload,
-                vapid_private_key=config("VAPID_PRIVATE_KEY"),
-                vapid_claims={"sub": config("VAPID_SUBJECT")}
-            )
-            return Response({"message": "Notification sent successfully"}, status=status.HTTP_200_OK)
-        except WebPushException as ex:
+            push.check_payload_size(payload)
+        except push.PayloadTooLarge as ex:
             return Response({"error": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        quota_error, reservation = reserve_send(token, 1)
+        if quota_error:
+            return quota_exceeded_response(quota_error)
+        
+        result = send_push(
+            record,
+            payload,
+            urgency=Campaign.PRIORITY_URGENCY[priority],
+            ttl=ttl,
+            deadline=deadline.timestamp() if deadline else None,
+            vapid_key_id=token.vapid_key_id,
+        )
+        log_results([record], [result])
+        
+        if result.outcome == push.SENT:
+            return Response({"message": "Notification sent successfully"}, status=status.HTTP_200_OK)
+        if result.outcome == push.DEFERRED:
+            # Nothing was attempted; the caller's retry is counted instead
+            refund_send(reservation)
+            # The push service is failing; tell the caller when to retry
+            return Response({"error": result.error}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={"Retry-After": str(settings.PUSH_BREAKER_RECOVERY)})
+        return Response({"error": result.error}, status=status.HTTP_400_BAD_REQUEST)
 
 class SendGroupNotificationView(APIView):
-    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    parser_classes = (MultiPartParser, FormParser, FastJSONParser)
     
     def post(self, request):
+        from . import push
+        from .campaigns import enqueue_campaign, enqueue_audience, iter_subscription_batches
+        from .fanout import (deliver_inline, simulate, new_dry_run_report, merge_dry_run_reports, summarize_dry_run,
+                             get_sample_step, scale_dry_run_report)
+        
         # Validate admin token
         admin_token = request.data.get("admin_token")
         if not admin_token:
             return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
         
-        if not AdminToken.objects.filter(token=admin_token).exists():
+        token = AdminToken.objects.filter(token=admin_token).first()
+        if not token:
             return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # Get notification parameters
-        try:
-            subscription_list_str = request.data.get("subscription_info_list", "[]")
-            subscription_info_list = json.loads(subscription_list_str)
-            
-            if not isinstance(subscription_info_list, list) or not subscription_info_list:
+        # Get notification parameters: an explicit subscription list, an
+        # audience expression over stored subscriptions or a django-webpush group
+        audience = request.data.get("audience")
+        webpush_group = request.data.get("webpush_group")
+        subscription_info_list = []
+        if webpush_group and not audience:
+            # django-webpush subscriptions belong to the site, not to a tenant
+            from .webpush_bridge import get_webpush_subscription_infos, get_webpush_admin_token
+            webpush_token = get_webpush_admin_token()
+            if webpush_token is None or webpush_token.pk != token.pk:
+                return Response({"webpush_group": "only WEBPUSH_ADMIN_TOKEN can target webpush groups"},
+                                status=status.HTTP_403_FORBIDDEN)
+            subscription_info_list = get_webpush_subscription_infos(group_name=webpush_group)
+            if not subscription_info_list:
+                return Response({"webpush_group": "group has no subscriptions"}, status=status.HTTP_400_BAD_REQUEST)
+        elif not audience:
+            try:
+                subscription_info_list = get_json_field(request, "subscription_info_list", "[]")
+                
+                if not isinstance(subscription_info_list, list) or not subscription_info_list:
+                    return Response({
+                        "subscription_info_list": "Must be a non-empty list"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            except json.JSONDecodeError:
                 return Response({
-                    "subscription_info_list": "Must be a non-empty list"
+                    "subscription_info_list": "Invalid JSON format"
                 }, status=status.HTTP_400_BAD_REQUEST)
-        except json.JSONDecodeError:
-            return Response({
-                "subscription_info_list": "Invalid JSON format"
-            }, status=status.HTTP_400_BAD_REQUEST)
         
         title = request.data.get("title")
         body = request.data.get("body")
         url = request.data.get("url")
-        icon = request.FILES.get("icon")
         
         # Validate required fields
         if not title or not body:
             return Response({"error": "Title and body are required fields"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Process icon if provided
-        icon_base64 = None
-        if icon:
-            # Validate icon mime type
-            if icon.content_type not in ALLOWED_MIME_TYPES:
-                return Response({
-                    "error": "Unsupported file type. Only JPEG and PNG are allowed."
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Resize and compress
-            try:
-                compressed_image = resize_and_compress_image(icon)
-                compressed_file = InMemoryUploadedFile(
-                    compressed_image,
-                    None,
-                    f"{uuid.uuid4()}.jpg",  # Unique name with jpg extension
-                    'image/jpeg',
-                    compressed_image.getbuffer().nbytes,
-                    None
-                )
-                icon_base64 = convert_to_base64(compressed_file)
-            except Exception as e:
-                print(f"Error processing image: {e}")
-                # Continue without the icon if processing fails
+        priority = get_priority(request, default="normal")
+        if priority is None:
+            return Response({"priority": "must be one of high, normal, bulk"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        ttl, deadline, expiry_error = get_expiry(request)
+        if expiry_error:
+            return Response(expiry_error, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Icon: an uploaded file (rendered into an asset once) or an existing asset
+        icon_asset, icon_error = get_icon_asset(request, token)
+        if icon_error:
+            return Response(icon_error, status=status.HTTP_400_BAD_REQUEST)
         
         # Prepare notification payload
-        payload = prepare_notification_payload(title, body, url, icon_base64)
+        payload = prepare_notification_payload(title, body, url, icon_asset=icon_asset)
+        try:
+            push.check_payload_size(payload, tracking=tracking_enabled())
+        except push.PayloadTooLarge as ex:
+            return Response({"error": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        dry_run = str(request.data.get("dry_run", "")).lower() in ("1", "true", "yes")
+        send_options = {"urgency": Campaign.PRIORITY_URGENCY[priority], "ttl": ttl, "vapid_key_id": token.vapid_key_id}
+        
+        # Audience campaigns are resolved from the segment indexes and always queued
+        if audience:
+            try:
+                total, subscription_ids = resolve_audience(audience, token.pk, vapid_key_id=token.vapid_key_id)
+            except SegmentError as ex:
+                return Response({"audience": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            if dry_run:
+                # Encrypt for an evenly spread sample and extrapolate, so
+                # the request stays short however large the audience is
+                started = time.perf_counter()
+                report = new_dry_run_report()
+                sample = itertools.islice(subscription_ids, 0, None, get_sample_step(total))
+                for batch in iter_subscription_batches(sample):
+                    merge_dry_run_reports(report, simulate(batch, payload, **send_options))
+                scale_dry_run_report(report, total)
+                return Response(summarize_dry_run(report, payload, time.perf_counter() - started, token=token), status=status.HTTP_200_OK)
+            
+            quota_error = check_send(token, total)
+            if quota_error:
+                return quota_exceeded_response(quota_error)
+            
+            campaign = enqueue_audience(
+                payload, subscription_ids, total, admin_token=token,
+                priority=priority, ttl=ttl, deadline=deadline, icon_asset=icon_asset,
+            )
+            return Response({
+                "campaign_id": campaign.pk,
+                "total": campaign.total,
+                "chunks": campaign.chunks.count(),
+            }, status=status.HTTP_202_ACCEPTED)
+        
+        # Dry run: everything but the network requests, nothing is queued
+        if dry_run:
+            started = time.perf_counter()
+            sample = subscription_info_list[::get_sample_step(len(subscription_info_list))]
+            report = scale_dry_run_report(simulate(load_records(sample), payload, **send_options),
+                                          len(subscription_info_list))
+            return Response(summarize_dry_run(report, payload, time.perf_counter() - started, token=token), status=status.HTTP_200_OK)
+        
+        quota_error = check_send(token, len(subscription_info_list))
+        if quota_error:
+            return quota_exceeded_response(quota_error)
+        
+        # Queue the campaign for the send workers instead of sending inline.
+        # Bulk and large campaigns are always queued so they never hold a request worker.
+        if str(request.data.get("queue", "")).lower() in ("1", "true", "yes") or priority == Campaign.PRIORITY_BULK \
+                or len(subscription_info_list) > settings.SEND_INLINE_MAX_RECIPIENTS:
+            campaign = enqueue_campaign(
+                payload, subscription_info_list, admin_token=token,
+                priority=priority, ttl=ttl, deadline=deadline, icon_asset=icon_asset,
+            )
+            return Response({
+                "campaign_id": campaign.pk,
+                "total": campaign.total,
+                "chunks": campaign.chunks.count(),
+            }, status=status.HTTP_202_ACCEPTED)
         
         # Send to all subscriptions
         errors = []
         successes = []
+        expired = []
+        deferred = []
         
-        for subscription_info in subscription_info_list:
-            try:
-                webpush(
-                    subscription_info,
-                    data=payload,
-                    vapid_private_key=config("VAPID_PRIVATE_KEY"),
-                    vapid_claims={"sub": config("VAPID_SUBJECT")}
-                )
-                successes.append(subscription_info.get('endpoint', 'unknown'))
-            except WebPushException as ex:
-                errors.append(subscription_info.get('endpoint', 'unknown'))
-                print(f"Error sending to {subscription_info.get('endpoint', 'unknown')}: {str(ex)}")
+        records = load_records(subscription_info_list)
+        results = deliver_inline(
+            records,
+            payload,
+            deadline=deadline.timestamp() if deadline else None,
+            **send_options,
+        )
+        for subscription_info, result in zip(subscription_info_list, results):
+            endpoint = subscription_info.get('endpoint', 'unknown') if isinstance(subscription_info, dict) else 'unknown'
+            if result.outcome == push.SENT:
+                successes.append(endpoint)
+            elif result.outcome == push.EXPIRED:
+                expired.append(endpoint)
+            elif result.outcome == push.DEFERRED:
+                deferred.append(subscription_info)
+            else:
+                errors.append(endpoint)
+                print(f"Error sending to {endpoint}: {result.error}")
+        log_results(records, results)
+        
+        # Recipients of push services with an open circuit go to the retry queue
+        retry_campaign = None
+        if deferred:
+            retry_campaign = enqueue_campaign(
+                payload, deferred, admin_token=token,
+                priority=priority, ttl=ttl, deadline=deadline, icon_asset=icon_asset,
+                available_at=timezone.now() + timedelta(seconds=settings.PUSH_BREAKER_RECOVERY),
+            )
         
         return Response({
             'success': successes,
             'error': errors,
+            'expired': expired,
+            'deferred': [subscription_info.get('endpoint', 'unknown') for subscription_info in deferred],
             'total': len(subscription_info_list),
             'success_count': len(successes),
-            'error_count': len(errors)
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+            'error_count': len(errors),
+            'expired_count': len(expired),
+            'deferred_count': len(deferred),
+            'retry_campaign_id': retry_campaign.pk if retry_campaign else None,
+        }, status=status.HTTP_200_OK)
+
+class CampaignStatusView(APIView):
+    def get(self, request, pk):
+        from .campaigns import get_campaign_status
+        
+        # Validate admin token
+        admin_token = request.query_params.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        campaign = Campaign.objects.filter(pk=pk, admin_token__token=admin_token).first()
+        if not campaign:
+            return Response({"error": "campaign not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response(get_campaign_status(campaign), status=status.HTTP_200_OK)
+
+
+class CampaignAnalyticsView(APIView):
+    def get(self, request, pk):
+        # Validate admin token
+        admin_token = request.query_params.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        group_by = request.query_params.get("group_by") or None
+        if group_by not in (None, "origin", "bucket"):
+            return Response({"group_by": "must be origin or bucket"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        campaign = Campaign.objects.filter(pk=pk, admin_token__token=admin_token).first()
+        if not campaign:
+            return Response({"error": "campaign not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response(get_campaign_analytics(campaign, group_by), status=status.HTTP_200_OK)
+
+
+class VapidPublicKeyView(APIView):
+    def get(self, request):
+        # Validate admin token
+        admin_token = request.query_params.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        token = AdminToken.objects.select_related("vapid_key").filter(token=admin_token).first()
+        if not token:
+            return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        # The applicationServerKey the token's subscribers must subscribe with
+        if token.vapid_key:
+            return Response({"public_key": token.vapid_key.public_key, "key_set": token.vapid_key.name},
+                            status=status.HTTP_200_OK)
+        return Response({"public_key": settings.WEBPUSH_SETTINGS["VAPID_PUBLIC_KEY"], "key_set": None},
+                        status=status.HTTP_200_OK)
+
+
+class ProfileDownloadView(APIView):
+    def get(self, request, profile_id):
+        from .profiling import get_profile_path
+        
+        # Validate admin token
+        admin_token = request.query_params.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        token = AdminToken.objects.filter(token=admin_token).first()
+        if not token:
+            return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        # Ids are generated hex UUIDs; anything else must not reach the filesystem.
+        # Profiles of other tokens are stored under another name and are not found.
+        path = get_profile_path(profile_id, token.pk) if re.fullmatch(r"[0-9a-f]{32}", profile_id) else None
+        if path is None or not os.path.exists(path):
+            return Response({"error": "profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        # pstats format: python -m pstats <file>, or snakeviz
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=f"{profile_id}.prof")
+
+
+class TokenUsageView(APIView):
+    def get(self, request):
+        # Validate admin token
+        admin_token = request.query_params.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        token = AdminToken.objects.filter(token=admin_token).first()
+        if not token:
+            return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        try:
+            days = min(max(int(request.query_params.get("days", 30)), 1), 366)
+        except ValueError:
+            return Response({"days": "must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Usage is flushed every USAGE_FLUSH_SECONDS, so the current day lags slightly
+        since = timezone.now().date() - timedelta(days=days - 1)
+        usage = token.usage.filter(day__gte=since).order_by("-day").values("day", "requests", "messages", "rejected")
+        return Response({
+            # 0 means unlimited
+            "quotas": {
+                "messages_per_minute": get_limit(token, "messages_per_minute", "QUOTA_MESSAGES_PER_MINUTE"),
+                "messages_per_day": get_limit(token, "messages_per_day", "QUOTA_MESSAGES_PER_DAY"),
+                "max_group_size": get_limit(token, "max_group_size", "QUOTA_MAX_GROUP_SIZE"),
+            },
+            "usage": list(usage),
+        }, status=status.HTTP_200_OK)
+
+
+class RegisterSubscriptionView(APIView):
+    parser_classes = (FastJSONParser,)
+    
+    def post(self, request):
+        # Validate admin token
+        admin_token = request.data.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        token = AdminToken.objects.filter(token=admin_token).first()
+        if not token:
+            return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        serializer = SubscriptionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        # Registering an endpoint again updates its keys and targeting data,
+        # but only for the token that registered it
+        subscription = Subscription.objects.filter(endpoint_hash=hash_endpoint(data["endpoint"])).first()
+        if subscription is None:
+            subscription = Subscription(endpoint=data["endpoint"], admin_token=token, vapid_key_id=token.vapid_key_id)
+        elif subscription.admin_token_id != token.pk:
+            return Response({"endpoint": "endpoint is registered with another admin token"},
+                            status=status.HTTP_409_CONFLICT)
+        subscription.p256dh = data["keys"]["p256dh"]
+        subscription.auth = data["keys"]["auth"]
+        subscription.tags = data.get("tags", [])
+        subscription.attributes = data.get("attributes", {})
+        subscription.is_active = True
+        subscription.last_active_at = timezone.now()
+        subscription.save()
+        
+        return Response({"id": subscription.pk, "vendor": subscription.vendor}, status=status.HTTP_201_CREATED)
+
+
+class ImportSubscriptionsView(APIView):
+    # The body is streamed line by line, never parsed as a whole
+    parser_classes = ()
+    
+    def post(self, request):
+        # Validate admin token
+        admin_token = request.query_params.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        token = AdminToken.objects.filter(token=admin_token).first()
+        if not token:
+            return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        format = request.query_params.get("format", "ndjson")
+        if format not in PARSERS:
+            return Response({"format": "must be ndjson or csv"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Keys are validated in a pool of SEND_PROCESSES processes kept apart from the send lanes
+        from .fanout import get_pool, resolve_process_count
+        processes = resolve_process_count()
+        report = import_subscriptions(
+            request._request,
+            format=format,
+            batch_size=settings.IMPORT_BATCH_SIZE,
+            update=request.query_params.get("skip_existing", "").lower() not in ("1", "true", "yes"),
+            pool=get_pool(processes, lane="import") if processes > 1 else None,
+            processes=processes,
+            admin_token=token,
+        )
+        return Response(report, status=status.HTTP_200_OK)
+
+class ExportSubscriptionsView(APIView):
+    def get(self, request):
+        # Validate admin token
+        admin_token = request.query_params.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        token = AdminToken.objects.filter(token=admin_token).first()
+        if not token:
+            return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        format = request.query_params.get("format", "ndjson")
+        if format not in PARSERS:
+            return Response({"format": "must be ndjson or csv"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Only the token's own subscriptions (they include the encryption keys)
+        active_only = request.query_params.get("active_only", "").lower() in ("1", "true", "yes")
+        response = StreamingHttpResponse(
+            export_subscriptions(format, active_only=active_only, admin_token=token),
+            content_type="text/csv" if format == "csv" else "application/x-ndjson",
+        )
+        response["Content-Disposition"] = f'attachment; filename="subscriptions.{format}"'
+        return response
+
+
+class IconUploadView(APIView):
+    parser_classes = (MultiPartParser, FormParser)
+    
+    def post(self, request):
+        # Validate admin token
+        admin_token = request.data.get("admin_token")
+        if not admin_token:
+            return Response({"admin_token": "required field"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        token = AdminToken.objects.filter(token=admin_token).first()
+        if not token:
+            return Response({"admin_token": "admin_token is invalid"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        icon = request.FILES.get("icon")
+        if not icon:
+            return Response({"icon": "is a required field"}, status=status.HTTP_400_BAD_REQUEST)
+        if icon.content_type not in ALLOWED_MIME_TYPES:
+            return Response({
+                "error": "Unsupported file type. Only JPEG and PNG are allowed."
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            asset = create_icon_asset(icon, token)
+        except IconError as e:
+            return Response({"icon": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            "id": asset.pk,
+            "width": asset.width,
+            "height": asset.height,
+            "variants": [
+                {"size": variant["size"], "format": variant["format"], "bytes": len(variant["uri"])}
+                for variant in asset.variants
+            ],
+        }, status=status.HTTP_201_CREATED)
+
+
+class TrackEventView(APIView):
+    """
+    Display and click pings from service workers.
+    
+    Public: the signed token in the payload's tracking field identifies the
+    campaign and subscription. Events are only counted in memory here.
+    """
+    authentication_classes = ()
+    permission_classes = ()
+    parser_classes = (FastJSONParser,)
+    
+    def post(self, request):
+        token = request.data.get("token")
+        event = request.data.get("event")
+        if not isinstance(token, str) or not isinstance(event, str):
+            return Response({"error": "token and event are required"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            record_event(token, event)
+        except BadSignature:
+            return Response({"error": "invalid token"}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as ex:
+            return Response({"error": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,82 @@
+import logging
+import os
+import sys
+import time
+from importlib import import_module
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Programs and manage.py commands that serve requests or send notifications
+SERVER_PROGRAMS = ("gunicorn", "uwsgi", "daphne", "uvicorn")
+SERVING_COMMANDS = ("runserver", "run_send_worker")
+
+# Push service origins most subscriptions belong to; their VAPID JWTs are
+# signed ahead of the first send
+COMMON_PUSH_ORIGINS = (
+    "https://fcm.googleapis.com",
+    "https://updates.push.services.mozilla.com",
+    "https://web.push.apple.com",
+)
+
+
+# Modules the views import lazily
+WARMUP_MODULES = ("server.push", "server.fanout", "server.campaigns")
+
+
+def is_serving_process(argv=None):
+    """
+    Return True if this process serves requests or sends notifications.
+    
+    Other management commands (migrate, shell, imports, ...) and the
+    runserver autoreloader's parent process are not warmed up.
+    """
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return False
+    program = os.path.basename(argv[0])
+    if any(name in program for name in SERVER_PROGRAMS):
+        return True
+    if len(argv) < 2 or argv[1] not in SERVING_COMMANDS:
+        return False
+    if argv[1] == "runserver":
+        return "--noreload" in argv or os.environ.get("RUN_MAIN") == "true"
+    return True
+
+
+def should_warm_up():
+    """Apply the SERVER_WARMUP setting (auto, always or never)."""
+    mode = settings.SERVER_WARMUP
+    if mode == "always":
+        return True
+    if mode == "never":
+        return False
+    return is_serving_process()
+
+
+def warm_up():
+    """
+    Load everything the first request would otherwise pay for.
+    
+    Imports the send pipeline and URL configuration, parses the VAPID
+    private key, signs VAPID JWTs for the common push services and loads
+    Pillow's image plugins. No database queries are made. Failures are
+    logged as warnings and ignored; the first request will retry the same
+    work. The duration is logged at debug level.
+    """
+    started = time.perf_counter()
+    try:
+        for module in WARMUP_MODULES + (settings.ROOT_URLCONF,):
+            import_module(module)
+        
+        from . import push
+        push.get_vapid()
+        for origin in COMMON_PUSH_ORIGINS:
+            push.get_vapid_headers(origin)
+        
+        from PIL import Image
+        Image.init()
+    except Exception as e:
+        logger.warning("Warm-up failed: %s", e)
+        return
+    logger.debug("Warm-up done in %.2fs", time.perf_counter() - started)
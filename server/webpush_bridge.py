@@ -0,0 +1,206 @@
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.utils import timezone
+from .models import AdminToken, Campaign
+
+# The send pipeline (push, fanout, campaigns) is imported by the functions
+# that send, so installing the bridge in ServerConfig.ready() stays cheap.
+
+
+def get_webpush_subscription_infos(group_name=None, user=None):
+    """
+    Load the subscriptions django-webpush stored for a group or a user.
+
+    Args:
+        group_name: webpush Group name
+        user: User (or user id) whose browsers to target
+
+    Returns:
+        list: Browser-format subscription_info dicts, one per endpoint
+    """
+    from webpush.models import PushInformation
+
+    queryset = PushInformation.objects.all()
+    if group_name is not None:
+        queryset = queryset.filter(group__name=group_name)
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    rows = queryset.values_list("subscription__endpoint", "subscription__p256dh", "subscription__auth").distinct()
+    return [{"endpoint": endpoint, "keys": {"p256dh": p256dh, "auth": auth}} for endpoint, p256dh, auth in rows]
+
+
+def _load_webpush_admin_token():
+    """Return (token or None, error message or None) for WEBPUSH_ADMIN_TOKEN."""
+    try:
+        token = AdminToken.objects.get(token=settings.WEBPUSH_ADMIN_TOKEN)
+    except (AdminToken.DoesNotExist, ValidationError):
+        return None, "WEBPUSH_ADMIN_TOKEN is not an existing admin token"
+    if token.vapid_key_id:
+        # django-webpush subscribes browsers with the default key
+        return None, "WEBPUSH_ADMIN_TOKEN must use the default VAPID key"
+    return token, None
+
+
+def check_webpush_admin_token():
+    """
+    Validate WEBPUSH_ADMIN_TOKEN; called once when a serving process starts.
+    
+    Raises:
+        ImproperlyConfigured: If the token does not exist or has its own key set
+    """
+    if not settings.WEBPUSH_ADMIN_TOKEN:
+        return
+    _, error = _load_webpush_admin_token()
+    if error:
+        raise ImproperlyConfigured(error)
+
+
+def get_webpush_admin_token():
+    """
+    Return the admin token django-webpush subscriptions belong to.
+    
+    Bridge sends are attributed to WEBPUSH_ADMIN_TOKEN and count against
+    its quotas, and it is the only token allowed to target webpush groups
+    from the API. The setting is validated at startup (see
+    check_webpush_admin_token); if the token was deleted or given a key set
+    since, this is reported and the token treated as unset, so a
+    notification never fails the request that triggered it.
+    
+    Returns:
+        AdminToken or None: The token, or None if WEBPUSH_ADMIN_TOKEN is empty or invalid
+    """
+    if not settings.WEBPUSH_ADMIN_TOKEN:
+        return None
+    token, error = _load_webpush_admin_token()
+    if error:
+        print(f"Error loading webpush admin token: {error}")
+    return token
+
+
+def delete_expired_subscription_infos(endpoints):
+    """
+    Delete django-webpush subscriptions whose push service answered 410 Gone.
+
+    django-webpush deleted them after each failed send; the delivery log
+    does it for the bridge when it flushes (see delivery_log), so expired
+    browsers are not sent to again.
+
+    Args:
+        endpoints: Endpoints of expired subscriptions
+
+    Returns:
+        int: Number of subscriptions deleted
+    """
+    from webpush.models import SubscriptionInfo
+
+    return SubscriptionInfo.objects.filter(endpoint__in=list(endpoints)).delete()[0]
+
+
+def send_to_subscription_infos(subscription_info_list, payload, ttl=0, queue=True, priority=Campaign.PRIORITY_NORMAL):
+    """
+    Send a payload through the server's pipeline instead of pywebpush.
+
+    Queued sends become a campaign for the send workers (pooled, with
+    deferred retries); inline sends are delivered concurrently in this
+    request and recipients of failing push services are queued for retry.
+    Sends are attributed to WEBPUSH_ADMIN_TOKEN and checked against its
+    quotas; without it they are unattributed and unlimited.
+
+    Args:
+        subscription_info_list: List of subscription_info dicts
+        payload: JSON-encoded payload
+        ttl: Web Push TTL in seconds
+        queue: Queue the send instead of delivering it inline (groups larger
+            than SEND_INLINE_MAX_RECIPIENTS are always queued)
+        priority: Priority lane (Campaign.PRIORITY_*)
+
+    Returns:
+        Campaign or list: The queued campaign, or a push.PushResult per recipient
+        
+    Raises:
+        push.PayloadTooLarge: If the payload does not fit in a push message
+        quotas.QuotaExceeded: If the send exceeds a quota of WEBPUSH_ADMIN_TOKEN
+    """
+    from . import push
+    from .campaigns import enqueue_campaign
+    from .fanout import deliver_inline
+    from .quotas import check_send
+    from .records import load_records
+    from .delivery_log import log_results
+    from .tracking import tracking_enabled
+
+    if not subscription_info_list:
+        return []
+    # Fail in the caller, like pywebpush, rather than once per recipient
+    push.check_payload_size(payload, tracking=tracking_enabled())
+    admin_token = get_webpush_admin_token()
+    if admin_token is not None:
+        quota_error = check_send(admin_token, len(subscription_info_list))
+        if quota_error:
+            raise quota_error
+    if queue or len(subscription_info_list) > settings.SEND_INLINE_MAX_RECIPIENTS:
+        return enqueue_campaign(payload, subscription_info_list, admin_token=admin_token, priority=priority, ttl=ttl)
+
+    records = load_records(subscription_info_list)
+    results = deliver_inline(records, payload, urgency=Campaign.PRIORITY_URGENCY[priority], ttl=ttl)
+    log_results(records, results)
+    deferred = [
+        subscription_info
+        for subscription_info, result in zip(subscription_info_list, results)
+        if result.outcome == push.DEFERRED
+    ]
+    if deferred:
+        enqueue_campaign(
+            payload, deferred, admin_token=admin_token, priority=priority, ttl=ttl,
+            available_at=timezone.now() + timedelta(seconds=settings.PUSH_BREAKER_RECOVERY),
+        )
+    return results
+
+
+def send_notification_to_group(group_name, payload, ttl=0, exclude_user_id=None):
+    """Drop-in for webpush.utils.send_notification_to_group: queues a campaign for the group."""
+    subscription_info_list = get_webpush_subscription_infos(group_name=group_name)
+    if exclude_user_id is not None:
+        from webpush.models import PushInformation
+        excluded = set(PushInformation.objects.filter(group__name=group_name, user_id=exclude_user_id)
+                       .values_list("subscription__endpoint", flat=True))
+        subscription_info_list = [info for info in subscription_info_list if info["endpoint"] not in excluded]
+    return send_to_subscription_infos(subscription_info_list, payload, ttl=ttl, queue=True)
+
+
+def send_notification_to_user(user, payload, ttl=0):
+    """Drop-in for webpush.utils.send_notification_to_user: delivers inline on the high lane."""
+    subscription_info_list = get_webpush_subscription_infos(user=user)
+    return send_to_subscription_infos(subscription_info_list, payload, ttl=ttl, queue=False,
+                                      priority=Campaign.PRIORITY_HIGH)
+
+
+def send_group_notification(group_name, payload, ttl=0, exclude_user_id=None):
+    """Drop-in for webpush.send_group_notification; like it, always JSON-encodes the payload."""
+    return send_notification_to_group(group_name, json.dumps(payload), ttl=ttl, exclude_user_id=exclude_user_id)
+
+
+def send_user_notification(user, payload, ttl=0):
+    """Drop-in for webpush.send_user_notification; like it, always JSON-encodes the payload."""
+    return send_notification_to_user(user, json.dumps(payload), ttl=ttl)
+
+
+def install():
+    """
+    Route django-webpush's send helpers through this pipeline.
+
+    Replaces webpush.send_group_notification / send_user_notification and
+    the webpush.utils functions behind them, so code written against
+    django-webpush sends with the pooled engine instead of looping over
+    pywebpush synchronously.
+    """
+    import webpush
+    from webpush import utils
+
+    webpush.send_group_notification = send_group_notification
+    webpush.send_user_notification = send_user_notification
+    # The utils variants take an already JSON-encoded payload
+    utils.send_notification_to_group = send_notification_to_group
+    utils.send_notification_to_user = send_notification_to_user
@@ -2,47 +2,63 @@ import json
 import re
 import os
 from io import BytesIO
-from PIL import Image
 from decouple import config
-from kavenegar import KavenegarAPI, APIException, HTTPException
 from rest_framework.exceptions import ValidationError
-from pywebpush import webpush, WebPushException
 
-# Configuration constants
-VAPID_CLAIMS = {
-    "sub": config("VAPID_SUBJECT"),
-}
-VAPID_PRIVATE_KEY = config("VAPID_PRIVATE_KEY")
+# Extra Pillow save options per icon format (smallest output, encoding speed matters less)
+ICON_FORMAT_OPTIONS = {"JPEG": {"optimize": True}, "WEBP": {"method": 6}}
 
-def resize_and_compress_image(image, max_size=(64, 64), quality=85):
+# Pillow, pywebpush and kavenegar are imported inside the functions that use
+# them, so importing this module (every process does) stays cheap
+
+def render_icon_variants(data, sizes=(64, 128, 192), formats=("JPEG", "WEBP"), quality=85,
+                         max_pixels=50_000_000):
     """
-    Resize and compress an image to optimize it for use as a notification icon.
+    Render an icon at several sizes and formats from a single decode.
+    
+    The image is decoded once (in draft mode for JPEGs, at the smallest scale
+    still at least twice the largest size) and every variant is resized
+    from that decoded image. Runs in the icon process pool.
     
     Args:
-        image: The uploaded image file
-        max_size: Maximum dimensions (width, height) for the resized image
-        quality: JPEG compression quality (0-100)
+        data: Encoded image bytes
+        sizes: Edge lengths in pixels; each variant fits in a size x size box
+        formats: Pillow format names to encode every size in
+        quality: Compression quality (0-100)
+        max_pixels: Largest accepted width x height (decompression bomb guard)
         
     Returns:
-        BytesIO: A buffer containing the compressed image
+        tuple: ((width, height) of the original, [(size, format, bytes), ...])
+        
+    Raises:
+        ValueError: If the image is too large or cannot be decoded
     """
+    from PIL import Image
+    
     try:
-        img = Image.open(image)
-        
-        # Maintain aspect ratio while resizing
-        img.thumbnail(max_size)
+        img = Image.open(BytesIO(data))
+        original_size = img.size
+        if img.width * img.height > max_pixels:
+            raise ValueError(f"{img.width}x{img.height} exceeds {max_pixels} pixels")
         
-        # Convert to RGB if necessary (e.g., PNG with transparency)
+        largest = max(sizes)
+        img.draft("RGB", (largest * 2, largest * 2))
+        img.load()
         if img.mode not in ("RGB", "L"):
             img = img.convert("RGB")
         
-        # Save to buffer with compression
-        output = BytesIO()
-        img.save(output, format="JPEG", quality=quality, optimize=True)
-        output.seek(0)
-        return output
+        variants = []
+        for size in sorted(sizes):
+            resized = img.copy()
+            resized.thumbnail((size, size))
+            for format in formats:
+                output = BytesIO()
+                resized.save(output, format=format, quality=quality, **ICON_FORMAT_OPTIONS.get(format, {}))
+                variants.append((size, format, output.getvalue()))
+        return original_size, variants
+    except ValueError:
+        raise
     except Exception as e:
-        print(f"Error processing image: {e}")
         raise ValueError(f"Failed to process image: {str(e)}")
 
 def send_web_push(subscription_info, message):
@@ -56,12 +72,14 @@ def send_web_push(subscription_info, message):
     Returns:
         dict: Result with success status and any error information
     """
+    from pywebpush import webpush, WebPushException
+    
     try:
         webpush(
             subscription_info=subscription_info,
             data=json.dumps(message),
-            vapid_private_key=VAPID_PRIVATE_KEY,
-            vapid_claims=VAPID_CLAIMS
+            vapid_private_key=config("VAPID_PRIVATE_KEY"),
+            vapid_claims={"sub": config("VAPID_SUBJECT")}
         )
         return {"success": True}
     except WebPushException as ex:
@@ -106,6 +124,8 @@ def send_otp(phone_number, otp_code):
     Returns:
         dict/str: API response or error message
     """
+    from kavenegar import KavenegarAPI, APIException, HTTPException
+    
     try:
         # Initialize Kavenegar API with the API key
         api = KavenegarAPI(config("KAVENEGAR_API"))
@@ -129,4 +149,44 @@ def send_otp(phone_number, otp_code):
         return {"success": False, "error": str(e)}
     except Exception as e:
         print(f"Unexpected error in OTP sending: {str(e)}")
-        return {"success": False, "error": f"Unexpected error: {str(e)}"}
\ No newline at end of file
+        return {"success": False, "error": f"Unexpected error: {str(e)}"}
+
+# Cache backends that keep their data inside the current process
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+def is_shared_cache(alias="default"):
+    """
+    Check whether a cache is shared between processes.
+    
+    Invalidations and counters kept in a per-process cache (the LocMem
+    default) are only seen by the worker that wrote them.
+    
+    Returns:
+        bool: False for LocMemCache and DummyCache
+    """
+    from django.conf import settings
+    return settings.CACHES[alias]["BACKEND"] not in PROCESS_LOCAL_CACHES
+
+def create_process_pool(max_workers):
+    """
+    Create a process pool safe to start from a multi-threaded server.
+    
+    Processes are spawned, not forked: a fork copies the database
+    connections (and locks) of every thread of a gunicorn or send worker,
+    and the child closing its copies would close the parent's connections
+    too. The fresh interpreter runs django.setup() with the parent's settings.
+    
+    Returns:
+        ProcessPoolExecutor: The new pool
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import django
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=django.setup,
+    )